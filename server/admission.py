@@ -0,0 +1,254 @@
+"""
+Admission control for chat turns.
+
+A turn must hold a slot for as long as its pipeline runs. At most
+`max_active` turns run at once; further turns wait in a bounded queue that is
+served round-robin across clients, so one busy client cannot starve the
+others, and no client holds more than `max_active_per_client` slots.
+
+Turns on the same conversation run one at a time in arrival order, so a
+follow-up reads the history its predecessor wrote. With a shared lock backend
+this also holds across worker processes: each turn takes the conversation's
+lock in the backend and keeps it until the turn is written (`settle`), and a
+worker taking over a conversation from another one is told (`on_handoff`) so
+it can drop local state such as retriever indexes.
+
+Requests that cannot be queued, or wait longer than `max_queue_wait`, are
+rejected with AdmissionRejected, which the API turns into a 429.
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from config import CHAT_MAX_ACTIVE, CHAT_MAX_QUEUED, CHAT_MAX_QUEUE_WAIT, CHAT_MAX_ACTIVE_PER_CLIENT
+from config import CONVERSATION_LOCK_TTL, CONVERSATION_OWNER_TTL, SHARED_POLL_INTERVAL
+from metrics import REGISTRY
+
+ADMISSION_WAIT = REGISTRY.histogram("admission_wait_seconds", "Time chat turns waited for a slot")
+ADMISSION_REJECTED = REGISTRY.counter("admission_rejected_total", "Chat turns shed by admission control", ["reason"])
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Server busy ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A held slot; release() is idempotent."""
+
+    def __init__(self, controller: "AdmissionController", client_id: str, conversation_id: str,
+                 conversation_lock: asyncio.Lock, shared_token: Optional[str] = None):
+        self.controller = controller
+        self.client_id = client_id
+        self.conversation_id = conversation_id
+        self.conversation_lock = conversation_lock
+        self.shared_token = shared_token
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self, max_active: int = CHAT_MAX_ACTIVE, max_queued: int = CHAT_MAX_QUEUED,
+                 max_queue_wait: float = CHAT_MAX_QUEUE_WAIT,
+                 max_active_per_client: int = CHAT_MAX_ACTIVE_PER_CLIENT, lock_backend=None,
+                 settle: Optional[Callable[[str], Awaitable]] = None,
+                 on_handoff: Optional[Callable[[str], None]] = None):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_queue_wait = max_queue_wait
+        self.max_active_per_client = max_active_per_client
+        self.active = 0
+        self.active_by_client: Dict[str, int] = {}
+        # client -> waiting futures, in round-robin order of clients
+        self.waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.queued = 0
+        # conversation -> (lock, number of turns holding or waiting for it)
+        self.conversations: Dict[str, list] = {}
+        # Cross-worker serialization, only with a backend other processes see
+        self.lock_backend = lock_backend if lock_backend is not None and lock_backend.shared else None
+        self.settle = settle
+        self.on_handoff = on_handoff
+        self.worker_token = uuid.uuid4().hex.encode()
+        self._releasing = set()
+
+        self.admitted = 0
+        self.rejected = 0
+
+    async def acquire(self, client_id: str, conversation_id: str) -> Ticket:
+        """Waits for a slot. Raises AdmissionRejected when shedding load."""
+        started = time.perf_counter()
+        deadline = started + self.max_queue_wait
+        if self.queued >= self.max_queued:
+            self._reject("queue_full")
+
+        entry = self.conversations.setdefault(conversation_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        lock = entry[0]
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=max(0.0, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                self._reject("conversation_busy")
+            shared_token = None
+            try:
+                if self.lock_backend is not None:
+                    shared_token = await self._acquire_shared(conversation_id, deadline)
+                await self._acquire_slot(client_id, deadline)
+            except BaseException:
+                if shared_token is not None:
+                    self._schedule_shared_release(conversation_id, shared_token, settle=False)
+                lock.release()
+                raise
+        except BaseException:
+            self._forget_conversation(conversation_id)
+            raise
+
+        self.admitted += 1
+        ADMISSION_WAIT.observe(time.perf_counter() - started)
+        return Ticket(self, client_id, conversation_id, lock, shared_token)
+
+    async def _acquire_shared(self, conversation_id: str, deadline: float) -> Optional[str]:
+        """Takes the conversation's lock in the shared backend, polling until
+        `deadline`. Backend errors let the turn through unserialized."""
+        lock = f"conversation:{conversation_id}"
+        while True:
+            try:
+                token = await self.lock_backend.acquire(lock, CONVERSATION_LOCK_TTL)
+            except Exception as e:
+                print(f"Conversation lock failed, continuing without it: {e}")
+                return None
+            if token is not None:
+                break
+            if time.perf_counter() >= deadline:
+                self._reject("conversation_busy")
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+        try:
+            owner = await self.lock_backend.get(f"conversation-owner:{conversation_id}")
+        except Exception:
+            owner = None
+        if owner != self.worker_token and self.on_handoff is not None:
+            self.on_handoff(conversation_id)
+        return token
+
+    def _schedule_shared_release(self, conversation_id: str, token: str, settle: bool):
+        task = asyncio.ensure_future(self._release_shared(conversation_id, token, settle))
+        self._releasing.add(task)
+        task.add_done_callback(self._releasing.discard)
+
+    async def _release_shared(self, conversation_id: str, token: str, settle: bool):
+        try:
+            if settle:
+                if self.settle is not None:
+                    # Hold the lock until the turn is written, so the next
+                    # turn reads it from whichever worker it lands on
+                    await self.settle(conversation_id)
+                await self.lock_backend.set(f"conversation-owner:{conversation_id}", self.worker_token,
+                                            CONVERSATION_OWNER_TTL)
+            await self.lock_backend.release(f"conversation:{conversation_id}", token)
+        except Exception as e:
+            print(f"Conversation lock release failed (expires in {CONVERSATION_LOCK_TTL:.0f}s): {e}")
+
+    async def _acquire_slot(self, client_id: str, deadline: float):
+        if not self.waiting and self._has_capacity(client_id):
+            self._grant(client_id)
+            return
+        if self.queued >= self.max_queued:
+            self._reject("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(client_id, deque()).append(future)
+        self.queued += 1
+        # Slots may be free for this client while others wait at their own limit
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(0.0, deadline - time.perf_counter()))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self._release_slot(client_id)
+            else:
+                future.cancel()
+                self._remove_waiter(client_id, future)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("queue_timeout")
+            raise
+
+    def _has_capacity(self, client_id: str) -> bool:
+        return (self.active < self.max_active
+                and self.active_by_client.get(client_id, 0) < self.max_active_per_client)
+
+    def _grant(self, client_id: str):
+        self.active += 1
+        self.active_by_client[client_id] = self.active_by_client.get(client_id, 0) + 1
+
+    def _release_slot(self, client_id: str):
+        self.active -= 1
+        count = self.active_by_client.get(client_id, 1) - 1
+        if count:
+            self.active_by_client[client_id] = count
+        else:
+            self.active_by_client.pop(client_id, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hands free slots to waiting turns, one client at a time."""
+        while self.waiting and self.active < self.max_active:
+            for client_id in self.waiting:
+                if self.active_by_client.get(client_id, 0) < self.max_active_per_client:
+                    break
+            else:
+                return  # Every waiting client is at its own limit
+            queue = self.waiting.pop(client_id)
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.waiting[client_id] = queue  # Back of the round-robin order
+            self._grant(client_id)
+            future.set_result(None)
+
+    def _remove_waiter(self, client_id: str, future: asyncio.Future):
+        queue = self.waiting.get(client_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self.waiting[client_id]
+
+    def _release(self, ticket: Ticket):
+        if ticket.shared_token is not None:
+            self._schedule_shared_release(ticket.conversation_id, ticket.shared_token, settle=True)
+        ticket.conversation_lock.release()
+        self._forget_conversation(ticket.conversation_id)
+        self._release_slot(ticket.client_id)
+
+    def _forget_conversation(self, conversation_id: str):
+        entry = self.conversations.get(conversation_id)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.conversations[conversation_id]
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        ADMISSION_REJECTED.inc(reason=reason)
+        raise AdmissionRejected(reason, retry_after=max(1.0, self.max_queue_wait / 2))
+
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "clients_waiting": len(self.waiting),
+            "conversations_active": len(self.conversations),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "max_active": self.max_active,
+            "max_queued": self.max_queued,
+        }
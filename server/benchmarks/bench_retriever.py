@@ -0,0 +1,123 @@
+"""
+Retrieval benchmark: local in-process index vs. Atlas $vectorSearch.
+
+Builds a synthetic conversation of N messages with random unit vectors and
+measures query latency and recall@k. Exact brute-force search is the ground
+truth. The HNSW path is measured when hnswlib is installed, and Atlas when
+--atlas is given (uses MONGODB_URI; inserts into a throwaway conversation
+and removes it afterwards).
+
+Usage (from the server directory):
+    python benchmarks/bench_retriever.py --messages 2000 --queries 200 [--atlas]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retriever as retriever_module  # noqa: E402
+from retriever import AtlasRetriever, ConversationIndex  # noqa: E402
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize(name, latencies, recalls):
+    print(f"{name:<8} p50={percentile(latencies, 50):8.3f}ms  p95={percentile(latencies, 95):8.3f}ms  "
+          f"p99={percentile(latencies, 99):8.3f}ms  recall@k={np.mean(recalls):.3f}")
+
+
+def make_messages(conversation_id, vectors):
+    return [{
+        "_id": f"{conversation_id}-{i}",
+        "conversation_id": conversation_id,
+        "role": "user",
+        "content": f"message {i}",
+        "timestamp": float(i),
+        "embedding": vectors[i].tolist(),
+    } for i in range(len(vectors))]
+
+
+def build_index(messages, dim, use_hnsw):
+    threshold = retriever_module.LOCAL_INDEX_HNSW_THRESHOLD
+    retriever_module.LOCAL_INDEX_HNSW_THRESHOLD = 1 if use_hnsw else float("inf")
+    try:
+        index = ConversationIndex(dim)
+        for message in messages:
+            index.add(message, np.asarray(message["embedding"], dtype=np.float32))
+        return index
+    finally:
+        retriever_module.LOCAL_INDEX_HNSW_THRESHOLD = threshold
+
+
+def run_local(name, index, queries, truth, k):
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = index.search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        recalls.append(len({r["_id"] for r in results} & expected) / k)
+    summarize(name, latencies, recalls)
+
+
+async def run_atlas(conversation_id, messages, queries, truth, k):
+    from database import conversations_collection
+    await conversations_collection.insert_many([dict(m) for m in messages])
+    try:
+        backend = AtlasRetriever()
+        # Atlas Search indexes are eventually consistent; wait for the new docs
+        for _ in range(60):
+            if len(await backend.search(conversation_id, queries[0].tolist(), k)) == k:
+                break
+            await asyncio.sleep(1)
+        latencies, recalls = [], []
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            results = await backend.search(conversation_id, query.tolist(), k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(len({r["_id"] for r in results} & expected) / k)
+        summarize("atlas", latencies, recalls)
+    finally:
+        await conversations_collection.delete_many({"conversation_id": conversation_id})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--atlas", action="store_true", help="also benchmark Atlas $vectorSearch")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = rng.standard_normal((args.messages, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    conversation_id = f"bench-{uuid.uuid4()}"
+    messages = make_messages(conversation_id, vectors)
+    top = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k]
+    truth = [{messages[i]["_id"] for i in row} for row in top]
+
+    print(f"{args.messages} messages, {args.queries} queries, dim={args.dim}, k={args.k}")
+    run_local("exact", build_index(messages, args.dim, use_hnsw=False), queries, truth, args.k)
+    if retriever_module.hnswlib is not None:
+        run_local("hnsw", build_index(messages, args.dim, use_hnsw=True), queries, truth, args.k)
+    else:
+        print("hnsw     skipped (hnswlib not installed)")
+    if args.atlas:
+        asyncio.run(run_atlas(conversation_id, messages, queries, truth, args.k))
+
+
+if __name__ == "__main__":
+    main()
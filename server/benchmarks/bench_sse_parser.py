@@ -0,0 +1,153 @@
+"""
+SSE parsing benchmark: byte-level parser vs. the previous aiter_lines path.
+
+Builds a synthetic OpenRouter stream (keep-alive comments, one delta per
+token, a final chunk with finish_reason and usage, [DONE]), cuts it into
+network-sized chunks and feeds it through an httpx.Response both ways:
+
+    lines   response.aiter_lines() + json.loads per line (previous path)
+    bytes   response.aiter_bytes() + SSEParser + parse_delta (orjson if installed)
+
+Both paths must produce the same text, usage and finish_reason.
+
+Usage (from the server directory):
+    python benchmarks/bench_sse_parser.py --tokens 2000 --streams 200 --chunk-size 1024
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sse_parser  # noqa: E402
+from sse_parser import DONE, SSEParser, parse_delta  # noqa: E402
+
+
+class ChunkStream(httpx.AsyncByteStream):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def build_stream(tokens: int, rng: random.Random) -> bytes:
+    words = ["the", "model", "streams", "tokens", "quickly", "über", "naïve", "数据", "\\n", "**bold**"]
+    events = [b": OPENROUTER PROCESSING\n\n"]
+    for i in range(tokens):
+        chunk = {
+            "id": "gen-123", "provider": "Moonshot", "model": "moonshotai/kimi-k2-thinking",
+            "object": "chat.completion.chunk", "created": 1700000000,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": rng.choice(words) + " "},
+                         "finish_reason": None, "native_finish_reason": None, "logprobs": None}],
+        }
+        events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        if i % 200 == 0:
+            events.append(b": OPENROUTER PROCESSING\n\n")
+    final = {
+        "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1200, "completion_tokens": tokens, "total_tokens": 1200 + tokens},
+    }
+    events.append(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+    events.append(b"data: [DONE]\n\n")
+    return b"".join(events)
+
+
+def split(body: bytes, chunk_size: int, rng: random.Random):
+    chunks, i = [], 0
+    while i < len(body):
+        size = rng.randint(max(1, chunk_size // 2), chunk_size * 3 // 2)
+        chunks.append(body[i:i + size])
+        i += size
+    return chunks
+
+
+async def parse_lines(chunks):
+    """The previous stream_chat_response loop."""
+    response = httpx.Response(200, stream=ChunkStream(chunks))
+    text, info = [], {}
+    async for line in response.aiter_lines():
+        if line.startswith("data: "):
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                break
+            try:
+                data = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            if data.get("usage"):
+                info["usage"] = data["usage"]
+            choices = data.get("choices") or [{}]
+            if choices[0].get("finish_reason"):
+                info["finish_reason"] = choices[0]["finish_reason"]
+            content = (choices[0].get("delta") or {}).get("content", "")
+            if content:
+                text.append(content)
+    return "".join(text), info
+
+
+async def parse_bytes(chunks):
+    """The current stream_chat_response loop."""
+    response = httpx.Response(200, stream=ChunkStream(chunks))
+    text, info = [], {}
+    parser = SSEParser()
+    async for chunk in response.aiter_bytes():
+        for data in parser.feed(chunk):
+            if data == DONE:
+                return "".join(text), info
+            delta = parse_delta(data)
+            if delta is None:
+                continue
+            if delta.usage:
+                info["usage"] = delta.usage
+            if delta.finish_reason:
+                info["finish_reason"] = delta.finish_reason
+            if delta.content:
+                text.append(delta.content)
+    return "".join(text), info
+
+
+async def measure(fn, streams):
+    started = time.perf_counter()
+    for chunks in streams:
+        await fn(chunks)
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=2000, help="tokens per stream")
+    parser.add_argument("--streams", type=int, default=100, help="streams per measurement")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="average network chunk size in bytes")
+    parser.add_argument("--repeat", type=int, default=3, help="measurements per path (best is reported)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    body = build_stream(args.tokens, rng)
+    streams = [split(body, args.chunk_size, rng) for _ in range(args.streams)]
+
+    expected = await parse_lines(streams[0])
+    for chunks in streams[:10]:
+        assert await parse_bytes(chunks) == expected, "parsers disagree"
+
+    total_tokens = args.tokens * args.streams
+    print(f"{args.streams} streams x {args.tokens} tokens, ~{args.chunk_size}B chunks, "
+          f"json backend: {'orjson' if sse_parser.orjson else 'json'}")
+    results = {}
+    for name, fn in (("lines", parse_lines), ("bytes", parse_bytes)):
+        best = min([await measure(fn, streams) for _ in range(args.repeat)])
+        results[name] = best
+        print(f"{name:<6} {best * 1000:9.1f}ms  {best / total_tokens * 1e6:7.2f}us/token  "
+              f"{total_tokens / best:12,.0f} tokens/s")
+    print(f"speedup: {results['lines'] / results['bytes']:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""
+Local stand-ins for the OpenRouter and Parallel APIs.
+
+One ASGI app serves both upstreams with configurable latency, so the chat
+pipeline can be exercised without network access or API spend:
+
+    POST /openrouter/chat/completions   streamed (SSE) or plain completions
+    POST /parallel/search               search results for each query
+
+Streamed completions wait `llm_latency` seconds, then emit `tokens` deltas
+at `token_rate` tokens/sec, a final chunk with finish_reason and usage,
+and [DONE], like OpenRouter does.
+
+Standalone usage (from the server directory):
+    python benchmarks/fake_upstreams.py --port 9100
+
+then start the server with
+    OPENROUTER_API_URL=http://127.0.0.1:9100/openrouter/chat/completions
+    PARALLEL_API_URL=http://127.0.0.1:9100/parallel/search
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+OPENROUTER_PATH = "/openrouter/chat/completions"
+PARALLEL_PATH = "/parallel/search"
+
+
+def create_app(tokens: int = 200, token_rate: float = 100.0, llm_latency: float = 0.3,
+               search_latency: float = 0.2, search_results: int = 10) -> FastAPI:
+    app = FastAPI(title="Fake upstreams")
+
+    @app.post(OPENROUTER_PATH)
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        prompt_tokens = sum(len(m.get("content", "")) for m in payload.get("messages", [])) // 4
+        await asyncio.sleep(llm_latency)
+
+        if not payload.get("stream"):
+            # Internal calls (query rewriting, fan-out, summaries)
+            query = payload["messages"][-1]["content"][:80]
+            content = "\n".join(f"{query} aspect {i}" for i in range(3))
+            return {
+                "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 30, "total_tokens": prompt_tokens + 30},
+            }
+
+        async def events():
+            interval = 1.0 / token_rate if token_rate > 0 else 0.0
+            for i in range(tokens):
+                chunk = {"choices": [{"index": 0, "delta": {"content": f"word{i} "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if interval:
+                    await asyncio.sleep(interval)
+            final = {
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                          "total_tokens": prompt_tokens + tokens},
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post(PARALLEL_PATH)
+    async def search(request: Request):
+        payload = await request.json()
+        queries = payload.get("search_queries", [])
+        per_query = max(1, payload.get("max_results", search_results) // max(len(queries), 1))
+        await asyncio.sleep(search_latency)
+        results = []
+        for query in queries:
+            slug = hashlib.sha1(query.encode("utf-8")).hexdigest()[:8]
+            for i in range(min(per_query, search_results)):
+                results.append({
+                    "url": f"https://example.com/{slug}/{i}",
+                    "title": f"Result {i} for {query[:40]}",
+                    "body": f"Synthetic excerpt {i} about {query}. " * 8,
+                })
+        return {"results": results}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per streamed answer")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="streamed tokens per second")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--search-latency", type=float, default=0.2, help="seconds per search request")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.tokens, args.token_rate, args.llm_latency, args.search_latency)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
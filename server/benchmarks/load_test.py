@@ -0,0 +1,333 @@
+"""
+End-to-end load test for /chat against local stand-ins for the upstreams.
+
+Boots `main.app` under uvicorn with OpenRouter and Parallel replaced by the
+fake servers in fake_upstreams.py, and MongoDB by mongomock (default) or a
+real mongod. It drives N concurrent /chat streams and reports:
+
+    ttft_ms                    request start to first answer token
+    latency_ms                 request start to end of stream
+    tokens_per_sec_per_stream  completion tokens / streaming time
+    aggregate_tokens_per_sec   completion tokens / wall time
+    event_loop_lag_ms          scheduling delay of the server's event loop
+
+The load generator runs on its own thread and event loop, so the loop lag
+reflects the server alone. Results are written as JSON. With --baseline the
+run fails (exit code 1) when a p95/p99 latency or throughput figure regresses
+by more than --max-regression against an earlier results file.
+
+Usage (from the server directory):
+    python benchmarks/load_test.py --concurrency 20 --requests 200 --output results.json
+    python benchmarks/load_test.py --mongo mongodb://localhost:27017 --fake-embeddings
+    python benchmarks/load_test.py --baseline results.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_upstreams import OPENROUTER_PATH, PARALLEL_PATH, create_app  # noqa: E402
+
+QUERIES = [
+    "What is retrieval augmented generation?",
+    "How do vector databases index embeddings?",
+    "Compare HTTP/2 and HTTP/1.1 for streaming APIs",
+    "What changed in the latest Python release?",
+    "Explain reciprocal rank fusion",
+    "How does it handle deletes?",
+    "Why is that faster?",
+    "Summarize the trade-offs",
+]
+
+# (result key, statistic, True when higher is better) checked against --baseline
+REGRESSION_CHECKS = [
+    ("ttft_ms", "p95", False),
+    ("latency_ms", "p95", False),
+    ("event_loop_lag_ms", "p99", False),
+    ("aggregate_tokens_per_sec", None, True),
+]
+
+
+class HashEmbedding:
+    """Deterministic stand-in for fastembed.TextEmbedding (no model download,
+    no ONNX time), for measuring the service itself."""
+
+    def __init__(self, model_name=None, dim: int = 384, **kwargs):
+        self.dim = dim
+
+    def embed(self, texts, batch_size=None, **kwargs):
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+            yield np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def stats(values) -> dict:
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def configure_environment(args, upstream_port: int):
+    base = f"http://127.0.0.1:{upstream_port}"
+    os.environ["OPENROUTER_API_URL"] = base + OPENROUTER_PATH
+    os.environ["PARALLEL_API_URL"] = base + PARALLEL_PATH
+    os.environ["OPENROUTER_API_KEY"] = "load-test"
+    os.environ["PARALLEL_API_KEY"] = "load-test"
+
+    if args.mongo == "mongomock":
+        try:
+            import mongomock_motor
+        except ImportError:
+            sys.exit("mongomock-motor is not installed; pip install mongomock-motor or pass --mongo <uri>")
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    else:
+        os.environ["MONGODB_URI"] = args.mongo
+
+    if args.fake_embeddings:
+        import fastembed
+        fastembed.TextEmbedding = HashEmbedding
+
+
+def start_upstreams(args, port: int):
+    import uvicorn
+    app = create_app(args.tokens, args.token_rate, args.llm_latency, args.search_latency)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread
+
+
+async def run_stream(client, url: str, query: str, conversation_id: str, client_id: str) -> dict:
+    started = time.perf_counter()
+    result = {"ok": False, "ttft": None, "first_token": None, "last_token": None,
+              "completion_tokens": 0, "error": None}
+    try:
+        payload = {"query": query, "conversation_id": conversation_id, "stream_format": "ndjson"}
+        headers = {"X-Client-Id": client_id}
+        async with client.stream("POST", url, json=payload, headers=headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}"
+            else:
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    now = time.perf_counter()
+                    if event["type"] == "token":
+                        if result["first_token"] is None:
+                            result["first_token"] = now
+                            result["ttft"] = now - started
+                        result["last_token"] = now
+                    elif event["type"] == "usage":
+                        result["completion_tokens"] = (event.get("usage") or {}).get("completion_tokens") or 0
+                    elif event["type"] == "error":
+                        result["error"] = event["message"]
+                result["ok"] = result["error"] is None and result["first_token"] is not None
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency"] = time.perf_counter() - started
+    return result
+
+
+async def generate_load(args, url: str) -> dict:
+    import httpx
+
+    results = []
+    remaining = {"warmup": args.warmup, "measured": args.requests}
+    measured_started = []
+
+    async def worker(worker_id: int):
+        conversation_id, turns = None, 0
+        while True:
+            if remaining["warmup"] > 0:
+                remaining["warmup"] -= 1
+                measured = False
+            elif remaining["measured"] > 0:
+                remaining["measured"] -= 1
+                measured = True
+                if not measured_started:
+                    measured_started.append(time.perf_counter())
+            else:
+                return
+            if conversation_id is None or turns >= args.turns:
+                conversation_id, turns = str(uuid.uuid4()), 0
+            query = QUERIES[(worker_id + turns) % len(QUERIES)]
+            # Each worker is a separate client for admission control's fair sharing
+            result = await run_stream(client, url, query, conversation_id, f"load-test-{worker_id}")
+            turns += 1
+            if measured:
+                results.append(result)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=120.0, limits=limits) as client:
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    # Wall time of the measured requests; warm-up requests still in flight overlap it
+    wall = time.perf_counter() - measured_started[0] if measured_started else 0.0
+    return {"results": results, "wall": wall}
+
+
+async def monitor_loop_lag(interval: float, samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval) * 1000)
+
+
+async def run(args) -> dict:
+    import uvicorn
+
+    upstream_port, app_port = free_port(), free_port()
+    configure_environment(args, upstream_port)
+    upstreams, upstream_thread = start_upstreams(args, upstream_port)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+        import main as app_module
+        server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=app_port, log_level="warning"))
+        serve_task = asyncio.create_task(server.serve())
+        while not server.started:
+            if serve_task.done():
+                serve_task.result()
+            await asyncio.sleep(0.01)
+
+        lag_samples = []
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(monitor_loop_lag(args.lag_interval, lag_samples, stop))
+        # Client on its own thread and loop so it does not add to the server's loop lag
+        load = await asyncio.to_thread(asyncio.run, generate_load(args, f"http://127.0.0.1:{app_port}/chat"))
+        stop.set()
+        await lag_task
+
+        server.should_exit = True
+        await serve_task
+    upstreams.should_exit = True
+    upstream_thread.join(timeout=5)
+
+    results, wall = load["results"], load["wall"]
+    ok = [r for r in results if r["ok"]]
+    per_stream_rates = [
+        r["completion_tokens"] / (r["last_token"] - r["first_token"])
+        for r in ok if r["completion_tokens"] and r["last_token"] > r["first_token"]
+    ]
+    return {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "requests": {"measured": len(results), "ok": len(ok), "errors": len(results) - len(ok)},
+        "wall_seconds": round(wall, 3),
+        "requests_per_sec": round(len(ok) / wall, 2) if wall else 0.0,
+        "ttft_ms": stats([r["ttft"] * 1000 for r in ok]),
+        "latency_ms": stats([r["latency"] * 1000 for r in ok]),
+        "tokens_per_sec_per_stream": stats(per_stream_rates),
+        "aggregate_tokens_per_sec": round(sum(r["completion_tokens"] for r in ok) / wall, 2) if wall else 0.0,
+        "event_loop_lag_ms": stats(lag_samples),
+        "sample_errors": sorted({r["error"] for r in results if r["error"]})[:5],
+    }
+
+
+def check_regressions(current: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for key, statistic, higher_is_better in REGRESSION_CHECKS:
+        old, new = baseline.get(key), current.get(key)
+        if statistic is not None:
+            old = (old or {}).get(statistic)
+            new = (new or {}).get(statistic)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -max_regression) or (not higher_is_better and change > max_regression):
+            name = f"{key}.{statistic}" if statistic else key
+            regressions.append(f"{name}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def print_summary(report: dict):
+    requests = report["requests"]
+    print(f"requests: {requests['ok']}/{requests['measured']} ok in {report['wall_seconds']}s "
+          f"({report['requests_per_sec']} req/s)")
+    for key in ("ttft_ms", "latency_ms", "tokens_per_sec_per_stream", "event_loop_lag_ms"):
+        s = report[key]
+        if s.get("count"):
+            print(f"{key:<26} p50={s['p50']:>9}  p95={s['p95']:>9}  p99={s['p99']:>9}  max={s['max']:>9}")
+    print(f"{'aggregate_tokens_per_sec':<26} {report['aggregate_tokens_per_sec']}")
+    for error in report["sample_errors"]:
+        print(f"error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent /chat streams")
+    parser.add_argument("--requests", type=int, default=100, help="measured requests")
+    parser.add_argument("--warmup", type=int, default=10, help="requests sent first and not measured")
+    parser.add_argument("--turns", type=int, default=4, help="turns per conversation before starting a new one")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per streamed answer")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="fake OpenRouter tokens per second")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake OpenRouter seconds to first byte")
+    parser.add_argument("--search-latency", type=float, default=0.2, help="fake Parallel seconds per request")
+    parser.add_argument("--mongo", default="mongomock", help='"mongomock" or a MongoDB URI')
+    parser.add_argument("--fake-embeddings", action="store_true", help="hash-based embeddings instead of fastembed")
+    parser.add_argument("--lag-interval", type=float, default=0.01, help="event loop lag probe interval (s)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="show server logs")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_summary(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = check_regressions(report, baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
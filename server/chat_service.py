@@ -1,58 +1,78 @@
-from prompts import get_system_prompt, get_contextualization_prompt
+import os
+import re
+import time
+from typing import List, Dict, Optional
 
-# ... (existing imports)
+from database import conversations_collection, conversations_meta_collection
+from search_client import search_parallel
+from llm_client import stream_chat_response, generate_chat_response, LLMError
+from prompts import get_system_prompt, get_contextualization_prompt, get_fanout_prompt
+from rank_fusion import reciprocal_rank_fusion
+from context_builder import assemble_messages, dedupe_messages
+from message_store import load_sources, render_user_content
+from persistence import PersistenceQueue
+from retriever import create_retriever
+from summarizer import SummaryScheduler, get_conversation_summary
+from config import LLM_MODEL, EMBEDDING_MODEL, SEARCH_RESULTS_LIMIT
+from config import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_DISK_MAX_ENTRIES, WORKER_ID
+from config import SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_SEMANTIC, SEARCH_CACHE_SEMANTIC_THRESHOLD, SEARCH_COST_PER_REQUEST
+from config import SEARCH_FANOUT_QUERIES
+from config import PIPELINE_BUDGET_SECONDS, STAGE_TIMEOUTS, REWRITE_SIMILARITY_THRESHOLD, REWRITE_PRECHECK
+from config import LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES
+from config import MESSAGE_STREAM_BATCH, PERSIST_READ_WAIT, TRACE_LOG
+from pipeline import PipelineRun
+import metrics
+from metrics import trace
+from embedding_service import EmbeddingService, load_embedding_model
+from embedding_cache import EmbeddingCache
+from search_cache import SearchCache
+from llm_cache import LLMResponseCache
+from shared_cache import SharedCache, create_backend
 
-# ... (inside contextualize_query)
-    messages = [
-        {"role": "system", "content": get_contextualization_prompt()},
-    ]
+# The disk tier has a single writer, so serve.py workers each get their own
+embedding_cache_dir = EMBEDDING_CACHE_DIR
+if embedding_cache_dir and WORKER_ID is not None:
+    embedding_cache_dir = os.path.join(embedding_cache_dir, f"worker-{WORKER_ID}")
 
-# ... (inside chat_pipeline)
-        # 4. Construct Messages for Final Generation
-        messages = [{"role": "system", "content": get_system_prompt()}]
-from search_client import search_parallel
-from llm_client import stream_chat_response, generate_chat_response
-from fastembed import TextEmbedding
-from prompts import get_system_prompt, get_contextualization_prompt
-from config import EMBEDDING_MODEL, SEARCH_RESULTS_LIMIT, MAX_CONTEXT_MESSAGES, SUMMARIZATION_THRESHOLD
+embedding_service = EmbeddingService(
+    load_embedding_model,
+    cache=EmbeddingCache(EMBEDDING_MODEL, EMBEDDING_CACHE_SIZE, embedding_cache_dir, EMBEDDING_CACHE_DISK_MAX_ENTRIES),
+)
+
+# State shared between server workers; process-local unless SHARED_BACKEND is "redis"
+shared_backend = create_backend()
+
+def shared_cache(namespace: str, ttl: float) -> Optional[SharedCache]:
+    # With the memory backend the caches' own LRU is already the shared tier
+    return SharedCache(shared_backend, namespace, ttl) if shared_backend.shared else None
 
-# Initialize embedding model (lightweight)
-embedding_model = TextEmbedding(model_name=EMBEDDING_MODEL)
+search_cache = SearchCache(
+    search_parallel,
+    ttl=SEARCH_CACHE_TTL,
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    cost_per_request=SEARCH_COST_PER_REQUEST,
+    embed_fn=embedding_service.embed,
+    semantic_threshold=SEARCH_CACHE_SEMANTIC_THRESHOLD if SEARCH_CACHE_SEMANTIC else None,
+    shared=shared_cache("search", SEARCH_CACHE_TTL),
+)
 
-from summarizer import summarize_conversation
+llm_cache = LLMResponseCache(generate_chat_response, LLM_MODEL, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES,
+                             shared=shared_cache("llm", LLM_CACHE_TTL))
 
-async def get_conversation_context(conversation_id: str, query: str) -> List[Dict]:
-    # 1. Try Vector Search first (if query is long enough to be semantic)
+persistence_queue = PersistenceQueue()
+
+retriever = create_retriever()
+persistence_queue.on_written.append(retriever.add_messages)
+
+summary_scheduler = SummaryScheduler(lock_backend=shared_backend)
+
+async def get_vector_context(conversation_id: str, query_embedding: List[float]) -> List[Dict]:
+    """Semantically similar past messages from the configured retriever."""
     context_messages = []
     
     try:
-        query_embedding = list(embedding_model.embed([query]))[0].tolist()
-        
-        # MongoDB Atlas Vector Search Pipeline
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "vector_index",
-                    "path": "embedding",
-                    "queryVector": query_embedding,
-                    "numCandidates": 100,
-                    "limit": 5,
-                    "filter": {"conversation_id": conversation_id}
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "role": 1,
-                    "content": 1,
-                    "timestamp": 1,
-                    "score": {"$meta": "vectorSearchScore"}
-                }
-            }
-        ]
-        
-        cursor = conversations_collection.aggregate(pipeline)
-        vector_results = await cursor.to_list(length=5)
+        with trace("retriever", retriever.name):
+            vector_results = await retriever.search(conversation_id, query_embedding, limit=5)
         
         if vector_results:
             print(f"Vector search found {len(vector_results)} relevant messages.")
@@ -63,29 +83,26 @@ async def get_conversation_context(conversation_id: str, query: str) -> List[Dic
             print("Vector search returned no results (index might be missing or empty). Falling back to recent.")
             
     except Exception as e:
-        print(f"Vector search failed (likely no index): {e}. Falling back to recent.")
+        print(f"Vector search failed: {e}. Falling back to recent.")
+
+    return context_messages
 
-    # 2. Fallback / Augment with Recent Messages
-    # Always fetch the last few messages for immediate context continuity
-    cursor = conversations_collection.find({"conversation_id": conversation_id}).sort("timestamp", -1).limit(5)
-    recent_messages = await cursor.to_list(length=5)
+async def get_recent_messages(conversation_id: str) -> List[Dict]:
+    """The last few messages, oldest first, for immediate context continuity."""
+    cursor = conversations_collection.find(
+        {"conversation_id": conversation_id, "type": {"$ne": "summary"}},
+        {"embedding": 0},
+    ).sort("timestamp", -1).limit(5)
+    with trace("mongo", "recent_messages"):
+        recent_messages = await cursor.to_list(length=5)
     recent_messages.reverse()
-    
-    # Merge and Deduplicate
-    # (Simple dedup by content/timestamp if needed, but for now just appending recent if not in vector)
-    # Actually, let's just use recent if vector failed, or combine them.
-    # A simple strategy: Use Recent + Vector.
-    
-    final_context = recent_messages
-    for msg in context_messages:
-        if msg not in final_context:
-            final_context.insert(0, msg) # Add vector matches to the beginning (background context)
+    return recent_messages
 
-    # 3. Check token count for summarization
-    total_chars = sum([len(m['content']) for m in final_context])
-    if total_chars / 4 > 25000:
-        # Trigger background summarization
-        asyncio.create_task(summarize_conversation(conversation_id, final_context))
+def merge_context(recent_messages: List[Dict], context_messages: List[Dict]) -> List[Dict]:
+    # Merge and deduplicate by message id; vector matches are background
+    # context, so keep everything in chronological order
+    final_context = dedupe_messages(recent_messages, context_messages)
+    final_context.sort(key=lambda m: m["timestamp"])
 
     return final_context
 
@@ -107,110 +124,380 @@ async def contextualize_query(query: str, history: List[Dict]) -> str:
     messages.append({"role": "user", "content": query})
     
     print(f"Contextualizing query: '{query}' with history length {len(recent_history)}")
-    new_query = await generate_chat_response(messages)
+    new_query = await llm_cache.generate(messages)
     
     # Cleanup response (remove quotes etc if model adds them)
     new_query = new_query.strip().strip('"').strip("'")
     print(f"Rewritten query: '{new_query}'")
     return new_query
 
+async def generate_search_queries(query: str, history: List[Dict], rewrite: bool = True) -> List[str]:
+    """Rewrites the user query into a standalone query plus fan-out sub-queries.
+    The first entry is always the standalone rewrite. With `rewrite=False` the
+    query already stands on its own: it is kept as typed and only the
+    sub-queries are generated."""
+    if not history:
+        rewrite = False  # Nothing to resolve against on a first turn
+    if SEARCH_FANOUT_QUERIES <= 1:
+        if not rewrite:
+            return [query]
+        return [await contextualize_query(query, history)]
+
+    messages = [
+        {"role": "system", "content": get_fanout_prompt(SEARCH_FANOUT_QUERIES)},
+    ]
+    # A standalone query needs no history, which also lets conversations
+    # share the cached response
+    for msg in (history[-3:] if rewrite else []):
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    messages.append({"role": "user", "content": query})
+
+    print(f"Generating search queries for: '{query}'")
+    response = await llm_cache.generate(messages)
+    if response.startswith("Error:"):
+        return [query]
+
+    lines = response.splitlines()
+    if not rewrite:
+        # The first line is the model's rewrite; keep the query as typed
+        lines = [query] + lines[1:]
+    queries, seen = [], set()
+    for line in lines:
+        line = re.sub(r"^\s*(?:[-*\u2022]|\d+[.)])\s*", "", line).strip().strip('"').strip("'")
+        if line and line.lower() not in seen:
+            seen.add(line.lower())
+            queries.append(line)
+    queries = queries[:SEARCH_FANOUT_QUERIES] or [query]
+    print(f"Search queries: {queries}")
+    return queries
+
+async def search_sub_queries(query: str) -> List[Dict]:
+    """Fan-out for a query searched as typed: generates sub-queries without
+    history and searches only those."""
+    sub_queries = (await generate_search_queries(query, [], rewrite=False))[1:]
+    if not sub_queries:
+        return []
+    return await search_cache.search(sub_queries)
+
+# Words that usually point back at earlier turns ("how does it compare?")
+REFERENCE_WORDS = {
+    "it", "its", "itself", "they", "them", "their", "theirs", "this", "that", "these", "those",
+    "he", "him", "his", "she", "her", "hers", "there", "then", "one", "ones", "same", "such",
+    "former", "latter", "above", "previous", "earlier", "aforementioned", "else", "other",
+    "another", "more", "also", "too", "again",
+}
+FOLLOW_UP_PREFIXES = ("and ", "or ", "but ", "so ", "what about", "how about", "why", "how come", "what else")
+
+def needs_rewrite(query: str, history: List[Dict]) -> bool:
+    """Cheap check for whether a query depends on earlier turns. Queries that
+    read as standalone skip the rewrite LLM call."""
+    if not history:
+        return False
+    words = re.findall(r"[a-z']+", query.lower())
+    if len(words) <= 3:
+        return True
+    if query.lower().lstrip().startswith(FOLLOW_UP_PREFIXES):
+        return True
+    return any(word in REFERENCE_WORDS for word in words)
+
+def _query_terms(text: str) -> set:
+    return set(re.findall(r"\w+", text.lower()))
+
+def is_meaningful_rewrite(original: str, rewritten: str) -> bool:
+    """True if the rewrite differs enough from the original to warrant its own search."""
+    a, b = _query_terms(original), _query_terms(rewritten)
+    if not a or not b:
+        return False
+    return len(a & b) / len(a | b) < REWRITE_SIMILARITY_THRESHOLD
+
 async def chat_pipeline(query: str, conversation_id: str):
+    """Runs one chat turn and yields typed events:
+
+        {"type": "sources", "search_query": str, "sources": [...]}
+        {"type": "token", "text": str}
+        {"type": "usage", "usage": {...}, "finish_reason": str}
+        {"type": "timings", ...}
+        {"type": "error", "message": str}
+    """
+    # The decision is passed along explicitly: every resumption of this
+    # generator may run in a different task
+    run = PipelineRun(PIPELINE_BUDGET_SECONDS, sampled=metrics.sample_request())
+    metrics.set_sampling(run.sampled)
     try:
-        # 1. Context Retrieval (Moved UP before search)
-        history = await get_conversation_context(conversation_id, query)
+        # 1. Start everything that only needs the raw query
+        # History lookups and a speculative search on the raw query run while
+        # we wait for the history needed to rewrite the query.
+        # The query is embedded once per turn and reused for persistence.
+        async def vector_stage():
+            query_embedding = await run.result("embed_query")
+            if query_embedding is None:
+                return []
+            return await get_vector_context(conversation_id, query_embedding)
+
+        run.start("embed_query", embedding_service.embed(query), timeout=STAGE_TIMEOUTS["embed_query"])
+        run.start("search_raw", search_cache.search(query), timeout=STAGE_TIMEOUTS["search"])
+        # The previous turn of this conversation may still be in the write queue
+        await persistence_queue.wait_written(conversation_id, timeout=STAGE_TIMEOUTS["recent_messages"])
+        run.start("vector_search", vector_stage(), timeout=STAGE_TIMEOUTS["vector_search"])
+        run.start("recent_messages", get_recent_messages(conversation_id), timeout=STAGE_TIMEOUTS["recent_messages"])
+        run.start("summary", get_conversation_summary(conversation_id), timeout=STAGE_TIMEOUTS["recent_messages"])
+
+        # 2. Context Retrieval
+        recent_messages = await run.result("recent_messages", default=[])
+        vector_messages = await run.result("vector_search", default=[])
+        summary = await run.result("summary", default=None) or {}
+        history = merge_context(recent_messages, vector_messages)
         
-        # 2. Contextualize Query
-        try:
-            search_query = await contextualize_query(query, history)
-            if not search_query:
-                print("Contextualization returned empty query, falling back to original.")
+        # 3. Contextualize Query (standalone rewrite plus fan-out sub-queries).
+        # A query that already stands on its own is not rewritten: search_raw
+        # already has it, and its sub-queries are generated and searched
+        # alongside, fused only if they arrive within the contextualize budget.
+        # A first turn has nothing to resolve and is always standalone
+        if history and (not REWRITE_PRECHECK or needs_rewrite(query, history)):
+            metrics.QUERY_REWRITES.inc(decision="llm")
+            run.start("contextualize", generate_search_queries(query, history), timeout=STAGE_TIMEOUTS["contextualize"])
+            search_queries = await run.result("contextualize", default=None)
+        elif SEARCH_FANOUT_QUERIES > 1:
+            metrics.QUERY_REWRITES.inc(decision="skipped_parallel_fanout")
+            run.start("search_fanout", search_sub_queries(query), timeout=STAGE_TIMEOUTS["contextualize"])
+            search_queries = [query]
+        else:
+            metrics.QUERY_REWRITES.inc(decision="skipped")
+            search_queries = [query]
+        if not search_queries:
+            print("Contextualization returned empty query, falling back to original.")
+            search_queries = [query]
+        search_query = search_queries[0]
+        rewritten = is_meaningful_rewrite(query, search_query)
+        
+        # 4. Search the rewrite and sub-queries in one batched call, and fuse
+        # with the raw-query results unless the rewrite replaced the query.
+        # Without a rewrite, search_raw already covers the first query
+        result_lists = []
+        if rewritten:
+            run.start("search_fanout", search_cache.search(search_queries), timeout=STAGE_TIMEOUTS["search"])
+        elif len(search_queries) > 1:
+            run.start("search_fanout", search_cache.search(search_queries[1:]), timeout=STAGE_TIMEOUTS["search"])
+        fanout_results = await run.result("search_fanout", default=[])
+        if fanout_results:
+            result_lists.append(fanout_results)
+        if rewritten and result_lists:
+            run.tasks["search_raw"].cancel()
+        else:
+            if rewritten:
                 search_query = query
-        except Exception as e:
-            print(f"Contextualization failed: {e}")
-            search_query = query
+            result_lists.insert(0, await run.result("search_raw", default=[]))
+        search_results = reciprocal_rank_fusion(result_lists, SEARCH_RESULTS_LIMIT)
+
+        run.cancel_pending()
         
-        # 3. Search (using rewritten query)
-        search_results = await search_parallel(search_query)
+        # 5. Construct Messages for Final Generation within the token budget
+        messages, prompt_report = assemble_messages(
+            LLM_MODEL,
+            get_system_prompt(),
+            query,
+            search_query,
+            search_results,
+            recent_messages,
+            vector_messages,
+            summary=summary.get("content"),
+            summary_covers_until=summary.get("covers_until"),
+        )
+        metrics.PROMPT_TOKENS.observe(prompt_report["total"])
         
-        # Format search results
-        search_context = "\n".join([f"[{i+1}] {res.get('title', 'Untitled')} ({res.get('url', '#')}): {res.get('body', '')[:300]}..." for i, res in enumerate(search_results)])
+        yield {
+            "type": "sources",
+            "search_query": search_query,
+            "sources": [{
+                "id": i + 1,
+                "title": res.get("title", "Untitled"),
+                "url": res.get("url", "#"),
+                "snippet": res.get("body", "")[:300],
+            } for i, res in enumerate(search_results)],
+        }
         
-        # 4. Construct Messages for Final Generation
-        messages = [{"role": "system", "content": get_system_prompt()}]
+        # 6. Stream & Persist
+        full_response = ""
+        stream_info = {}
+        generation_started = time.perf_counter()
+        first_token_ms = None
+        outcome = "ok"
+        try:
+            async for chunk in stream_chat_response(messages, stream_info, sampled=run.sampled):
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - run.started) * 1000, 1)
+                full_response += chunk
+                yield {"type": "token", "text": chunk}
+        except LLMError as e:
+            outcome = "llm_error"
+            yield {"type": "error", "message": str(e)}
+        generation_ms = round((time.perf_counter() - generation_started) * 1000, 1)
         
-        # Add history
-        for msg in history:
-            messages.append({"role": msg["role"], "content": msg["content"]})
+        yield {
+            "type": "usage",
+            "usage": stream_info.get("usage"),
+            "finish_reason": stream_info.get("finish_reason"),
+        }
+        timings = {
+            **run.report(),
+            "ttft_ms": first_token_ms,
+            "generation_ms": generation_ms,
+            "prompt": prompt_report,
+        }
+        yield {"type": "timings", **timings}
         
-        # Add current query with search context
-        user_content = f"Search Results (for query: '{search_query}'):\n{search_context}\n\nUser Query: {query}"
-        messages.append({"role": "user", "content": user_content})
+        metrics.record_pipeline(timings, run.sampled)
+        if first_token_ms is not None:
+            metrics.TTFT_SECONDS.observe(first_token_ms / 1000)
+            metrics.GENERATION_SECONDS.observe(generation_ms / 1000)
+        if TRACE_LOG and run.sampled:
+            print(f"Trace {conversation_id}: {timings}")
         
-        # 5. Stream & Persist
-        full_response = ""
-        async for chunk in stream_chat_response(messages):
-            full_response += chunk
-            yield chunk
+        if not full_response:
+            metrics.CHAT_REQUESTS.inc(outcome=outcome if outcome != "ok" else "empty")
+            return
+        metrics.CHAT_REQUESTS.inc(outcome=outcome)
         
-        # 6. Persist to MongoDB
+        # 7. Persist to MongoDB (queued, written in the background)
         timestamp = time.time()
         
-        # Embed user query (original)
-        query_embedding = list(embedding_model.embed([query]))[0]
+        # Reuse the query embedding computed for retrieval
+        query_embedding = await run.result("embed_query")
+        if query_embedding is None:
+            query_embedding = await embedding_service.embed(query)
         
-        # Save User Message
-        await conversations_collection.insert_one({
-            "conversation_id": conversation_id,
-            "role": "user",
-            "content": user_content, # Store full content with search results for frontend parsing
+        # User message is slim: raw query plus references to shared sources
+        await persistence_queue.enqueue({
             "timestamp": timestamp,
-            "embedding": query_embedding.tolist()
+            "search_results": search_results,
+            "messages": [
+                {
+                    "conversation_id": conversation_id,
+                    "role": "user",
+                    "content": query,
+                    "search_query": search_query,
+                    "timestamp": timestamp,
+                    "embedding": query_embedding
+                },
+                {
+                    "conversation_id": conversation_id,
+                    "role": "assistant",
+                    "content": full_response,
+                    "timestamp": timestamp + 1
+                },
+            ],
         })
         
-        # Save Assistant Message
-        await conversations_collection.insert_one({
-            "conversation_id": conversation_id,
-            "role": "assistant",
-            "content": full_response,
-            "timestamp": timestamp + 1
-        })
+        # 8. Fold older messages into the rolling summary in the background
+        summary_scheduler.maybe_schedule(conversation_id, summary.get("pending_messages", 0) + 2)
 
     except Exception as e:
         print(f"Pipeline Error: {e}")
-        yield f"Error processing request: {str(e)}"
-
-async def get_user_conversations() -> List[Dict]:
-    """Retrieves a list of unique conversations with metadata."""
-    # Group by conversation_id and get the first message (usually user query) as title
-    pipeline = [
-        {"$sort": {"timestamp": 1}},
-        {"$group": {
-            "_id": "$conversation_id",
-            "first_message": {"$first": "$content"},
-            "last_updated": {"$last": "$timestamp"}
-        }},
-        {"$sort": {"last_updated": -1}},
-        {"$project": {
-            "id": "$_id",
-            "title": {"$substr": ["$first_message", 0, 50]}, # Truncate for title
-            "timestamp": "$last_updated",
-            "_id": 0
-        }}
-    ]
-    cursor = conversations_collection.aggregate(pipeline)
-    return await cursor.to_list(length=100)
-
-async def get_conversation_messages(conversation_id: str) -> List[Dict]:
-    """Retrieves full message history for a conversation."""
-    cursor = conversations_collection.find({"conversation_id": conversation_id}).sort("timestamp", 1)
-    messages = await cursor.to_list(length=None)
-    # Format for frontend
-    return [{
+        metrics.CHAT_REQUESTS.inc(outcome="error")
+        yield {"type": "error", "message": f"Error processing request: {str(e)}"}
+    finally:
+        run.cancel_pending()
+
+async def get_user_conversations(limit: int = 100, before: Optional[float] = None,
+                                 before_id: Optional[str] = None) -> List[Dict]:
+    """Lists conversations newest first from the metadata collection.
+
+    Keyset pagination: pass the `timestamp` and `id` of the last item of the
+    previous page as `before` / `before_id`.
+    """
+    query = {}
+    if before is not None:
+        query = {"$or": [{"last_updated": {"$lt": before}}]}
+        if before_id is not None:
+            query["$or"].append({"last_updated": before, "_id": {"$lt": before_id}})
+    cursor = conversations_meta_collection.find(
+        query, {"title": 1, "last_updated": 1}
+    ).sort([("last_updated", -1), ("_id", -1)]).limit(limit)
+    with trace("mongo", "list_conversations"):
+        return [{
+            "id": doc["_id"],
+            "title": doc.get("title", ""),
+            "timestamp": doc["last_updated"]
+        } async for doc in cursor]
+
+# Fields the frontend needs; stored embeddings and other metadata stay in Mongo
+MESSAGE_PROJECTION = {"_id": 0, "role": 1, "content": 1, "timestamp": 1, "sources": 1, "search_query": 1}
+
+def _messages_cursor(conversation_id: str, limit: Optional[int], before: Optional[float],
+                     after: Optional[float]):
+    """Returns the cursor and whether it runs newest first. A limited page
+    without `after` is the newest `limit` messages before `before`."""
+    query = {"conversation_id": conversation_id, "type": {"$ne": "summary"}}
+    timestamp = {}
+    if before is not None:
+        timestamp["$lt"] = before
+    if after is not None:
+        timestamp["$gt"] = after
+    if timestamp:
+        query["timestamp"] = timestamp
+    newest_first = limit is not None and after is None
+    cursor = conversations_collection.find(query, MESSAGE_PROJECTION).sort("timestamp", -1 if newest_first else 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor, newest_first
+
+def _format_message(msg: Dict, sources: Dict[str, Dict]) -> Dict:
+    return {
         "role": msg["role"],
-        "content": msg["content"],
+        "content": render_user_content(msg, sources) if msg["role"] == "user" else msg["content"],
         "timestamp": msg["timestamp"]
-    } for msg in messages]
+    }
+
+async def get_conversation_messages(conversation_id: str, limit: Optional[int] = None,
+                                    before: Optional[float] = None, after: Optional[float] = None) -> List[Dict]:
+    """Retrieves a conversation's messages in chronological order.
+
+    Without arguments the whole history is returned. To page backwards from
+    the newest message, pass `limit` and then the `timestamp` of the first
+    message of each page as `before`; `after` pages forwards.
+    """
+    # A turn that just finished streaming may still be in the write queue
+    await persistence_queue.wait_written(conversation_id, timeout=PERSIST_READ_WAIT)
+    return await _read_page(*_messages_cursor(conversation_id, limit, before, after))
+
+async def _read_page(cursor, newest_first: bool) -> List[Dict]:
+    with trace("mongo", "conversation_messages"):
+        messages = await cursor.to_list(length=None)
+        if newest_first:
+            messages.reverse()
+        sources = await load_sources(messages)
+    return [_format_message(msg, sources) for msg in messages]
+
+async def iter_conversation_messages(conversation_id: str, limit: Optional[int] = None,
+                                     before: Optional[float] = None, after: Optional[float] = None):
+    """Like get_conversation_messages, but yields messages while iterating the
+    cursor so long histories are never held in memory at once. Sources are
+    fetched once per MESSAGE_STREAM_BATCH messages."""
+    await persistence_queue.wait_written(conversation_id, timeout=PERSIST_READ_WAIT)
+    cursor, newest_first = _messages_cursor(conversation_id, limit, before, after)
+    if newest_first:
+        # A bounded page that has to be reversed; no point streaming it
+        for message in await _read_page(cursor, newest_first):
+            yield message
+        return
+    batch = []
+    async for msg in cursor.batch_size(MESSAGE_STREAM_BATCH):
+        batch.append(msg)
+        if len(batch) >= MESSAGE_STREAM_BATCH:
+            sources = await load_sources(batch)
+            for message in batch:
+                yield _format_message(message, sources)
+            batch = []
+    if batch:
+        sources = await load_sources(batch)
+        for message in batch:
+            yield _format_message(message, sources)
 
 async def delete_conversation(conversation_id: str):
+    # Otherwise a queued turn would be written after the delete and bring the
+    # conversation back
+    await persistence_queue.wait_written(conversation_id, timeout=PERSIST_READ_WAIT)
     result = await conversations_collection.delete_many({"conversation_id": conversation_id})
+    await conversations_meta_collection.delete_one({"_id": conversation_id})
+    retriever.evict(conversation_id)
     return result.deleted_count > 0
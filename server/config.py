@@ -4,6 +4,30 @@ Configuration file for Cipher AI Research Assistant
 This file contains all configurable settings for the application.
 Modify these values to customize the behavior of Cipher.
 """
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# ============================================
+# Environment
+# ============================================
+
+# Secrets and deployment settings come from the environment, with .env in the
+# project root loaded once here. Other modules import these values.
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+# Falls back to a local MongoDB for development
+MONGODB_URI = os.getenv("MONGODB_URI") or "mongodb://localhost:27017"
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+PARALLEL_API_KEY = os.getenv("PARALLEL_API_KEY")
+PARALLEL_API_URL = os.getenv("PARALLEL_API_URL", "https://api.parallel.ai/v1beta/search")
+
+# Only used when SHARED_BACKEND is "redis"
+REDIS_URL = os.getenv("REDIS_URL") or "redis://localhost:6379/0"
 
 # ============================================
 # LLM Configuration
@@ -19,6 +43,10 @@ Modify these values to customize the behavior of Cipher.
 #   - "meta-llama/llama-3.1-70b-instruct"
 LLM_MODEL = "moonshotai/kimi-k2-thinking"
 
+# Model used when LLM_MODEL keeps failing or its circuit breaker is open
+# (None disables the fallback)
+LLM_FALLBACK_MODEL = None
+
 # Maximum tokens for streaming responses
 LLM_MAX_TOKENS = 2500
 
@@ -33,6 +61,21 @@ LLM_INTERNAL_MAX_TOKENS = 500
 # This is used for semantic search in the knowledge base
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 
+# Embeddings run in a thread pool off the event loop. Requests arriving within
+# EMBEDDING_BATCH_WINDOW seconds of each other share one inference call of up
+# to EMBEDDING_MAX_BATCH_SIZE texts.
+EMBEDDING_BATCH_WINDOW = 0.005
+EMBEDDING_MAX_BATCH_SIZE = 32
+EMBEDDING_WORKERS = 1
+
+# Embedding cache: number of vectors kept in memory (LRU), and an optional
+# directory for the on-disk tier (set to None to disable). The disk tier
+# stores float32 vectors in a memory-mapped file so restarts start warm.
+# Under serve.py each worker uses its own "worker-<n>" subdirectory.
+EMBEDDING_CACHE_SIZE = 10000
+EMBEDDING_CACHE_DIR = None
+EMBEDDING_CACHE_DISK_MAX_ENTRIES = 1_000_000
+
 # ============================================
 # Search Configuration
 # ============================================
@@ -40,6 +83,24 @@ EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 # Number of search results to retrieve
 SEARCH_RESULTS_LIMIT = 5
 
+# Fan-out search: the query is rewritten into up to this many sub-queries,
+# which are sent in one batched request and merged with reciprocal-rank
+# fusion. Set to 1 to search only the rewritten query.
+SEARCH_FANOUT_QUERIES = 3
+
+# Search results are cached per normalized query for SEARCH_CACHE_TTL seconds.
+# Concurrent identical queries always share a single upstream call.
+SEARCH_CACHE_TTL = 600
+SEARCH_CACHE_MAX_ENTRIES = 2000
+
+# Semantic cache mode: reuse cached results for a query whose embedding has
+# cosine similarity >= SEARCH_CACHE_SEMANTIC_THRESHOLD with a cached query
+SEARCH_CACHE_SEMANTIC = False
+SEARCH_CACHE_SEMANTIC_THRESHOLD = 0.95
+
+# Cost of one Parallel search request in USD, used to report savings
+SEARCH_COST_PER_REQUEST = 0.005
+
 # ============================================
 # Conversation Configuration
 # ============================================
@@ -47,5 +108,278 @@ SEARCH_RESULTS_LIMIT = 5
 # Maximum number of messages to include in conversation context
 MAX_CONTEXT_MESSAGES = 10
 
-# Trigger summarization when conversation exceeds this many messages
+# Prompt token budget per model, including the answer (LLM_MAX_TOKENS is
+# reserved for it). Models not listed use DEFAULT_CONTEXT_BUDGET.
+MODEL_CONTEXT_BUDGETS = {
+    "moonshotai/kimi-k2-thinking": 32000,
+}
+DEFAULT_CONTEXT_BUDGET = 16000
+
+# Backend for retrieving semantically similar past messages:
+#   "atlas": MongoDB Atlas $vectorSearch (requires the "vector_index" search index)
+#   "local": in-process vector index built from stored embeddings
+#   "auto":  Atlas, falling back to the local index while Atlas is unavailable
+RETRIEVER_BACKEND = "auto"
+
+# Seconds to stay on the local index after Atlas vector search fails
+RETRIEVER_ATLAS_RETRY_SECONDS = 300
+
+# Local index: conversations kept in memory (LRU), and the history size from
+# which an HNSW index is used instead of exact search (needs hnswlib)
+LOCAL_INDEX_MAX_CONVERSATIONS = 500
+LOCAL_INDEX_HNSW_THRESHOLD = 20000
+
+# tiktoken encoding used to count prompt tokens. Loaded at startup (it may
+# need to download its BPE file) so no request pays for it
+TOKENIZER_ENCODING = "cl100k_base"
+
+# Token counts remembered by text digest, so memory stays bounded however
+# long the messages are
+TOKEN_COUNT_CACHE_SIZE = 8192
+
+# Trigger summarization when this many messages are not yet in the summary
 SUMMARIZATION_THRESHOLD = 20
+
+# Max tokens of new messages folded into the summary per summarization run
+SUMMARIZATION_MAX_INPUT_TOKENS = 12000
+
+# Newest messages that always stay out of the summary (kept verbatim)
+SUMMARIZATION_KEEP_RECENT = 6
+
+# Largest page /conversations/{id} returns for `limit`, and the number of
+# messages read per cursor batch (and per sources lookup) when streaming a
+# conversation as NDJSON
+CONVERSATION_PAGE_MAX_LIMIT = 1000
+MESSAGE_STREAM_BATCH = 100
+
+# ============================================
+# Upstream HTTP Client Configuration
+# ============================================
+
+# Shared, pooled HTTP clients are created once at startup and reused by every
+# request. HTTP/2 multiplexes concurrent requests over a single connection.
+HTTP2_ENABLED = True
+
+# Per-upstream connection pool settings
+#   max_connections:           hard cap on open connections to the upstream
+#   max_keepalive_connections: idle connections kept around for reuse
+#   keepalive_expiry:          seconds before an idle connection is closed
+#   connect_timeout:           seconds allowed to establish a connection
+HTTP_POOL_LIMITS = {
+    "openrouter": {
+        "max_connections": 100,
+        "max_keepalive_connections": 20,
+        "keepalive_expiry": 60.0,
+        "connect_timeout": 5.0,
+    },
+    "parallel": {
+        "max_connections": 50,
+        "max_keepalive_connections": 10,
+        "keepalive_expiry": 30.0,
+        "connect_timeout": 5.0,
+    },
+}
+
+# ============================================
+# Pipeline Configuration
+# ============================================
+
+# Total time (seconds) allowed for the stages that run before generation
+# (history retrieval, query rewriting, search). Stages still running when
+# the budget is spent are cancelled and the answer uses what is available.
+PIPELINE_BUDGET_SECONDS = 15.0
+
+# Per-stage timeouts in seconds
+STAGE_TIMEOUTS = {
+    "embed_query": 3.0,
+    "vector_search": 3.0,
+    "recent_messages": 3.0,
+    "contextualize": 8.0,
+    "search": 10.0,
+}
+
+# A rewritten query whose word overlap with the original is at or above this
+# ratio (0-1) is considered unchanged and does not trigger a second search
+REWRITE_SIMILARITY_THRESHOLD = 0.8
+
+# Skip the query rewrite when a query already reads as standalone (no
+# pronouns, no follow-up phrasing, not a short fragment, or a first turn).
+# Such queries are searched as typed with no LLM call before search; with
+# SEARCH_FANOUT_QUERIES > 1 their sub-queries are generated and searched in
+# parallel and only used if ready within STAGE_TIMEOUTS["contextualize"].
+REWRITE_PRECHECK = True
+
+# Rewrite and fan-out responses are cached by model and exact messages.
+# Concurrent identical calls always share a single upstream request.
+LLM_CACHE_TTL = 900
+LLM_CACHE_MAX_ENTRIES = 5000
+
+# ============================================
+# Persistence Configuration
+# ============================================
+
+# Finished turns are written to MongoDB by a background worker.
+#   PERSIST_QUEUE_MAX_TURNS: turns waiting to be written before callers block
+#   PERSIST_BATCH_SIZE:      max turns combined into one insert_many
+#   PERSIST_BATCH_WINDOW:    seconds to wait for more turns to fill a batch
+#   PERSIST_MAX_RETRIES:     retries on transient MongoDB errors
+#   PERSIST_ENQUEUE_TIMEOUT: seconds to wait for queue space before writing inline
+#   PERSIST_DRAIN_TIMEOUT:   seconds allowed to flush the queue on shutdown
+#   PERSIST_READ_WAIT:       seconds reads and deletes of a conversation wait
+#                            for its queued turns to be written
+PERSIST_QUEUE_MAX_TURNS = 1000
+PERSIST_BATCH_SIZE = 50
+PERSIST_BATCH_WINDOW = 0.05
+PERSIST_MAX_RETRIES = 3
+PERSIST_ENQUEUE_TIMEOUT = 1.0
+PERSIST_DRAIN_TIMEOUT = 10.0
+PERSIST_READ_WAIT = 5.0
+
+# ============================================
+# Streaming Configuration
+# ============================================
+
+# Streamed tokens are buffered and written together once the oldest buffered
+# token is STREAM_COALESCE_MS old or the buffer reaches STREAM_COALESCE_BYTES
+STREAM_COALESCE_MS = 30
+STREAM_COALESCE_BYTES = 512
+
+# ============================================
+# Metrics Configuration
+# ============================================
+
+# Fraction (0-1) of chat requests whose latency spans (pipeline stages,
+# LLM, search, embedding and MongoDB calls) are recorded. Counters such as
+# request outcomes, upstream status codes and token usage are always kept.
+METRICS_SAMPLE_RATE = 1.0
+
+# Print each sampled turn's stage timings to stdout, for local debugging.
+# Off by default: /metrics histograms and /stats cover production
+TRACE_LOG = False
+
+# Histogram buckets (seconds) for latency metrics on /metrics
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# ============================================
+# Upstream Resilience Configuration
+# ============================================
+
+# Per-upstream call policy
+#   timeout:             seconds per attempt (read timeout for streams)
+#   retries:             extra attempts on timeouts, connection errors, 429 and
+#                        5xx; streamed answers are only retried before the
+#                        first token
+#   backoff_base/max:    exponential backoff bounds in seconds (full jitter)
+#   hedge:               send a second attempt when the first is slower than
+#                        the observed p95 latency (not used for streams)
+#   hedge_min_delay:     lower bound for the hedge delay, in seconds
+#   hedge_default_delay: hedge delay until enough latencies have been seen
+#   breaker_failures:    consecutive failures that open the circuit breaker
+#   breaker_reset:       seconds calls fail fast before a trial call is let through
+# While the Parallel circuit is open, answers are generated without search.
+UPSTREAM_POLICIES = {
+    "openrouter": {
+        "timeout": 30.0,
+        "retries": 2,
+        "backoff_base": 0.25,
+        "backoff_max": 2.0,
+        "hedge": True,
+        "hedge_min_delay": 0.5,
+        "hedge_default_delay": 3.0,
+        "breaker_failures": 5,
+        "breaker_reset": 30.0,
+    },
+    "parallel": {
+        "timeout": 8.0,
+        "retries": 1,
+        "backoff_base": 0.2,
+        "backoff_max": 1.0,
+        "hedge": True,
+        "hedge_min_delay": 0.3,
+        "hedge_default_delay": 2.0,
+        "breaker_failures": 5,
+        "breaker_reset": 30.0,
+    },
+}
+
+# ============================================
+# Admission Control Configuration
+# ============================================
+
+# At most CHAT_MAX_ACTIVE chat turns run at once. Further turns wait in a queue
+# of up to CHAT_MAX_QUEUED, served round-robin across clients. A turn that
+# cannot be queued, or waits longer than CHAT_MAX_QUEUE_WAIT seconds, gets a
+# 429 with Retry-After. Turns on the same conversation always run one at a time.
+CHAT_MAX_ACTIVE = 64
+CHAT_MAX_QUEUED = 256
+CHAT_MAX_QUEUE_WAIT = 10.0
+
+# Max concurrent turns per client. Clients are identified by CLIENT_ID_HEADER
+# when present, otherwise by remote address.
+CHAT_MAX_ACTIVE_PER_CLIENT = 8
+CLIENT_ID_HEADER = "X-Client-Id"
+
+# With a shared backend (SHARED_BACKEND="redis"), turns on the same
+# conversation are also serialized across serve.py workers: a lock in the
+# backend is held until the turn is written, for at most
+# CONVERSATION_LOCK_TTL seconds. The worker that ran a conversation's last
+# turn is remembered for CONVERSATION_OWNER_TTL seconds, so a worker picking
+# the conversation up from another one drops its stale local state.
+CONVERSATION_LOCK_TTL = 300.0
+CONVERSATION_OWNER_TTL = 3600.0
+
+# ============================================
+# Startup Configuration
+# ============================================
+
+# Load the embedding model in the background after the server starts
+# listening. /health answers immediately; /ready returns 503 until the model
+# is loaded. Set to False to block startup until the model is ready.
+STARTUP_BACKGROUND_LOADING = True
+
+# A failed background load is retried with exponential backoff (seconds)
+# until it succeeds, so a worker whose model failed once becomes ready again
+STARTUP_RETRY_DELAY = 1.0
+STARTUP_RETRY_MAX_DELAY = 30.0
+
+# Run one embedding after loading so the first request does not pay for
+# onnxruntime session initialization. /ready waits for it when enabled
+EMBEDDING_WARMUP = True
+
+# ============================================
+# Shared State Configuration
+# ============================================
+
+# Backend for state shared between server workers (see serve.py):
+#   "memory": process-local; enough for a single worker
+#   "redis":  a Redis-compatible server at REDIS_URL (pip install redis).
+#             LLM and search results are shared across workers, identical
+#             upstream calls in different workers are made once, and only
+#             one worker summarizes a conversation at a time.
+SHARED_BACKEND = os.getenv("SHARED_BACKEND") or "memory"
+SHARED_KEY_PREFIX = "cipher:"
+
+# Seconds to wait on the backend before treating a call as failed; callers
+# then carry on without it
+SHARED_BACKEND_TIMEOUT = 0.5
+
+# Single flight across workers: the worker holding a key's lock (for at most
+# SHARED_LOCK_TTL seconds) makes the upstream call; others poll every
+# SHARED_POLL_INTERVAL seconds for its result and give up after
+# SHARED_LOCK_WAIT seconds to make the call themselves.
+SHARED_LOCK_TTL = 60.0
+SHARED_LOCK_WAIT = 10.0
+SHARED_POLL_INTERVAL = 0.05
+
+# Lock held by the worker summarizing a conversation
+SUMMARY_LOCK_TTL = 300.0
+
+# Entry limit for the memory backend
+SHARED_MEMORY_MAX_ENTRIES = 10000
+
+# serve.py: worker processes (0 = one per CPU core)
+SERVER_WORKERS = 0
+
+# Set by serve.py in each worker process to its slot (0..N-1); None when
+# running a single process under uvicorn directly
+WORKER_ID = None
@@ -0,0 +1,172 @@
+"""
+Token-budgeted prompt assembly.
+
+History, the conversation summary and search snippets compete for a per-model
+prompt budget. Messages are deduplicated by id and packed by priority:
+
+    1. system prompt and the current user query (always included)
+    2. search snippets, in rank order
+    3. the rolling conversation summary, which replaces the messages it covers
+    4. recent messages, newest first
+    5. semantically retrieved (vector) messages, best score first
+"""
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from config import MODEL_CONTEXT_BUDGETS, DEFAULT_CONTEXT_BUDGET, LLM_MAX_TOKENS, MAX_CONTEXT_MESSAGES, TOKENIZER_ENCODING
+from config import TOKEN_COUNT_CACHE_SIZE
+
+# Per-message framing overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        print(f"Warning: tokenizer '{TOKENIZER_ENCODING}' unavailable ({e}), estimating tokens from length")
+        return None
+
+
+def load_tokenizer() -> bool:
+    """Loads the encoding ahead of the first count_tokens call. Blocking (may
+    download), so run it in a thread. Returns False if estimating instead."""
+    return _get_encoding() is not None
+
+
+# digest of text -> token count, least recently used first
+_token_counts: "OrderedDict[bytes, int]" = OrderedDict()
+
+
+def count_tokens(text: str) -> int:
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    count = _token_counts.get(key)
+    if count is not None:
+        _token_counts.move_to_end(key)
+        return count
+    encoding = _get_encoding()
+    if encoding is None:
+        count = (len(text) + 3) // 4
+    else:
+        count = len(encoding.encode(text, disallowed_special=()))
+    _token_counts[key] = count
+    while len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+        _token_counts.popitem(last=False)
+    return count
+
+
+def message_tokens(message: Dict) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_budget(model: str) -> int:
+    """Prompt tokens available for a model, after reserving room for the answer."""
+    return MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET) - LLM_MAX_TOKENS
+
+
+def message_id(message: Dict) -> str:
+    if message.get("_id") is not None:
+        return str(message["_id"])
+    return f"{message.get('timestamp')}:{message.get('role')}"
+
+
+def dedupe_messages(*message_lists: List[Dict]) -> List[Dict]:
+    """Merges message lists, keeping the first occurrence of each message id."""
+    seen = set()
+    merged = []
+    for messages in message_lists:
+        for message in messages:
+            key = message_id(message)
+            if key not in seen:
+                seen.add(key)
+                merged.append(message)
+    return merged
+
+
+def format_search_results(search_results: List[Dict]) -> List[str]:
+    return [f"[{i+1}] {res.get('title', 'Untitled')} ({res.get('url', '#')}): {res.get('body', '')[:300]}..."
+            for i, res in enumerate(search_results)]
+
+
+def assemble_messages(model: str, system_prompt: str, query: str, search_query: str,
+                      search_results: List[Dict], recent_messages: List[Dict],
+                      vector_messages: List[Dict], summary: Optional[str] = None,
+                      summary_covers_until: Optional[float] = None) -> Tuple[List[Dict], Dict]:
+    """Builds the final prompt within the model's token budget.
+
+    Returns the chat messages and a report of the prompt size per section.
+    """
+    budget = context_budget(model)
+    report = {"model": model, "budget": budget}
+
+    system_message = {"role": "system", "content": system_prompt}
+    header = f"Search Results (for query: '{search_query}'):\n"
+    footer = f"\n\nUser Query: {query}"
+    used = message_tokens(system_message) + message_tokens({"content": header + footer})
+    report["required"] = used
+
+    # Search snippets
+    snippets = []
+    for line in format_search_results(search_results):
+        cost = count_tokens(line + "\n")
+        if used + cost > budget:
+            break
+        snippets.append(line)
+        used += cost
+    report["search"] = used - report["required"]
+    report["search_snippets"] = len(snippets)
+    report["search_snippets_dropped"] = len(search_results) - len(snippets)
+
+    # Summary: when it fits, the messages it covers are left out
+    summary_message = None
+    if summary:
+        candidate = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+        cost = message_tokens(candidate)
+        if used + cost <= budget:
+            summary_message = candidate
+            used += cost
+            if summary_covers_until is not None:
+                recent_messages = [m for m in recent_messages if m.get("timestamp", 0) > summary_covers_until]
+                vector_messages = [m for m in vector_messages if m.get("timestamp", 0) > summary_covers_until]
+    report["summary"] = message_tokens(summary_message) if summary_message else 0
+
+    # History: recent first (newest to oldest), then vector hits by score
+    history = []
+    history_tokens = 0
+    recent = dedupe_messages(recent_messages)
+    for message in reversed(recent):
+        cost = message_tokens(message)
+        if len(history) >= MAX_CONTEXT_MESSAGES or used + cost > budget:
+            break
+        history.append(message)
+        used += cost
+        history_tokens += cost
+
+    included = {message_id(m) for m in history}
+    by_score = sorted(vector_messages, key=lambda m: m.get("score", 0.0), reverse=True)
+    for message in dedupe_messages(by_score):
+        if message_id(message) in included:
+            continue
+        cost = message_tokens(message)
+        if len(history) >= MAX_CONTEXT_MESSAGES or used + cost > budget:
+            continue
+        history.append(message)
+        included.add(message_id(message))
+        used += cost
+        history_tokens += cost
+    history.sort(key=lambda m: m.get("timestamp", 0))
+    report["history"] = history_tokens
+    report["history_messages"] = len(history)
+    report["history_messages_dropped"] = len(dedupe_messages(recent_messages, vector_messages)) - len(history)
+    report["total"] = used
+
+    messages = [system_message]
+    if summary_message:
+        messages.append(summary_message)
+    messages.extend({"role": m["role"], "content": m["content"]} for m in history)
+    messages.append({"role": "user", "content": header + "\n".join(snippets) + footer})
+    return messages, report
@@ -1,22 +1,24 @@
-import os
 from motor.motor_asyncio import AsyncIOMotorClient
-from dotenv import load_dotenv
 
-from pathlib import Path
-
-# Load .env from parent directory
-env_path = Path(__file__).parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-MONGODB_URI = os.getenv("MONGODB_URI")
-if not MONGODB_URI:
-    # Fallback for development if not set, though it should be.
-    MONGODB_URI = "mongodb://localhost:27017"
+from config import MONGODB_URI
 
 client = AsyncIOMotorClient(MONGODB_URI)
 db = client.cipher_db
 conversations_collection = db.conversations
 
+# Search results referenced by user messages, one document per canonical URL
+# and excerpt
+search_results_collection = db.search_results
+
+# Per-conversation metadata (title, last_updated, message_count, summary
+# pointer), maintained incrementally on every write
+conversations_meta_collection = db.conversations_meta
+
+async def ensure_indexes():
+    """Creates the indexes the hot queries rely on. Safe to run on every startup."""
+    await conversations_collection.create_index([("conversation_id", 1), ("timestamp", 1)])
+    await conversations_meta_collection.create_index([("last_updated", -1), ("_id", -1)])
+
 # Ensure index for vector search (Atlas Vector Search)
 # Note: This usually requires setting up a Search Index in Atlas UI.
 # We will assume the index name is "vector_index" and the field is "embedding".
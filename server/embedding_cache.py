@@ -0,0 +1,214 @@
+"""
+Content-addressed cache for query embeddings.
+
+Vectors are keyed by a hash of (model name, normalized text). A bounded
+in-memory LRU tier serves hot entries; an optional on-disk tier keeps every
+vector as packed float32 rows in a memory-mapped file so a restarted worker
+starts warm. The disk tier has a single writer: each store holds an exclusive
+lock on its files, and a second process pointed at the same directory runs
+without the disk tier (serve.py gives every worker its own directory).
+
+Disk reads and writes run on one background thread, never on the event loop.
+New vectors are queued and appended in batches; until then the memory tier
+serves them.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+KEY_SIZE = 32  # sha256 digest
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class DiskEmbeddingStore:
+    """Append-only float32 vector file plus a parallel file of keys.
+
+    Row i of `<name>.f32` holds the vector for the i-th digest in `<name>.keys`.
+    Reads go through a read-only memmap that is remapped when it falls behind.
+    Not thread-safe: EmbeddingCache calls it from a single thread.
+    """
+
+    def __init__(self, directory: str, model_name: str, max_entries: int):
+        os.makedirs(directory, exist_ok=True)
+        slug = model_name.replace("/", "__")
+        self.keys_path = os.path.join(directory, f"{slug}.keys")
+        self.vectors_path = os.path.join(directory, f"{slug}.f32")
+        self.meta_path = os.path.join(directory, f"{slug}.json")
+        self._lock_file = self._lock(os.path.join(directory, f"{slug}.lock"))
+        self.max_entries = max_entries
+        self.dim: Optional[int] = None
+        self.index: Dict[bytes, int] = {}
+        self._mmap: Optional[np.memmap] = None
+        self._load()
+
+    @staticmethod
+    def _lock(path: str):
+        """Takes the store's writer lock; raises BlockingIOError if another
+        process holds it. Kept open for the life of the store."""
+        lock_file = open(path, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise BlockingIOError(f"{path} is in use by another process")
+        return lock_file
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path) as f:
+            self.dim = json.load(f)["dim"]
+        keys = open(self.keys_path, "rb").read() if os.path.exists(self.keys_path) else b""
+        row_bytes = self.dim * 4
+        vector_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        # A crash between the two appends can leave the files out of step
+        count = min(len(keys) // KEY_SIZE, vector_rows)
+        for row in range(count):
+            self.index[keys[row * KEY_SIZE:(row + 1) * KEY_SIZE]] = row
+        self._truncate(count)
+        print(f"Embedding disk cache loaded: {count} vectors")
+
+    def _truncate(self, count: int):
+        for path, size in ((self.keys_path, count * KEY_SIZE), (self.vectors_path, count * self.dim * 4)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        row = self.index.get(key)
+        if row is None:
+            return None
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.index), self.dim))
+        return np.array(self._mmap[row])
+
+    def put(self, key: bytes, vector: np.ndarray):
+        self.put_many([(key, vector)])
+
+    def put_many(self, items: List[Tuple[bytes, np.ndarray]]):
+        """Appends new vectors with one write per file."""
+        if self.dim is None and items:
+            self.dim = int(items[0][1].shape[0])
+            with open(self.meta_path, "w") as f:
+                json.dump({"dim": self.dim}, f)
+        new: Dict[bytes, np.ndarray] = {}
+        for key, vector in items:
+            if len(self.index) + len(new) >= self.max_entries:
+                break
+            if key not in self.index and vector.shape[0] == self.dim:
+                new[key] = vector
+        if not new:
+            return
+        # Vectors first, then keys: a torn write leaves orphan rows, never a bad key
+        with open(self.vectors_path, "ab") as f:
+            f.write(b"".join(vector.astype(np.float32).tobytes() for vector in new.values()))
+        with open(self.keys_path, "ab") as f:
+            f.write(b"".join(new))
+        for key in new:
+            self.index[key] = len(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, max_entries: int, disk_dir: Optional[str] = None,
+                 disk_max_entries: int = 1_000_000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.disk = None
+        if disk_dir:
+            try:
+                self.disk = DiskEmbeddingStore(disk_dir, model_name, disk_max_entries)
+            except OSError as e:
+                print(f"Embedding disk cache disabled: {e}")
+        # One thread owns the disk store, so reads and appends never interleave
+        self._disk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-disk")
+        self._pending: List[Tuple[bytes, np.ndarray]] = []
+        self._pending_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, text: str) -> Optional[List[float]]:
+        key = cache_key(self.model_name, text)
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return vector.tolist()
+        if self.disk is not None:
+            vector = await asyncio.get_running_loop().run_in_executor(self._disk_executor, self.disk.get, key)
+            if vector is not None:
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector.tolist()
+        self.misses += 1
+        return None
+
+    def put(self, text: str, vector: List[float]):
+        """Stores in memory now; the disk append is queued for the disk thread."""
+        key = cache_key(self.model_name, text)
+        array = np.asarray(vector, dtype=np.float32)
+        self._remember(key, array)
+        if self.disk is not None:
+            with self._pending_lock:
+                self._pending.append((key, array))
+                schedule = len(self._pending) == 1
+            if schedule:
+                try:
+                    self._disk_executor.submit(self._flush)
+                except RuntimeError:  # Closed at shutdown
+                    pass
+
+    def _flush(self):
+        """Runs on the disk thread: appends everything queued since the last flush."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        try:
+            self.disk.put_many(pending)
+        except OSError as e:
+            print(f"Embedding disk cache write failed: {e}")
+
+    def close(self):
+        """Waits for queued disk writes. Blocks; call from a thread at shutdown."""
+        self._disk_executor.shutdown(wait=True)
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "cache_memory_entries": len(self.memory),
+            "cache_disk_entries": len(self.disk) if self.disk is not None else 0,
+            "cache_memory_hits": self.memory_hits,
+            "cache_disk_hits": self.disk_hits,
+            "cache_misses": self.misses,
+            "cache_hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
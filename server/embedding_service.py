@@ -0,0 +1,191 @@
+"""
+Off-event-loop embedding service.
+
+ONNX inference is CPU bound and would block every connected client if run
+inside an async handler. Requests are queued, micro-batched over a short
+window so a single inference call serves many concurrent users, and executed
+in a thread pool (onnxruntime releases the GIL while it runs).
+
+The model itself is created by `model_loader` on first use or by `load()`
+at startup, off the event loop, so importing this module stays cheap.
+serve.py can instead load it once with `preload_model()` before forking
+workers, which then share the weights copy-on-write.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import EMBEDDING_MODEL, EMBEDDING_BATCH_WINDOW, EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_WORKERS
+from metrics import EMBEDDING_BATCH_SIZE, trace
+
+_preloaded_model = None
+
+
+def load_embedding_model(threads: Optional[int] = None):
+    # fastembed pulls in onnxruntime and may download the model; both happen
+    # off the event loop when the service loads it
+    if _preloaded_model is not None:
+        return _preloaded_model
+    from fastembed import TextEmbedding
+    if threads is None:
+        return TextEmbedding(model_name=EMBEDDING_MODEL)
+    return TextEmbedding(model_name=EMBEDDING_MODEL, threads=threads)
+
+
+def preload_model():
+    """Loads the model in this process for forked workers to inherit.
+
+    onnxruntime's intra-op thread pool does not survive fork(), so the
+    preloaded session runs inference on the calling thread only; workers get
+    their parallelism from being separate processes.
+    """
+    global _preloaded_model
+    _preloaded_model = load_embedding_model(threads=1)
+
+
+class EmbeddingService:
+    def __init__(self, model_loader: Callable[[], Any], cache=None, batch_window: float = EMBEDDING_BATCH_WINDOW,
+                 max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE, workers: int = EMBEDDING_WORKERS):
+        self.model_loader = model_loader
+        self.model = None
+        self._loading: Optional[asyncio.Future] = None
+        self.cache = cache
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+        self._queue: asyncio.Queue = None
+        self._worker: asyncio.Task = None
+        self._workers = workers
+        self._inflight: asyncio.Semaphore = None
+        self._batches = set()
+
+        # Metrics
+        self.started_at = time.time()
+        self.total_embeddings = 0
+        self.total_batches = 0
+        self.busy_seconds = 0.0
+        self.in_batch = 0
+
+    def start(self):
+        """Starts the batching worker on the running event loop."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._inflight = asyncio.Semaphore(self._workers)
+            self._worker = asyncio.create_task(self._run())
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    async def load(self):
+        """Loads the model in the thread pool. Concurrent callers share one
+        load; a failed load is retried by the next caller."""
+        if self._loading is None or (self._loading.done() and self.model is None):
+            self._loading = asyncio.ensure_future(self._load())
+        await asyncio.shield(self._loading)
+
+    async def _load(self):
+        started = time.perf_counter()
+        model = await asyncio.get_running_loop().run_in_executor(self._executor, self.model_loader)
+        self.model = model
+        print(f"Embedding model loaded in {time.perf_counter() - started:.2f}s")
+
+    async def warmup(self):
+        """Runs one inference so the first request does not pay for session
+        initialization."""
+        await self.load()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._embed_sync, ["warm up"])
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+        if self.cache is not None:
+            # Flush queued disk cache writes without blocking the loop
+            await asyncio.get_running_loop().run_in_executor(None, self.cache.close)
+
+    async def embed(self, text: str) -> List[float]:
+        """Embeds a single text, batched together with concurrent callers."""
+        if self.cache is not None:
+            cached = await self.cache.get(text)
+            if cached is not None:
+                return cached
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        with trace("embedding", "embed"):
+            await self._queue.put((text, future))
+            vector = await future
+        if self.cache is not None:
+            self.cache.put(text, vector)
+        return vector
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.embed(t) for t in texts)))
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Bound concurrent inference calls to the number of pool threads;
+            # the next batch keeps filling while this one runs.
+            self.in_batch += len(batch)
+            await self._inflight.acquire()
+            task = asyncio.create_task(self._process(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _process(self, batch: List[Tuple[str, asyncio.Future]]):
+        started = time.perf_counter()
+        try:
+            if self.model is None:
+                await self.load()
+            texts = [text for text, _ in batch]
+            loop = asyncio.get_running_loop()
+            EMBEDDING_BATCH_SIZE.observe(len(texts))
+            with trace("embedding", "batch"):
+                vectors = await loop.run_in_executor(self._executor, self._embed_sync, texts)
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+            self.total_embeddings += len(batch)
+            self.total_batches += 1
+        except Exception as e:
+            print(f"Embedding batch failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.busy_seconds += time.perf_counter() - started
+            self.in_batch -= len(batch)
+            self._inflight.release()
+
+    def _embed_sync(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self.model.embed(texts, batch_size=len(texts))]
+
+    def stats(self) -> Dict:
+        uptime = max(time.time() - self.started_at, 1e-9)
+        stats = self.cache.stats() if self.cache is not None else {}
+        return {
+            **stats,
+            "model_loaded": self.ready,
+            "queue_depth": (self._queue.qsize() if self._queue else 0) + self.in_batch,
+            "total_embeddings": self.total_embeddings,
+            "total_batches": self.total_batches,
+            "avg_batch_size": round(self.total_embeddings / self.total_batches, 2) if self.total_batches else 0.0,
+            "embeddings_per_sec": round(self.total_embeddings / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+            "avg_embeddings_per_sec_since_start": round(self.total_embeddings / uptime, 4),
+        }
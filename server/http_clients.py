@@ -0,0 +1,83 @@
+"""
+Shared HTTP clients for upstream APIs (OpenRouter, Parallel).
+
+Clients are created once in the FastAPI lifespan and reused across requests so
+that TLS handshakes and TCP connections are amortized over many calls.
+"""
+import httpx
+from functools import lru_cache
+from typing import Dict
+
+from config import HTTP2_ENABLED, HTTP_POOL_LIMITS
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+@lru_cache(maxsize=1)
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("Warning: HTTP/2 requested but 'h2' is not installed, using HTTP/1.1")
+        return False
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    settings = HTTP_POOL_LIMITS.get(name, {})
+    limits = httpx.Limits(
+        max_connections=settings.get("max_connections", 100),
+        max_keepalive_connections=settings.get("max_keepalive_connections", 20),
+        keepalive_expiry=settings.get("keepalive_expiry", 30.0),
+    )
+    # Read timeouts are set per request by the callers
+    timeout = httpx.Timeout(30.0, connect=settings.get("connect_timeout", 5.0))
+    return httpx.AsyncClient(http2=_http2_available(), limits=limits, timeout=timeout)
+
+
+def init_http_clients():
+    """Creates the shared clients. Called once from the app lifespan."""
+    for name in HTTP_POOL_LIMITS:
+        if name not in _clients:
+            _clients[name] = _build_client(name)
+    print(f"HTTP clients ready: {', '.join(_clients)}")
+
+
+async def close_http_clients():
+    """Closes all shared clients and their pooled connections."""
+    for name, client in list(_clients.items()):
+        await client.aclose()
+        del _clients[name]
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """Returns the shared client for an upstream, creating it on first use
+    (e.g. when running outside the FastAPI lifespan)."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build_client(name)
+        _clients[name] = client
+    return client
+
+
+def get_pool_stats() -> Dict[str, Dict]:
+    """Returns connection pool usage per upstream."""
+    stats = {}
+    for name, client in _clients.items():
+        # httpx does not expose pool state publicly; read it from httpcore
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        settings = HTTP_POOL_LIMITS.get(name, {})
+        stats[name] = {
+            "http2": getattr(pool, "_http2", False),
+            "connections": len(connections),
+            "idle": sum(1 for c in connections if c.is_idle()),
+            "active": sum(1 for c in connections if not c.is_idle() and not c.is_closed()),
+            "pending_requests": len(getattr(pool, "_requests", [])),
+            "max_connections": settings.get("max_connections"),
+            "max_keepalive_connections": settings.get("max_keepalive_connections"),
+            "keepalive_expiry": settings.get("keepalive_expiry"),
+        }
+    return stats
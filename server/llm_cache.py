@@ -0,0 +1,97 @@
+"""
+Response cache for internal, deterministic LLM calls (query rewriting and
+fan-out).
+
+Responses are keyed by a hash of the model and the exact messages, kept for
+LLM_CACHE_TTL seconds in a bounded LRU, and concurrent identical calls share
+one upstream request. With a SharedCache, local misses are looked up in the
+shared backend and identical calls are shared across workers too. Streamed
+answers are never cached.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from singleflight import SingleFlight
+from shared_cache import SharedCache
+
+
+def messages_key(model: str, messages: List[Dict]) -> str:
+    raw = json.dumps([model, [[m["role"], m["content"]] for m in messages]], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cacheable(response: str) -> bool:
+    # generate_chat_response reports failures as "" or "Error: ..."; don't pin them
+    return bool(response) and not response.startswith("Error:")
+
+
+class LLMResponseCache:
+    def __init__(self, generate_fn: Callable[[List[Dict]], Awaitable[str]], model: str, ttl: float, max_entries: int,
+                 shared: Optional[SharedCache] = None):
+        self.generate_fn = generate_fn
+        self.model = model
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expires_at, response)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.flights = SingleFlight()
+        self.shared = shared
+
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    async def generate(self, messages: List[Dict]) -> str:
+        key = messages_key(self.model, messages)
+        response = self._get(key)
+        if response is not None:
+            self.hits += 1
+            return response
+
+        response, shared = await self.flights.do(key, lambda: self._fetch(key, messages))
+        if shared:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        return response
+
+    async def _fetch(self, key: str, messages: List[Dict]) -> str:
+        if self.shared is not None:
+            response, shared = await self.shared.get_or_compute(key, lambda: self.generate_fn(messages), cacheable)
+            if shared:
+                self.shared_hits += 1
+        else:
+            response = await self.generate_fn(messages)
+        if cacheable(response):
+            self.entries[key] = (time.time() + self.ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return response
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def stats(self) -> Dict:
+        # Local misses include those answered by the shared backend
+        lookups = self.hits + self.coalesced + self.misses
+        saved = self.hits + self.coalesced + self.shared_hits
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "hit_ratio": round(saved / lookups, 4) if lookups else 0.0,
+        }
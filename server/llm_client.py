@@ -1,92 +1,160 @@
-import os
-import httpx
-import json
-from dotenv import load_dotenv
+import time
+from typing import Optional
 
-from pathlib import Path
-from config import LLM_MODEL, LLM_MAX_TOKENS, LLM_INTERNAL_MAX_TOKENS
+from config import OPENROUTER_API_KEY, OPENROUTER_API_URL
+from config import LLM_MODEL, LLM_FALLBACK_MODEL, LLM_MAX_TOKENS, LLM_INTERNAL_MAX_TOKENS
+from http_clients import get_http_client
+from metrics import trace, record_upstream, record_usage
+from resilience import CircuitOpenError, UpstreamError, get_upstream
+from sse_parser import DONE, SSEParser, parse_delta
 
-# Load .env from parent directory
-env_path = Path(__file__).parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
+class LLMError(Exception):
+    """Raised by stream_chat_response when OpenRouter cannot produce an answer."""
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 
-async def stream_chat_response(messages: list):
-    if not OPENROUTER_API_KEY:
-        yield "Error: OPENROUTER_API_KEY not set."
-        return
+def _models() -> list:
+    """LLM_MODEL, then LLM_FALLBACK_MODEL if one is configured."""
+    if LLM_FALLBACK_MODEL and LLM_FALLBACK_MODEL != LLM_MODEL:
+        return [LLM_MODEL, LLM_FALLBACK_MODEL]
+    return [LLM_MODEL]
 
-    headers = {
+def _headers() -> dict:
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
         "HTTP-Referer": "http://localhost:3000", # Required by OpenRouter
         "X-Title": "Project Cipher"
     }
+
+async def stream_chat_response(messages: list, stream_info: Optional[dict] = None, sampled: bool = True):
+    """Streams answer text from OpenRouter. `sampled` says whether the
+    request records trace spans.
+
+    If `stream_info` is given it is filled with "status_code", "usage",
+    "finish_reason" and the "model" that answered. Attempts that fail before
+    the first token are retried, then LLM_FALLBACK_MODEL is tried. Failures
+    raise LLMError.
+    """
+    if stream_info is None:
+        stream_info = {}
+    if not OPENROUTER_API_KEY:
+        raise LLMError("Error: OPENROUTER_API_KEY not set.")
+
+    last_error = None
+    for model in _models():
+        upstream = get_upstream(f"openrouter:{model}:stream", "openrouter", breaker=f"openrouter:{model}")
+        attempt = 0
+        while True:
+            try:
+                trial = upstream.check_circuit()
+            except CircuitOpenError as e:
+                last_error = e
+                break
+            started = time.perf_counter()
+            streaming = False
+            try:
+                async for content in _stream_once(model, messages, stream_info, upstream.timeout, sampled):
+                    if not streaming:
+                        streaming = True
+                        upstream.record_success(time.perf_counter() - started)
+                    yield content
+            except Exception as e:
+                upstream.record_failure(e)
+                print(f"LLM Exception ({model}): {e}")
+                if streaming:
+                    # Part of the answer is already out; a retry would repeat it
+                    raise LLMError(f"Error generating response: {str(e)}") from e
+                last_error = e
+                if not await upstream.retry_wait(attempt, e):
+                    break
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled or closed before the first token, e.g. the client left
+                if not streaming:
+                    upstream.record_cancelled(trial)
+                raise
+            if not streaming:
+                upstream.record_success(time.perf_counter() - started)
+            stream_info["model"] = model
+            record_usage("stream", stream_info.get("usage"))
+            return
+        if model != _models()[-1]:
+            print(f"Falling back from {model} to {LLM_FALLBACK_MODEL}")
+
+    if isinstance(last_error, (UpstreamError, CircuitOpenError)):
+        raise LLMError(f"Error: {last_error}") from last_error
+    raise LLMError(f"Error generating response: {str(last_error)}") from last_error
+
+async def _stream_once(model: str, messages: list, stream_info: dict, timeout: float, sampled: bool = True):
     payload = {
-        "model": LLM_MODEL,
+        "model": model,
         "messages": messages,
         "stream": True,
-        "max_tokens": LLM_MAX_TOKENS
+        "max_tokens": LLM_MAX_TOKENS,
+        "usage": {"include": True}
     }
+    client = get_http_client("openrouter")
+    with trace("llm", "stream", sampled=sampled):
+        async with client.stream("POST", OPENROUTER_API_URL, json=payload, headers=_headers(), timeout=timeout) as response:
+            stream_info["status_code"] = response.status_code
+            record_upstream("openrouter", "stream", response.status_code)
+            if response.status_code != 200:
+                error_text = await response.aread()
+                raise UpstreamError(f"OpenRouter returned {response.status_code}: {error_text.decode('utf-8')}",
+                                    response.status_code)
 
-    async with httpx.AsyncClient() as client:
-        try:
-            print(f"Sending request to OpenRouter: {LLM_MODEL}")
-            async with client.stream("POST", OPENROUTER_API_URL, json=payload, headers=headers, timeout=30.0) as response:
-                print(f"OpenRouter Status: {response.status_code}")
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    print(f"OpenRouter Error: {error_text}")
-                    yield f"Error: OpenRouter returned {response.status_code}: {error_text.decode('utf-8')}"
-                    return
-
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]
-                        if data_str.strip() == "[DONE]":
-                            break
-                        try:
-                            data = json.loads(data_str)
-                            delta = data["choices"][0]["delta"]
-                            content = delta.get("content", "")
-                            if content:
-                                print(f"Chunk: {content}", end="", flush=True)
-                                yield content
-                        except json.JSONDecodeError:
-                            continue
-        except Exception as e:
-            print(f"LLM Exception: {e}")
-            yield f"Error generating response: {str(e)}"
+            parser = SSEParser()
+            async for chunk in response.aiter_bytes():
+                for data in parser.feed(chunk):
+                    if data == DONE:
+                        return
+                    delta = parse_delta(data)
+                    if delta is None:
+                        continue
+                    if delta.usage:
+                        stream_info["usage"] = delta.usage
+                    if delta.finish_reason:
+                        stream_info["finish_reason"] = delta.finish_reason
+                    if delta.content:
+                        yield delta.content
+
+async def generate_chat_response(messages: list, operation: str = "generate", hedge: bool = True) -> str:
+    """Non-streaming version for internal logic (e.g. query rewriting).
+    Retried and hedged, with LLM_FALLBACK_MODEL as a last resort.
 
-async def generate_chat_response(messages: list) -> str:
-    """Non-streaming version for internal logic (e.g. query rewriting)"""
+    `operation` keeps latency (and so the hedge delay) separate for calls of
+    different sizes; pass `hedge=False` for long, expensive calls."""
     if not OPENROUTER_API_KEY:
         return "Error: OPENROUTER_API_KEY not set."
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:3000",
-        "X-Title": "Project Cipher"
-    }
+    last_error = None
+    for model in _models():
+        upstream = get_upstream(f"openrouter:{model}:{operation}", "openrouter", breaker=f"openrouter:{model}")
+        try:
+            return await upstream.call(lambda: _generate_once(model, messages, upstream.timeout, operation), hedge=hedge)
+        except Exception as e:
+            print(f"LLM Generation Exception ({model}): {e}")
+            last_error = e
+
+    if isinstance(last_error, UpstreamError) and last_error.status_code:
+        return f"Error: {last_error.status_code}"
+    return ""
+
+async def _generate_once(model: str, messages: list, timeout: float, operation: str = "generate") -> str:
     payload = {
-        "model": LLM_MODEL,
+        "model": model,
         "messages": messages,
         "stream": False,
         "max_tokens": LLM_INTERNAL_MAX_TOKENS
     }
+    client = get_http_client("openrouter")
+    with trace("llm", operation):
+        response = await client.post(OPENROUTER_API_URL, json=payload, headers=_headers(), timeout=timeout)
+    record_upstream("openrouter", operation, response.status_code)
+    if response.status_code != 200:
+        raise UpstreamError(f"OpenRouter returned {response.status_code}", response.status_code)
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(OPENROUTER_API_URL, json=payload, headers=headers, timeout=30.0)
-            if response.status_code != 200:
-                return f"Error: {response.status_code}"
-            
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
-        except Exception as e:
-            print(f"LLM Generation Exception: {e}")
-            return ""
+    data = response.json()
+    record_usage(operation, data.get("usage"))
+    return data["choices"][0]["message"]["content"]
@@ -1,11 +1,106 @@
-from fastapi import FastAPI, HTTPException
+import time
+IMPORTS_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
-from chat_service import chat_pipeline
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+from chat_service import chat_pipeline, embedding_service, search_cache, llm_cache, persistence_queue, retriever, summary_scheduler
+from chat_service import shared_backend
+from http_clients import init_http_clients, close_http_clients, get_pool_stats
+from resilience import get_upstream_stats
+from database import ensure_indexes
+from streaming import MEDIA_TYPES, encode_stream, negotiate_format
+from admission import AdmissionController, AdmissionRejected
+from startup import Startup
+from context_builder import load_tokenizer
+from config import CLIENT_ID_HEADER, STARTUP_BACKGROUND_LOADING, EMBEDDING_WARMUP, CONVERSATION_PAGE_MAX_LIMIT
+from config import PERSIST_READ_WAIT, STARTUP_RETRY_DELAY, STARTUP_RETRY_MAX_DELAY
+import metrics
+from typing import Optional
+import asyncio
+import base64
+import json
 import uuid
 
-app = FastAPI(title="Project Cipher")
+IMPORTS_SECONDS = time.perf_counter() - IMPORTS_STARTED
+
+startup = Startup(started=IMPORTS_STARTED)
+startup.record("imports", IMPORTS_SECONDS)
+
+async def create_indexes():
+    # Not required for readiness: queries work without the indexes, just slower
+    with startup.phase("indexes", required=False):
+        try:
+            await ensure_indexes()
+        except Exception as e:
+            print(f"Index creation failed: {e}")
+            raise
+
+async def load_tokenizer_phase():
+    # The first count_tokens call would otherwise load it on the event loop
+    with startup.phase("tokenizer"):
+        await asyncio.get_running_loop().run_in_executor(None, load_tokenizer)
+
+async def load_embedding_model():
+    with startup.phase("embedding_model"):
+        await embedding_service.load()
+    if EMBEDDING_WARMUP:
+        # Required: /ready waits so the first routed request doesn't pay for it
+        with startup.phase("embedding_warmup"):
+            await embedding_service.warmup()
+
+async def load_models():
+    await asyncio.gather(load_tokenizer_phase(), load_embedding_model())
+    print(f"Startup complete: {startup.summary()}")
+
+async def load_models_until_ready():
+    """Retries load_models until every phase is ok. A failed phase keeps /ready
+    at 503; the retry also picks up a model a request loaded lazily since."""
+    delay = STARTUP_RETRY_DELAY
+    while True:
+        try:
+            await load_models()
+            return
+        except Exception as e:
+            print(f"Model loading failed, retrying in {delay:.0f}s: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup.phase("http_clients"):
+        init_http_clients()
+    with startup.phase("workers"):
+        embedding_service.start()
+        persistence_queue.start()
+    startup.background(create_indexes())
+    startup.expect("tokenizer")
+    startup.expect("embedding_model")
+    if EMBEDDING_WARMUP:
+        startup.expect("embedding_warmup")
+    if STARTUP_BACKGROUND_LOADING:
+        startup.background(load_models_until_ready())
+    else:
+        await load_models()
+    print(f"Accepting requests after {startup.report()['uptime_ms']:.0f}ms: {startup.summary()}")
+    yield
+    await startup.stop()
+    await summary_scheduler.stop()
+    await persistence_queue.stop()
+    await embedding_service.stop()
+    await close_http_clients()
+    await shared_backend.close()
+
+app = FastAPI(title="Project Cipher", lifespan=lifespan)
+
+admission = AdmissionController(
+    lock_backend=shared_backend,
+    settle=lambda conversation_id: persistence_queue.wait_written(conversation_id, timeout=PERSIST_READ_WAIT),
+    on_handoff=retriever.evict,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,36 +108,160 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Conversation-Id"],
 )
 
 class ChatRequest(BaseModel):
     query: str
     conversation_id: str = None
+    # "text" (default), "sse" or "ndjson"; may also be chosen via Accept header
+    stream_format: Optional[str] = None
 
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     conversation_id = request.conversation_id or str(uuid.uuid4())
+    stream_format = negotiate_format(request.stream_format, http_request.headers.get("accept", ""))
+    client_id = http_request.headers.get(CLIENT_ID_HEADER) or (http_request.client.host if http_request.client else "unknown")
     
-    async def generate():
-        async for chunk in chat_pipeline(request.query, conversation_id):
-            yield chunk
-
-    return StreamingResponse(generate(), media_type="text/plain")
+    try:
+        ticket = await admission.acquire(client_id, conversation_id)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+    
+    async def admitted_stream():
+        # The slot is held until the stream ends or the client goes away
+        try:
+            async for chunk in encode_stream(
+                chat_pipeline(request.query, conversation_id),
+                stream_format,
+                conversation_id,
+                is_disconnected=http_request.is_disconnected,
+            ):
+                yield chunk
+        finally:
+            ticket.release()
+    
+    headers = {"X-Conversation-Id": conversation_id, "Cache-Control": "no-cache"}
+    return StreamingResponse(admitted_stream(), media_type=MEDIA_TYPES[stream_format], headers=headers,
+                             background=BackgroundTask(ticket.release))
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    # Liveness is /health; this one fails until the embedding model is loaded
+    report = startup.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/stats/startup")
+async def startup_stats():
+    return startup.report()
+
+@app.get("/stats/http")
+async def http_stats():
+    return get_pool_stats()
+
+@app.get("/stats/upstreams")
+async def upstream_stats():
+    return get_upstream_stats()
+
+@app.get("/stats/admission")
+async def admission_stats():
+    return admission.stats()
+
+@app.get("/stats/embeddings")
+async def embedding_stats():
+    return embedding_service.stats()
+
+@app.get("/stats/search")
+async def search_stats():
+    return search_cache.stats()
+
+@app.get("/stats/llm")
+async def llm_cache_stats():
+    return llm_cache.stats()
+
+@app.get("/stats/shared")
+async def shared_stats():
+    caches = {"search": search_cache.shared, "llm": llm_cache.shared}
+    return {
+        "backend": shared_backend.name,
+        "caches": {name: cache.stats() for name, cache in caches.items() if cache is not None},
+    }
+
+@app.get("/stats/persistence")
+async def persistence_stats():
+    return persistence_queue.stats()
+
+@app.get("/stats/retriever")
+async def retriever_stats():
+    return retriever.stats()
+
+@app.get("/stats/summaries")
+async def summary_stats():
+    return summary_scheduler.stats()
+
+metrics.REGISTRY.gauge("chat_active_turns", "Chat turns holding an admission slot", lambda: admission.active)
+metrics.REGISTRY.gauge("chat_queued_turns", "Chat turns waiting for an admission slot", lambda: admission.queued)
+metrics.REGISTRY.gauge("embedding_queue_depth", "Texts waiting for or in an embedding batch",
+                       lambda: embedding_service.stats()["queue_depth"])
+metrics.REGISTRY.gauge("persistence_pending_turns", "Turns waiting to be written to MongoDB",
+                       lambda: persistence_queue.stats()["pending_turns"])
+metrics.REGISTRY.gauge("search_cache_hit_ratio", "Search cache hit ratio since startup",
+                       lambda: search_cache.stats()["hit_ratio"])
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 from chat_service import get_user_conversations, get_conversation_messages
 from chat_service import get_user_conversations, get_conversation_messages, delete_conversation
+from chat_service import iter_conversation_messages
+
+def encode_cursor(conversation: dict) -> str:
+    raw = json.dumps([conversation["timestamp"], conversation["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(timestamp), str(conversation_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.get("/conversations")
-async def list_conversations():
-    return await get_user_conversations()
+async def list_conversations(
+    limit: int = Query(100, ge=1, le=500),
+    before: Optional[float] = None,
+    before_id: Optional[str] = None,
+):
+    return await get_user_conversations(limit, before, before_id)
+
+@app.get("/conversations/page")
+async def list_conversations_page(limit: int = Query(20, ge=1, le=500), cursor: Optional[str] = None):
+    before, before_id = decode_cursor(cursor) if cursor else (None, None)
+    conversations = await get_user_conversations(limit, before, before_id)
+    next_cursor = encode_cursor(conversations[-1]) if len(conversations) == limit else None
+    return {"conversations": conversations, "next_cursor": next_cursor}
 
 @app.get("/conversations/{conversation_id}")
-async def read_conversation(conversation_id: str):
-    return await get_conversation_messages(conversation_id)
+async def read_conversation(
+    conversation_id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=CONVERSATION_PAGE_MAX_LIMIT),
+    before: Optional[float] = None,
+    after: Optional[float] = None,
+    format: Optional[str] = None,
+):
+    # ?format=ndjson or Accept: application/x-ndjson streams one message per line
+    if format == "ndjson" or (format is None and MEDIA_TYPES["ndjson"] in request.headers.get("accept", "")):
+        async def lines():
+            async for message in iter_conversation_messages(conversation_id, limit, before, after):
+                yield json.dumps(message) + "\n"
+        return StreamingResponse(lines(), media_type=MEDIA_TYPES["ndjson"])
+    return await get_conversation_messages(conversation_id, limit, before, after)
 
 @app.delete("/conversations/{conversation_id}")
 async def remove_conversation(conversation_id: str):
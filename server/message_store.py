@@ -0,0 +1,108 @@
+"""
+Storage schema for conversation messages.
+
+User messages store only the raw query, the search query that was used and
+an ordered list of references into the `search_results` collection. Its
+documents are shared across all turns and keyed by canonical URL plus a hash
+of the stored excerpt: excerpts depend on the query, so a later turn hitting
+the same URL adds a document instead of rewriting the one earlier messages
+render. The legacy "Search Results ... User Query: ..." content the frontend
+parses is rebuilt on read.
+"""
+import hashlib
+from typing import Dict, List, Tuple
+
+from pymongo import UpdateOne
+
+from database import conversations_collection, search_results_collection, conversations_meta_collection
+from context_builder import format_search_results
+from rank_fusion import canonical_url
+
+# Snippet length kept per source; matches what is shown to the model
+SOURCE_SNIPPET_CHARS = 300
+
+# Conversation titles are the start of the first message
+TITLE_CHARS = 50
+
+
+def source_documents(search_results: List[Dict]) -> List[Tuple[str, Dict]]:
+    """Returns (source_id, document) pairs in rank order, one per canonical URL
+    (the first occurrence wins). Documents never change once stored."""
+    documents: Dict[str, Tuple[str, Dict]] = {}
+    for res in search_results:
+        url = res.get("url")
+        if not url:
+            continue
+        url_key = canonical_url(url)
+        if url_key in documents:
+            continue
+        document = {
+            "url": url,
+            "canonical_url": url_key,
+            "title": res.get("title", "Untitled"),
+            "body": res.get("body", "")[:SOURCE_SNIPPET_CHARS],
+        }
+        digest = hashlib.sha256("\0".join((url, document["title"], document["body"])).encode("utf-8")).hexdigest()
+        documents[url_key] = (f"{url_key}#{digest[:16]}", document)
+    return list(documents.values())
+
+
+async def save_search_results(search_results: List[Dict], timestamp: float) -> List[str]:
+    """Stores search results and returns their ids in rank order."""
+    documents = source_documents(search_results)
+    operations = [
+        UpdateOne({"_id": source_id}, {"$setOnInsert": document, "$max": {"last_seen": timestamp}}, upsert=True)
+        for source_id, document in documents
+    ]
+    if operations:
+        await search_results_collection.bulk_write(operations, ordered=False)
+    return [source_id for source_id, _ in documents]
+
+
+def render_user_content(message: Dict, sources: Dict[str, Dict]) -> str:
+    """Rebuilds the legacy user message content with its search results."""
+    if "sources" not in message:
+        return message["content"]  # Legacy document, content already has the results
+    results = [sources[source_id] for source_id in message["sources"] if source_id in sources]
+    search_context = "\n".join(format_search_results(results))
+    search_query = message.get("search_query", message["content"])
+    return f"Search Results (for query: '{search_query}'):\n{search_context}\n\nUser Query: {message['content']}"
+
+
+async def load_sources(messages: List[Dict]) -> Dict[str, Dict]:
+    """Fetches every source referenced by the messages in one query."""
+    source_ids = {source_id for msg in messages for source_id in msg.get("sources", [])}
+    if not source_ids:
+        return {}
+    cursor = search_results_collection.find({"_id": {"$in": list(source_ids)}})
+    return {doc["_id"]: doc async for doc in cursor}
+
+
+async def update_conversations_meta(messages: List[Dict]):
+    """Folds newly written messages into their conversations' metadata documents.
+
+    Idempotent, so it can be retried together with the insert: message_count
+    is recounted rather than incremented, and both it and last_updated only
+    move forward ($max), so a slower concurrent writer never winds them back."""
+    by_conversation: Dict[str, List[Dict]] = {}
+    for message in messages:
+        by_conversation.setdefault(message["conversation_id"], []).append(message)
+    operations = []
+    for conversation_id, conversation_messages in by_conversation.items():
+        conversation_messages.sort(key=lambda m: m["timestamp"])
+        # Same roles as migrate_conversations_meta counts
+        message_count = await conversations_collection.count_documents(
+            {"conversation_id": conversation_id, "role": {"$in": ["user", "assistant"]}})
+        operations.append(UpdateOne(
+            {"_id": conversation_id},
+            {
+                "$setOnInsert": {
+                    "title": conversation_messages[0]["content"][:TITLE_CHARS],
+                    "created_at": conversation_messages[0]["timestamp"],
+                },
+                "$max": {"last_updated": conversation_messages[-1]["timestamp"], "message_count": message_count},
+            },
+            upsert=True,
+        ))
+    if operations:
+        await conversations_meta_collection.bulk_write(operations, ordered=False)
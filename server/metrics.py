@@ -0,0 +1,201 @@
+"""
+In-process metrics with a Prometheus text exposition.
+
+Counters and histograms are plain dicts keyed by label values and are only
+touched from the event loop, so recording is a dict lookup and an add.
+Latency spans (`trace`) are sampled per chat request: a request that is not
+sampled skips its spans, while counters (requests, status codes, tokens)
+are always recorded. The decision travels explicitly (on the PipelineRun and
+as the `sampled` argument of `trace`); the context variable only carries it
+into tasks started for the request, since a streamed response resumes in a
+different task on every step.
+"""
+import bisect
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import METRICS_SAMPLE_RATE, METRICS_LATENCY_BUCKETS
+
+# Whether the current request records trace spans. Background work that runs
+# outside a request (persistence, summaries) is always recorded.
+_sampled: ContextVar[bool] = ContextVar("metrics_sampled", default=True)
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callback at scrape time, e.g. a queue depth."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Gauge {self.name} failed: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_format_value(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = METRICS_LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        self.metrics[name] = Gauge(name, help, fn)
+        return self.metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+CHAT_REQUESTS = REGISTRY.counter("chat_requests_total", "Chat turns by outcome", ["outcome"])
+STAGE_SECONDS = REGISTRY.histogram("chat_stage_seconds", "Pipeline stage durations", ["stage", "status"])
+TTFT_SECONDS = REGISTRY.histogram("chat_time_to_first_token_seconds", "Request start to first answer token")
+GENERATION_SECONDS = REGISTRY.histogram("chat_generation_seconds", "Answer streaming duration")
+PROMPT_TOKENS = REGISTRY.histogram("chat_prompt_tokens", "Assembled prompt size in tokens", buckets=TOKEN_BUCKETS)
+SPAN_SECONDS = REGISTRY.histogram("span_seconds", "Latency of traced calls", ["component", "operation"])
+UPSTREAM_RESPONSES = REGISTRY.counter("upstream_responses_total", "Upstream HTTP responses by status code",
+                                      ["upstream", "operation", "status_code"])
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "Tokens reported by OpenRouter", ["operation", "kind"])
+QUERY_REWRITES = REGISTRY.counter("query_rewrites_total", "Query rewrite decisions", ["decision"])
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram("embedding_batch_size", "Texts per embedding batch", buckets=SIZE_BUCKETS)
+
+
+def sample_request(rate: Optional[float] = None) -> bool:
+    """Decides whether a request records trace spans."""
+    rate = METRICS_SAMPLE_RATE if rate is None else rate
+    return rate >= 1.0 or random.random() < rate
+
+
+def set_sampling(sampled: bool) -> None:
+    """Applies a request's sampling decision to the current task (and the
+    tasks it starts from here on)."""
+    _sampled.set(sampled)
+
+
+def is_sampled() -> bool:
+    return _sampled.get()
+
+
+@contextmanager
+def trace(component: str, operation: str, sampled: Optional[bool] = None):
+    """Records the duration of the enclosed block as a span. `sampled`
+    overrides the decision of the current task.
+
+    Usage: `with trace("mongo", "recent_messages"): ...`
+    """
+    if not (_sampled.get() if sampled is None else sampled):
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - started, component=component, operation=operation)
+
+
+def record_upstream(upstream: str, operation: str, status_code) -> None:
+    UPSTREAM_RESPONSES.inc(upstream=upstream, operation=operation, status_code=status_code)
+
+
+def record_usage(operation: str, usage: Optional[Dict]) -> None:
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.inc(usage[kind], operation=operation, kind=kind.split("_")[0])
+
+
+def record_pipeline(report: Dict, sampled: bool) -> None:
+    """Records the per-stage timings of a finished PipelineRun report."""
+    if not sampled:
+        return
+    for stage, timing in report.get("stages", {}).items():
+        STAGE_SECONDS.observe(timing["duration_ms"] / 1000, stage=stage, status=timing["status"])
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,43 @@
+"""
+Builds the `conversations_meta` collection from existing messages.
+
+New writes keep the metadata up to date incrementally; this one-off backfill
+covers conversations created before it existed. Run it after
+migrate_slim_messages.py so titles come from the raw queries.
+
+Usage (from the server directory):
+    python migrate_conversations_meta.py
+"""
+import asyncio
+
+from database import conversations_collection, conversations_meta_collection, ensure_indexes
+from message_store import TITLE_CHARS
+
+
+async def backfill():
+    await ensure_indexes()
+    pipeline = [
+        {"$match": {"role": {"$in": ["user", "assistant"]}}},
+        {"$sort": {"conversation_id": 1, "timestamp": 1}},
+        {"$group": {
+            "_id": "$conversation_id",
+            "first_message": {"$first": "$content"},
+            "created_at": {"$first": "$timestamp"},
+            "last_updated": {"$last": "$timestamp"},
+            "message_count": {"$sum": 1},
+        }},
+        {"$project": {
+            "title": {"$substrCP": ["$first_message", 0, TITLE_CHARS]},
+            "created_at": 1,
+            "last_updated": 1,
+            "message_count": 1,
+        }},
+        {"$merge": {"into": conversations_meta_collection.name, "on": "_id", "whenMatched": "merge", "whenNotMatched": "insert"}},
+    ]
+    await conversations_collection.aggregate(pipeline).to_list(length=None)
+    count = await conversations_meta_collection.count_documents({})
+    print(f"conversations_meta now has {count} conversations")
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill())
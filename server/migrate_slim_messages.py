@@ -0,0 +1,109 @@
+"""
+Migrates legacy user messages to the slim storage schema.
+
+Legacy user messages store the whole "Search Results ... User Query: ..."
+blob as their content. This tool extracts the search results into the shared
+`search_results` collection (deduped by URL and excerpt) and rewrites each
+message to hold only the raw query, the search query and references to its
+sources. Messages whose migrated form would not render back to exactly the
+original content, given the source documents already stored, are left
+untouched and reported as skipped.
+
+Usage (from the server directory):
+    python migrate_slim_messages.py [--dry-run] [--batch-size 500]
+"""
+import argparse
+import asyncio
+import re
+
+from pymongo import UpdateOne
+
+from database import conversations_collection
+from message_store import load_sources, render_user_content, save_search_results, source_documents
+
+LEGACY_CONTENT = re.compile(r"^Search Results \(for query: '(.*?)'\):\n(.*?)\n\nUser Query: (.*)$", re.DOTALL)
+# "[n] title (url): body". URLs have no whitespace but may contain ")", so the
+# URL runs to the last "): " of the first whitespace-free token after " (".
+LEGACY_RESULT = re.compile(r"\[\d+\] (.*?) \(((?:https?://|#)\S*)\): (.*)$", re.DOTALL)
+
+
+def parse_legacy_content(content: str):
+    """Returns (search_query, results, query) or None if not a legacy blob."""
+    match = LEGACY_CONTENT.match(content)
+    if not match:
+        return None
+    search_query, block, query = match.groups()
+    # Entries start with "[1] ", "[2] ", ... at the start of a line; any other
+    # line belongs to the previous entry's body
+    entries = []
+    for line in block.split("\n"):
+        if line.startswith(f"[{len(entries) + 1}] ") or not entries:
+            entries.append(line)
+        else:
+            entries[-1] += "\n" + line
+    results = []
+    for entry in entries:
+        result = LEGACY_RESULT.match(entry)
+        if not result:
+            return None
+        title, url, body = result.groups()
+        if body.endswith("..."):
+            body = body[:-3]
+        results.append({"title": title, "url": url, "body": body})
+    return search_query, results, query
+
+
+def render_migrated(search_query: str, results, query: str, stored=None) -> str:
+    """The content reads will rebuild for the migrated message, storing the
+    results the way save_search_results does. `stored` holds source documents
+    already in the collection; saving never overwrites them, so they win."""
+    documents = source_documents(results)
+    sources = {source_id: document for source_id, document in documents}
+    sources.update(stored or {})
+    message = {"content": query, "search_query": search_query, "sources": [source_id for source_id, _ in documents]}
+    return render_user_content(message, sources)
+
+
+async def migrate(dry_run: bool, batch_size: int):
+    cursor = conversations_collection.find(
+        {"role": "user", "sources": {"$exists": False}, "content": {"$regex": "^Search Results"}},
+        {"content": 1, "timestamp": 1},
+    )
+    migrated = skipped = saved_bytes = 0
+    operations = []
+    async for msg in cursor:
+        parsed = parse_legacy_content(msg["content"])
+        # Content is overwritten, so only migrate what round-trips exactly,
+        # including against sources earlier messages already stored
+        stored = {}
+        if parsed is not None:
+            stored = await load_sources([{"sources": [source_id for source_id, _ in source_documents(parsed[1])]}])
+        if parsed is None or render_migrated(*parsed, stored=stored) != msg["content"]:
+            skipped += 1
+            continue
+        search_query, results, query = parsed
+        saved_bytes += len(msg["content"].encode("utf-8")) - len(query.encode("utf-8"))
+        migrated += 1
+        if dry_run:
+            continue
+        source_ids = await save_search_results(results, msg["timestamp"])
+        operations.append(UpdateOne(
+            {"_id": msg["_id"]},
+            {"$set": {"content": query, "search_query": search_query, "sources": source_ids}},
+        ))
+        if len(operations) >= batch_size:
+            await conversations_collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await conversations_collection.bulk_write(operations, ordered=False)
+
+    action = "Would migrate" if dry_run else "Migrated"
+    print(f"{action} {migrated} messages ({saved_bytes / 1024:.1f} KiB of content removed), skipped {skipped} that do not round-trip")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--batch-size", type=int, default=500, help="messages per bulk write")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.dry_run, args.batch_size))
@@ -0,0 +1,197 @@
+"""
+Write-behind persistence for chat turns.
+
+Finished turns are queued and written by a background worker, so the HTTP
+stream can close without waiting on MongoDB. The worker batches turns from
+concurrent conversations into one ordered insert_many, retries transient
+errors and drains the queue on shutdown. When the queue is full, callers
+wait briefly and then write inline, which pushes back on new work instead
+of growing memory without bound.
+"""
+import asyncio
+import random
+import time
+from typing import Callable, Dict, List
+
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError, ConnectionFailure, NetworkTimeout
+
+from config import (
+    PERSIST_QUEUE_MAX_TURNS,
+    PERSIST_BATCH_SIZE,
+    PERSIST_BATCH_WINDOW,
+    PERSIST_MAX_RETRIES,
+    PERSIST_ENQUEUE_TIMEOUT,
+    PERSIST_DRAIN_TIMEOUT,
+)
+from database import conversations_collection
+from message_store import save_search_results, update_conversations_meta
+from metrics import trace
+
+TRANSIENT_ERRORS = (AutoReconnect, ConnectionFailure, NetworkTimeout)
+DUPLICATE_KEY = 11000
+
+
+class PersistenceQueue:
+    def __init__(self, max_pending: int = PERSIST_QUEUE_MAX_TURNS, batch_size: int = PERSIST_BATCH_SIZE,
+                 batch_window: float = PERSIST_BATCH_WINDOW, max_retries: int = PERSIST_MAX_RETRIES):
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self._queue: asyncio.Queue = None
+        self._worker: asyncio.Task = None
+        # Callbacks run with the written messages, e.g. to update local indexes
+        self.on_written: List[Callable[[List[Dict]], None]] = []
+        # conversation_id -> futures of its turns not yet written
+        self._unwritten: Dict[str, set] = {}
+
+        self.written_turns = 0
+        self.failed_turns = 0
+        self.inline_writes = 0
+        self.batches = 0
+        self.retries = 0
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = PERSIST_DRAIN_TIMEOUT):
+        """Waits for queued turns to be written, then stops the worker."""
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Persistence drain timed out, {self._queue.qsize()} turns not written")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def enqueue(self, turn: Dict):
+        """Queues a turn for writing.
+
+        A turn is {"messages": [...], "search_results": [...], "timestamp": float}.
+        Messages get their _id assigned here so retried inserts are idempotent.
+        """
+        for message in turn["messages"]:
+            message.setdefault("_id", ObjectId())
+        self._track(turn)
+        self.start()
+        try:
+            await asyncio.wait_for(self._queue.put(turn), timeout=PERSIST_ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("Persistence queue full, writing turn inline")
+            self.inline_writes += 1
+            await self._write([turn])
+
+    def _track(self, turn: Dict):
+        conversation_id = turn["messages"][0]["conversation_id"]
+        future = asyncio.get_running_loop().create_future()
+        pending = self._unwritten.setdefault(conversation_id, set())
+        pending.add(future)
+
+        def forget(_):
+            pending.discard(future)
+            if not pending and self._unwritten.get(conversation_id) is pending:
+                del self._unwritten[conversation_id]
+
+        future.add_done_callback(forget)
+        turn["written"] = future
+
+    async def wait_written(self, conversation_id: str, timeout: float):
+        """Waits until earlier turns of a conversation are written (or have
+        failed), so a follow-up turn reads the history it expects."""
+        pending = list(self._unwritten.get(conversation_id, ()))
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, turns: List[Dict]):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                with trace("mongo", "insert_turns"):
+                    await self._write_once(turns, ordered=attempt == 0)
+                self.written_turns += len(turns)
+                self.batches += 1
+                break
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    error = e
+                    break
+                self.retries += 1
+                delay = min(0.1 * 2 ** attempt, 2.0) * random.uniform(0.5, 1.0)
+                print(f"Persistence transient error ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                error = e
+                break
+        if error is None:
+            await self._after_write(turns)
+        else:
+            self.failed_turns += len(turns)
+            print(f"Persistence failed for {len(turns)} turns: {error}")
+        for turn in turns:
+            written = turn.get("written")
+            if written is not None and not written.done():
+                written.set_result(error is None)
+
+    async def _after_write(self, turns: List[Dict]):
+        messages = [m for turn in turns for m in turn["messages"]]
+        for callback in self.on_written:
+            try:
+                callback(messages)
+            except Exception as e:
+                print(f"Persistence callback failed: {e}")
+
+    async def _write_once(self, turns: List[Dict], ordered: bool):
+        # Sources first so every message reference resolves once it is visible
+        for turn in turns:
+            source_ids = await save_search_results(turn.get("search_results", []), turn["timestamp"])
+            for message in turn["messages"]:
+                if message["role"] == "user":
+                    message["sources"] = source_ids
+        documents = [message for turn in turns for message in turn["messages"]]
+        try:
+            await conversations_collection.insert_many(documents, ordered=ordered)
+        except BulkWriteError as e:
+            # A retry after a partially applied write hits the already inserted ids
+            errors = e.details.get("writeErrors", [])
+            if not errors or any(err.get("code") != DUPLICATE_KEY for err in errors):
+                raise
+        # Inside the retry loop: the update is idempotent, so a transient
+        # error here is retried like the insert instead of drifting the count
+        with trace("mongo", "update_meta"):
+            await update_conversations_meta(documents)
+
+    def stats(self) -> Dict:
+        return {
+            "pending_turns": self._queue.qsize() if self._queue else 0,
+            "written_turns": self.written_turns,
+            "failed_turns": self.failed_turns,
+            "inline_writes": self.inline_writes,
+            "batches": self.batches,
+            "retries": self.retries,
+        }
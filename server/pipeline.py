@@ -0,0 +1,93 @@
+"""
+Lightweight stage scheduler for the chat pipeline.
+
+Stages are started as soon as their inputs are available and run concurrently.
+Each stage has its own timeout, and the whole run shares a cancellation budget:
+once the budget is spent, stages still running are cancelled and the pipeline
+continues with whatever results it already has.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from metrics import set_sampling
+
+
+class PipelineRun:
+    """Tracks the stages of a single chat turn."""
+
+    def __init__(self, budget: float, sampled: bool = True):
+        self.started = time.perf_counter()
+        # Whether this turn records trace spans (see metrics.sample_request)
+        self.sampled = sampled
+        self.deadline = self.started + budget
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.timings: Dict[str, Dict[str, Any]] = {}
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.perf_counter())
+
+    def start(self, name: str, coro: Awaitable, timeout: Optional[float] = None) -> asyncio.Task:
+        """Schedules a stage immediately and returns its task."""
+        task = asyncio.create_task(self._run(name, coro, timeout))
+        task.add_done_callback(lambda t: self._finalize(name, coro))
+        self.tasks[name] = task
+        return task
+
+    def _finalize(self, name: str, coro: Awaitable):
+        # A stage cancelled before it got to run never awaited its coroutine
+        if name not in self.timings:
+            coro.close()
+            self.timings[name] = {"status": "cancelled", "start_ms": None, "duration_ms": 0.0}
+
+    async def _run(self, name: str, coro: Awaitable, timeout: Optional[float]):
+        started = time.perf_counter()
+        limit = self.remaining() if timeout is None else min(timeout, self.remaining())
+        status = "ok"
+        # Each stage is its own task; spans inside it follow the run's decision
+        set_sampling(self.sampled)
+        try:
+            return await asyncio.wait_for(coro, timeout=limit)
+        except asyncio.TimeoutError:
+            status = "timeout"
+            raise
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.timings[name] = {
+                "status": status,
+                "start_ms": round((started - self.started) * 1000, 1),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+
+    async def result(self, name: str, default: Any = None) -> Any:
+        """Waits for a stage and returns its result, or `default` if it failed,
+        timed out or was cancelled."""
+        task = self.tasks.get(name)
+        if task is None:
+            return default
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise  # The caller itself is being cancelled
+            return default
+        except Exception as e:
+            print(f"Stage '{name}' failed: {type(e).__name__}: {e}")
+            return default
+
+    def cancel_pending(self):
+        """Cancels every stage that has not finished yet."""
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages": dict(self.timings),
+        }
@@ -40,3 +40,36 @@ History: User: "Who is CEO of Google?" Assistant: "Sundar Pichai."
 User: "How old is he?"
 Rewritten: "How old is Sundar Pichai"
 """
+
+def get_fanout_prompt(max_queries: int) -> str:
+    """Returns the prompt for rewriting a query into several search sub-queries."""
+    return f"""You are a search query planning assistant.
+Your task is to turn the user's latest query into at most {max_queries} web search queries, resolving any coreferences (like "it", "they", "that company") using the provided chat history.
+The FIRST line must be the user's query rewritten as a standalone search query (or returned exactly as is if it is already standalone).
+Each following line is a different sub-query that covers another aspect of the question. Only add sub-queries that would find genuinely different sources.
+Do NOT answer the question. Return one query per line, with no numbering, bullets or quotes.
+
+Example:
+History: User: "Who is CEO of Google?" Assistant: "Sundar Pichai."
+User: "How did he get the job and what did he do before?"
+Output:
+How did Sundar Pichai become CEO of Google
+Sundar Pichai career before Google CEO
+Sundar Pichai Chrome Android leadership
+"""
+
+def get_summarization_prompt(previous_summary: str, conversation_text: str) -> str:
+    """Returns the prompt for folding new messages into a rolling conversation summary."""
+    previous = previous_summary or "(none yet)"
+    return f"""Update the running summary of a conversation with the new messages below.
+Keep it concise, capturing key facts, user preferences, and the current topic.
+Do not lose important technical details from either the existing summary or the new messages.
+Return only the updated summary.
+
+Existing summary:
+{previous}
+
+New messages:
+{conversation_text}
+
+Updated summary:"""
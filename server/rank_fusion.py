@@ -0,0 +1,41 @@
+"""
+Merging of search result lists with URL deduplication and reciprocal-rank fusion.
+"""
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+# Standard RRF damping constant (Cormack et al., 2009)
+RRF_K = 60
+
+
+def canonical_url(url: str) -> str:
+    """Normalizes a URL so trivially different forms of the same page match."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{host}{path}{query}" if host else url.strip()
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], limit: int, k: int = RRF_K) -> List[Dict]:
+    """Fuses ranked result lists into one, scoring each URL by sum(1 / (k + rank)).
+
+    Results without a URL are kept as distinct entries. The first occurrence
+    of a URL provides the result body.
+    """
+    scores: Dict[str, float] = {}
+    results: Dict[str, Dict] = {}
+    for result_list in result_lists:
+        seen = set()
+        for rank, result in enumerate(result_list, start=1):
+            url = result.get("url")
+            key = canonical_url(url) if url else f"#{id(result)}"
+            if key in seen:
+                continue  # Duplicates within one list only count once
+            seen.add(key)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            results.setdefault(key, result)
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [results[key] for key in ranked[:limit]]
@@ -0,0 +1,269 @@
+"""
+Resilience policies for upstream calls (OpenRouter, Parallel).
+
+Each upstream gets an `Upstream` with its policy from UPSTREAM_POLICIES:
+
+    retries          bounded retries with exponential backoff and full jitter
+                     for timeouts, connection errors, 429 and 5xx responses
+    hedging          for idempotent calls, a second attempt is sent when the
+                     first is slower than the observed p95 latency; the first
+                     success wins and the other attempt is cancelled
+    circuit breaker  after `breaker_failures` consecutive failures the circuit
+                     opens and calls fail fast with CircuitOpenError for
+                     `breaker_reset` seconds, then one trial call is let through
+
+Callers decide the fallback (answer without search, switch model). Calls of
+different shapes on one upstream (streamed answers, short rewrites, long
+summaries) get separate Upstreams, so each learns its own latency and hedge
+delay, while sharing the circuit breaker of the model they call.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from config import UPSTREAM_POLICIES
+from metrics import REGISTRY
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Latencies needed before the hedge delay follows the observed p95
+HEDGE_MIN_SAMPLES = 20
+
+UPSTREAM_EVENTS = REGISTRY.counter("upstream_events_total", "Retries, hedges and circuit breaker events",
+                                   ["upstream", "event"])
+
+
+class UpstreamError(Exception):
+    """An upstream returned an error response."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while its circuit is open."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, UpstreamError):
+        return error.retryable
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self):
+        """Frees the half-open trial slot without judging the upstream, for a
+        trial call that was cancelled."""
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns True if this failure opened the circuit."""
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            newly_opened = self.state != "open"
+            self.opened_at = time.monotonic()
+            if newly_opened:
+                self.times_opened += 1
+            return newly_opened
+        return False
+
+
+class Upstream:
+    def __init__(self, name: str, policy: Dict[str, Any], breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.timeout = policy["timeout"]
+        self.retries = policy["retries"]
+        self.backoff_base = policy["backoff_base"]
+        self.backoff_max = policy["backoff_max"]
+        self.hedge = policy["hedge"]
+        self.hedge_min_delay = policy["hedge_min_delay"]
+        self.hedge_default_delay = policy["hedge_default_delay"]
+        self.breaker = breaker or CircuitBreaker(policy["breaker_failures"], policy["breaker_reset"])
+        self.latencies = deque(maxlen=200)
+
+        self.attempts = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return self.hedge_default_delay
+        ordered = sorted(self.latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95) - 1])
+
+    def check_circuit(self) -> bool:
+        """Call before each attempt; raises CircuitOpenError to fail fast.
+        Returns True if this attempt is the half-open trial call."""
+        self.attempts += 1
+        trial = self.breaker.state == "half_open"
+        if not self.breaker.allow():
+            self.rejected += 1
+            UPSTREAM_EVENTS.inc(upstream=self.name, event="rejected")
+            raise CircuitOpenError(f"{self.name} circuit open")
+        return trial
+
+    def record_success(self, latency: Optional[float] = None):
+        if latency is not None:
+            self.latencies.append(latency)
+        self.breaker.record_success()
+
+    def record_cancelled(self, trial: bool):
+        # A cancelled call (client went away) counts as neither success nor
+        # failure, but must not keep the half-open trial slot forever
+        if trial:
+            self.breaker.release_trial()
+
+    def record_failure(self, error: BaseException):
+        # Client errors (bad request, auth) say nothing about upstream health
+        if not is_retryable(error):
+            self.breaker.trial_in_flight = False
+            return
+        if self.breaker.record_failure():
+            print(f"{self.name} circuit opened after {self.breaker.failures} failures: {error}")
+            UPSTREAM_EVENTS.inc(upstream=self.name, event="circuit_opened")
+
+    async def retry_wait(self, attempt: int, error: BaseException) -> bool:
+        """Sleeps before retry `attempt + 1`. Returns False when the error is
+        final (not retryable, retries exhausted or circuit opened)."""
+        if attempt >= self.retries or not is_retryable(error) or self.breaker.state == "open":
+            return False
+        self.retried += 1
+        UPSTREAM_EVENTS.inc(upstream=self.name, event="retry")
+        await asyncio.sleep(self.backoff(attempt))
+        return True
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], idempotent: bool = True,
+                   hedge: Optional[bool] = None) -> Any:
+        """Calls `fn` under this upstream's policy. Retries and hedging only
+        apply to idempotent calls; `hedge=False` turns hedging off for calls
+        too expensive to send twice."""
+        hedge = self.hedge if hedge is None else hedge
+        attempt = 0
+        while True:
+            trial = self.check_circuit()
+            started = time.perf_counter()
+            try:
+                if idempotent and hedge:
+                    result = await self._hedged(fn)
+                else:
+                    result = await asyncio.wait_for(fn(), timeout=self.timeout)
+            except Exception as e:
+                self.record_failure(e)
+                if not idempotent or not await self.retry_wait(attempt, e):
+                    raise
+                attempt += 1
+                continue
+            except BaseException:
+                self.record_cancelled(trial)
+                raise
+            self.record_success(time.perf_counter() - started)
+            return result
+
+    async def _hedged(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        first = asyncio.ensure_future(asyncio.wait_for(fn(), timeout=self.timeout))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay())
+            if done:
+                return first.result()
+
+            self.hedged += 1
+            UPSTREAM_EVENTS.inc(upstream=self.name, event="hedge")
+            second = asyncio.ensure_future(asyncio.wait_for(fn(), timeout=self.timeout))
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing attempt, or both if the caller was cancelled
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "times_opened": self.breaker.times_opened,
+            "attempts": self.attempts,
+            "retries": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "rejected": self.rejected,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+        }
+
+
+_upstreams: Dict[str, Upstream] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_upstream(name: str, policy: Optional[str] = None, breaker: Optional[str] = None) -> Upstream:
+    """Returns the shared Upstream for `name`, created with the policy of the
+    same name (or `policy`). Upstreams created with the same `breaker` name
+    share one circuit breaker, e.g. every operation on one model."""
+    upstream = _upstreams.get(name)
+    if upstream is None:
+        config = UPSTREAM_POLICIES[policy or name]
+        shared = None
+        if breaker is not None:
+            shared = _breakers.get(breaker)
+            if shared is None:
+                shared = _breakers[breaker] = CircuitBreaker(config["breaker_failures"], config["breaker_reset"])
+        upstream = _upstreams[name] = Upstream(name, config, shared)
+    return upstream
+
+
+def get_upstream_stats() -> Dict[str, Dict]:
+    return {name: upstream.stats() for name, upstream in _upstreams.items()}
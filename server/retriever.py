@@ -0,0 +1,245 @@
+"""
+Pluggable retrieval of semantically similar past messages.
+
+    AtlasRetriever     MongoDB Atlas $vectorSearch on the "vector_index" index
+    LocalRetriever     in-process per-conversation float32 matrices, loaded
+                       lazily from MongoDB, updated on insert, LRU evicted;
+                       uses an HNSW index (hnswlib, optional) for big histories
+    FallbackRetriever  Atlas first, switching to the local index while Atlas
+                       vector search is unavailable (local Mongo, CI, dev)
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import (
+    RETRIEVER_BACKEND,
+    LOCAL_INDEX_MAX_CONVERSATIONS,
+    LOCAL_INDEX_HNSW_THRESHOLD,
+    RETRIEVER_ATLAS_RETRY_SECONDS,
+)
+from database import conversations_collection
+from singleflight import SingleFlight
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Fields returned for each retrieved message
+MESSAGE_FIELDS = ("_id", "role", "content", "timestamp")
+
+
+class Retriever:
+    name = "base"
+
+    async def search(self, conversation_id: str, query_embedding: List[float], limit: int) -> List[Dict]:
+        """Returns up to `limit` messages with a "score" (higher is closer)."""
+        raise NotImplementedError
+
+    def add_messages(self, messages: List[Dict]):
+        """Called after messages are written; backends may index them."""
+
+    def evict(self, conversation_id: str):
+        """Called when a conversation is deleted, or when its last turn ran on
+        another worker and local state may be stale."""
+
+    def stats(self) -> Dict:
+        return {"backend": self.name}
+
+
+class AtlasRetriever(Retriever):
+    name = "atlas"
+
+    async def search(self, conversation_id: str, query_embedding: List[float], limit: int) -> List[Dict]:
+        # MongoDB Atlas Vector Search Pipeline
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": "vector_index",
+                    "path": "embedding",
+                    "queryVector": query_embedding,
+                    "numCandidates": 100,
+                    "limit": limit,
+                    "filter": {"conversation_id": conversation_id}
+                }
+            },
+            {
+                "$project": {
+                    "role": 1,
+                    "content": 1,
+                    "timestamp": 1,
+                    "score": {"$meta": "vectorSearchScore"}
+                }
+            }
+        ]
+        cursor = conversations_collection.aggregate(pipeline)
+        return await cursor.to_list(length=limit)
+
+
+class ConversationIndex:
+    """Normalized float32 vectors for one conversation, grown by doubling."""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.dim = dim
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.messages: List[Dict] = []
+        self.ids = set()
+        self.hnsw = None
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, message: Dict, vector: np.ndarray):
+        key = str(message["_id"])
+        if key in self.ids or vector.shape[0] != self.dim:
+            return
+        n = len(self.messages)
+        if n == self.vectors.shape[0]:
+            grown = np.zeros((n * 2, self.dim), dtype=np.float32)
+            grown[:n] = self.vectors
+            self.vectors = grown
+        norm = np.linalg.norm(vector)
+        self.vectors[n] = vector / norm if norm else vector
+        self.messages.append({field: message.get(field) for field in MESSAGE_FIELDS})
+        self.ids.add(key)
+        if self.hnsw is not None:
+            if n >= self.hnsw.get_max_elements():
+                self.hnsw.resize_index(n * 2)
+            self.hnsw.add_items(self.vectors[n:n + 1], [n])
+        elif hnswlib is not None and n + 1 >= LOCAL_INDEX_HNSW_THRESHOLD:
+            self._build_hnsw()
+
+    def _build_hnsw(self):
+        n = len(self.messages)
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=max(n * 2, 16), ef_construction=200, M=32)
+        index.add_items(self.vectors[:n], np.arange(n))
+        index.set_ef(200)
+        self.hnsw = index
+
+    def search(self, query: np.ndarray, limit: int) -> List[Dict]:
+        n = len(self.messages)
+        if n == 0:
+            return []
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+        k = min(limit, n)
+        if self.hnsw is not None:
+            labels, distances = self.hnsw.knn_query(query, k=k)
+            rows, scores = labels[0], 1.0 - distances[0]
+        else:
+            similarities = self.vectors[:n] @ query
+            rows = np.argpartition(-similarities, k - 1)[:k]
+            rows = rows[np.argsort(-similarities[rows])]
+            scores = similarities[rows]
+        # Same scale as Atlas' cosine vectorSearchScore
+        return [{**self.messages[row], "score": float((1.0 + score) / 2.0)} for row, score in zip(rows, scores)]
+
+
+class LocalRetriever(Retriever):
+    name = "local"
+
+    def __init__(self, max_conversations: int = LOCAL_INDEX_MAX_CONVERSATIONS):
+        self.max_conversations = max_conversations
+        self.indexes: "OrderedDict[str, ConversationIndex]" = OrderedDict()
+        self.flights = SingleFlight()
+        self.loads = 0
+
+    async def _get_index(self, conversation_id: str, dim: int) -> ConversationIndex:
+        index = self.indexes.get(conversation_id)
+        if index is not None:
+            self.indexes.move_to_end(conversation_id)
+            return index
+        index, _ = await self.flights.do(conversation_id, lambda: self._load(conversation_id, dim))
+        return index
+
+    async def _load(self, conversation_id: str, dim: int) -> ConversationIndex:
+        index = ConversationIndex(dim)
+        cursor = conversations_collection.find(
+            {"conversation_id": conversation_id, "embedding": {"$exists": True}},
+            dict({field: 1 for field in MESSAGE_FIELDS}, embedding=1),
+        ).sort("timestamp", 1)
+        async for doc in cursor:
+            index.add(doc, np.asarray(doc["embedding"], dtype=np.float32))
+        self.loads += 1
+        self.indexes[conversation_id] = index
+        while len(self.indexes) > self.max_conversations:
+            self.indexes.popitem(last=False)
+        return index
+
+    async def search(self, conversation_id: str, query_embedding: List[float], limit: int) -> List[Dict]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        index = await self._get_index(conversation_id, query.shape[0])
+        return index.search(query, limit)
+
+    def add_messages(self, messages: List[Dict]):
+        for message in messages:
+            index = self.indexes.get(message["conversation_id"])
+            # Conversations that are not loaded pick the message up on load
+            if index is not None and message.get("embedding") is not None:
+                index.add(message, np.asarray(message["embedding"], dtype=np.float32))
+
+    def evict(self, conversation_id: str):
+        self.indexes.pop(conversation_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "conversations_loaded": len(self.indexes),
+            "vectors_loaded": sum(len(index) for index in self.indexes.values()),
+            "hnsw_indexes": sum(1 for index in self.indexes.values() if index.hnsw is not None),
+            "loads": self.loads,
+        }
+
+
+class FallbackRetriever(Retriever):
+    name = "auto"
+
+    def __init__(self, primary: Retriever, fallback: Retriever, retry_seconds: float = RETRIEVER_ATLAS_RETRY_SECONDS):
+        self.primary = primary
+        self.fallback = fallback
+        self.retry_seconds = retry_seconds
+        self.primary_down_until = 0.0
+        self.fallback_searches = 0
+
+    async def search(self, conversation_id: str, query_embedding: List[float], limit: int) -> List[Dict]:
+        if time.time() >= self.primary_down_until:
+            try:
+                return await self.primary.search(conversation_id, query_embedding, limit)
+            except Exception as e:
+                print(f"{self.primary.name} retrieval failed ({e}), using {self.fallback.name} index "
+                      f"for the next {self.retry_seconds:.0f}s")
+                self.primary_down_until = time.time() + self.retry_seconds
+        self.fallback_searches += 1
+        return await self.fallback.search(conversation_id, query_embedding, limit)
+
+    def add_messages(self, messages: List[Dict]):
+        self.primary.add_messages(messages)
+        self.fallback.add_messages(messages)
+
+    def evict(self, conversation_id: str):
+        self.primary.evict(conversation_id)
+        self.fallback.evict(conversation_id)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "primary_available": time.time() >= self.primary_down_until,
+            "fallback_searches": self.fallback_searches,
+            "primary": self.primary.stats(),
+            "fallback": self.fallback.stats(),
+        }
+
+
+def create_retriever(backend: Optional[str] = None) -> Retriever:
+    backend = backend or RETRIEVER_BACKEND
+    if backend == "atlas":
+        return AtlasRetriever()
+    if backend == "local":
+        return LocalRetriever()
+    if backend == "auto":
+        return FallbackRetriever(AtlasRetriever(), LocalRetriever())
+    raise ValueError(f"Unknown RETRIEVER_BACKEND: {backend}")
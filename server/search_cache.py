@@ -0,0 +1,145 @@
+"""
+Search-result cache in front of the Parallel API.
+
+Results are cached by normalized query for SEARCH_CACHE_TTL seconds, concurrent
+identical queries are coalesced into one upstream call, and an optional
+semantic mode reuses results for queries whose embedding is within a cosine
+similarity threshold of a cached one (semantic matches are local to each
+worker). With a SharedCache, exact-key misses are looked up in the shared
+backend and identical queries are coalesced across workers.
+"""
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from singleflight import SingleFlight
+from shared_cache import SharedCache
+
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.strip("?!.,;: ")
+
+
+def normalize_queries(queries: Union[str, List[str]]) -> str:
+    if isinstance(queries, str):
+        return normalize_query(queries)
+    return " | ".join(normalize_query(q) for q in queries)
+
+
+class SearchCache:
+    def __init__(self, search_fn: Callable[[Union[str, List[str]]], Awaitable[List[Dict]]], ttl: float, max_entries: int,
+                 cost_per_request: float = 0.0,
+                 embed_fn: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+                 semantic_threshold: Optional[float] = None, shared: Optional[SharedCache] = None):
+        self.search_fn = search_fn
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cost_per_request = cost_per_request
+        self.embed_fn = embed_fn
+        self.semantic_threshold = semantic_threshold if embed_fn is not None else None
+        # key -> (expires_at, results, unit embedding or None)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.flights = SingleFlight()
+        self.shared = shared
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    async def search(self, query: Union[str, List[str]]) -> List[Dict]:
+        """Searches a query, or a batch of fan-out queries cached as one entry."""
+        key = normalize_queries(query)
+        results = self._get(key)
+        if results is not None:
+            self.hits += 1
+            return results
+
+        embedding = None
+        if self.semantic_threshold is not None:
+            embedding = await self._embed(query if isinstance(query, str) else " ".join(query))
+            results = self._get_similar(embedding)
+            if results is not None:
+                self.semantic_hits += 1
+                return results
+
+        results, shared = await self.flights.do(key, lambda: self._fetch(key, query, embedding))
+        if shared:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        return results
+
+    async def _fetch(self, key: str, query: Union[str, List[str]], embedding: Optional[np.ndarray]) -> List[Dict]:
+        # search_parallel returns [] on errors; don't pin a failure for the TTL
+        if self.shared is not None:
+            results, shared = await self.shared.get_or_compute(key, lambda: self.search_fn(query), bool)
+            if shared:
+                self.shared_hits += 1
+        else:
+            results = await self.search_fn(query)
+        if results:
+            self._put(key, results, embedding)
+        return results
+
+    async def _embed(self, query: str) -> Optional[np.ndarray]:
+        try:
+            vector = np.asarray(await self.embed_fn(query), dtype=np.float32)
+        except Exception as e:
+            print(f"Search cache embedding failed: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _get(self, key: str) -> Optional[List[Dict]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def _get_similar(self, embedding: Optional[np.ndarray]) -> Optional[List[Dict]]:
+        if embedding is None:
+            return None
+        now = time.time()
+        candidates = [(key, entry) for key, entry in self.entries.items() if entry[2] is not None and entry[0] >= now]
+        if not candidates:
+            return None
+        matrix = np.stack([entry[2] for _, entry in candidates])
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.semantic_threshold:
+            return None
+        key, entry = candidates[best]
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def _put(self, key: str, results: List[Dict], embedding: Optional[np.ndarray]):
+        self.entries[key] = (time.time() + self.ttl, results, embedding)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        # Local misses include those answered by the shared backend
+        lookups = self.hits + self.semantic_hits + self.coalesced + self.misses
+        saved = self.hits + self.semantic_hits + self.coalesced + self.shared_hits
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "hit_ratio": round(saved / lookups, 4) if lookups else 0.0,
+            "upstream_calls_saved": saved,
+            "dollars_saved": round(saved * self.cost_per_request, 4),
+        }
@@ -1,17 +1,15 @@
-import os
-import httpx
-from dotenv import load_dotenv
+from typing import List, Optional, Union
+from config import PARALLEL_API_KEY, PARALLEL_API_URL, SEARCH_RESULTS_LIMIT
+from http_clients import get_http_client
+from metrics import trace, record_upstream
+from resilience import CircuitOpenError, UpstreamError, get_upstream
 
-from pathlib import Path
-
-# Load .env from parent directory
-env_path = Path(__file__).parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-PARALLEL_API_KEY = os.getenv("PARALLEL_API_KEY")
-PARALLEL_API_URL = "https://api.parallel.ai/v1beta/search"
-
-async def search_parallel(query: str):
+async def search_parallel(query: Union[str, List[str]], max_results: Optional[int] = None):
+    """Searches one query, or several queries batched into a single request.
+    By default each query gets SEARCH_RESULTS_LIMIT results' worth of budget."""
+    queries = [query] if isinstance(query, str) else list(query)
+    if max_results is None:
+        max_results = SEARCH_RESULTS_LIMIT * len(queries)
     if not PARALLEL_API_KEY:
         print("Warning: PARALLEL_API_KEY not set")
         return []
@@ -22,20 +20,26 @@ async def search_parallel(query: str):
         "Content-Type": "application/json"
     }
     payload = {
-        "search_queries": [query],
-        "max_results": 5
+        "search_queries": queries,
+        "max_results": max_results
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(PARALLEL_API_URL, json=payload, headers=headers, timeout=10.0)
-            print(f"Parallel API Status: {response.status_code}")
-            print(f"Parallel API Response: {response.text[:200]}...")
-            response.raise_for_status()
-            data = response.json()
-            results = data.get("results", [])
-            print(f"Parallel API Results: {len(results)} found")
-            return results
-        except Exception as e:
-            print(f"Error searching Parallel API: {e}")
-            return []
+    try:
+        upstream = get_upstream("parallel")
+        return await upstream.call(lambda: _search_once(payload, headers, upstream.timeout))
+    except CircuitOpenError:
+        # Fast fallback: answer without search while Parallel is failing
+        return []
+    except Exception as e:
+        print(f"Error searching Parallel API: {e}")
+        return []
+
+async def _search_once(payload: dict, headers: dict, timeout: float) -> list:
+    client = get_http_client("parallel")
+    with trace("search", "parallel"):
+        response = await client.post(PARALLEL_API_URL, json=payload, headers=headers, timeout=timeout)
+    record_upstream("parallel", "search", response.status_code)
+    if response.status_code != 200:
+        raise UpstreamError(f"Parallel API returned {response.status_code}: {response.text[:200]}",
+                            response.status_code)
+    return response.json().get("results", [])
@@ -0,0 +1,121 @@
+"""
+Multi-worker server for main.app.
+
+    python serve.py --workers 4 --port 8000
+
+Binds one listening socket, loads the embedding model once in this process
+and forks the uvicorn workers, so they share the model weights copy-on-write
+instead of each loading its own copy (--no-preload to load per worker).
+Everything else (Mongo and HTTP clients, caches) is created in each worker
+after the fork. Workers that exit unexpectedly are restarted; SIGTERM or
+Ctrl+C stops them all.
+
+Set SHARED_BACKEND=redis (and REDIS_URL) so workers share LLM and search
+results and do not repeat each other's upstream calls. Admission limits,
+/stats and /metrics are per worker. Needs fork(), so not on Windows.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from config import SERVER_WORKERS, SHARED_BACKEND
+
+# A worker exiting sooner than this after starting counts as a crash loop
+MIN_WORKER_UPTIME = 5.0
+
+
+def run_worker(sock: socket.socket, slot: int, args):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Read when main:app is imported below, e.g. for the per-worker disk cache
+    import config
+    config.WORKER_ID = slot
+    server_config = uvicorn.Config("main:app", log_level=args.log_level,
+                                   timeout_graceful_shutdown=args.graceful_timeout)
+    uvicorn.Server(server_config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="0 = one per CPU core")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="load the embedding model in each worker instead of before forking")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="seconds workers get to finish open streams on shutdown")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    if workers > 1 and SHARED_BACKEND == "memory":
+        print("Warning: SHARED_BACKEND is 'memory'; caches are not shared between workers")
+
+    if args.preload:
+        from embedding_service import preload_model
+        started = time.perf_counter()
+        preload_model()
+        print(f"Embedding model preloaded in {time.perf_counter() - started:.2f}s")
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}  # pid -> (slot, started)
+    stopping = False
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock, slot, args)
+            except BaseException as e:
+                print(f"Worker {slot} failed: {e}")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        children[pid] = (slot, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for slot in range(workers):
+        spawn(slot)
+    print(f"Serving on {args.host}:{args.port} with {workers} workers (pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot, started = children.pop(pid, (None, 0.0))
+        if stopping or slot is None:
+            continue
+        print(f"Worker {pid} exited with status {status}, restarting")
+        if time.monotonic() - started < MIN_WORKER_UPTIME:
+            time.sleep(MIN_WORKER_UPTIME)
+        if not stopping:
+            spawn(slot)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Shared state for running several server workers.
+
+A backend stores values with a TTL and hands out expiring locks:
+
+    MemoryBackend  process-local stand-in (single worker, tests)
+    RedisBackend   any Redis-compatible server (needs the `redis` package)
+
+`SharedCache` sits behind the in-process caches (LLM responses, search
+results). On a local miss it checks the backend, and across workers only the
+one holding the key's lock calls the upstream; the others wait for its result
+to appear. Backend errors never fail a request: the caller just does the work
+itself.
+"""
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from config import SHARED_BACKEND, REDIS_URL, SHARED_KEY_PREFIX, SHARED_BACKEND_TIMEOUT
+from config import SHARED_LOCK_TTL, SHARED_LOCK_WAIT, SHARED_POLL_INTERVAL, SHARED_MEMORY_MAX_ENTRIES
+
+# Deletes the lock only if we still own it
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SharedBackend:
+    name = "base"
+    # Whether other processes see what this backend stores
+    shared = False
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    async def acquire(self, key: str, ttl: float) -> Optional[str]:
+        """Takes the lock `key` for `ttl` seconds. Returns a token to release
+        it with, or None if someone else holds it."""
+        raise NotImplementedError
+
+    async def release(self, key: str, token: str):
+        raise NotImplementedError
+
+    async def locked(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(SharedBackend):
+    name = "memory"
+
+    def __init__(self, max_entries: int = SHARED_MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # key -> (expires_at, value)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.locks: Dict[str, tuple] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def acquire(self, key: str, ttl: float) -> Optional[str]:
+        if await self.locked(key):
+            return None
+        token = uuid.uuid4().hex
+        self.locks[key] = (time.monotonic() + ttl, token)
+        return token
+
+    async def release(self, key: str, token: str):
+        lock = self.locks.get(key)
+        if lock is not None and lock[1] == token:
+            del self.locks[key]
+
+    async def locked(self, key: str) -> bool:
+        lock = self.locks.get(key)
+        if lock is not None and lock[0] < time.monotonic():
+            del self.locks[key]
+            return False
+        return lock is not None
+
+
+class RedisBackend(SharedBackend):
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = SHARED_KEY_PREFIX):
+        import redis.asyncio as redis  # optional dependency, only needed for this backend
+        self.client = redis.from_url(url, socket_timeout=SHARED_BACKEND_TIMEOUT,
+                                     socket_connect_timeout=SHARED_BACKEND_TIMEOUT)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+
+    async def acquire(self, key: str, ttl: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        acquired = await self.client.set(self.prefix + key, token, nx=True, px=max(1, int(ttl * 1000)))
+        return token if acquired else None
+
+    async def release(self, key: str, token: str):
+        await self.client.eval(RELEASE_SCRIPT, 1, self.prefix + key, token)
+
+    async def locked(self, key: str) -> bool:
+        return bool(await self.client.exists(self.prefix + key))
+
+    async def close(self):
+        # redis-py 5 renamed close() to aclose()
+        close = getattr(self.client, "aclose", None) or self.client.close
+        await close()
+
+
+def create_backend(backend: Optional[str] = None) -> SharedBackend:
+    backend = backend or SHARED_BACKEND
+    if backend == "memory":
+        return MemoryBackend()
+    if backend == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown SHARED_BACKEND: {backend}")
+
+
+class SharedCache:
+    """JSON values under `namespace` in a backend, with single flight across
+    workers."""
+
+    def __init__(self, backend: SharedBackend, namespace: str, ttl: float, lock_ttl: float = SHARED_LOCK_TTL,
+                 lock_wait: float = SHARED_LOCK_WAIT, poll_interval: float = SHARED_POLL_INTERVAL):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.poll_interval = poll_interval
+
+        self.hits = 0
+        self.waited = 0
+        self.computed = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Any:
+        try:
+            value = await self.backend.get(f"{self.namespace}:{key}")
+        except Exception as e:
+            self._error("get", e)
+            return None
+        return None if value is None else json.loads(value)
+
+    async def set(self, key: str, value: Any):
+        try:
+            await self.backend.set(f"{self.namespace}:{key}", json.dumps(value).encode("utf-8"), self.ttl)
+        except Exception as e:
+            self._error("set", e)
+
+    async def get_or_compute(self, key: str, fn: Callable[[], Awaitable[Any]],
+                             cacheable: Callable[[Any], bool]) -> Tuple[Any, bool]:
+        """Returns (value, shared) where `shared` is True if the value came
+        from the backend, possibly after waiting for another worker's call."""
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value, True
+
+        lock = f"lock:{self.namespace}:{key}"
+        token = None
+        try:
+            token = await self.backend.acquire(lock, self.lock_ttl)
+            if token is None:
+                value = await self._wait_for(key, lock)
+                if value is not None:
+                    self.waited += 1
+                    return value, True
+        except Exception as e:
+            self._error("lock", e)
+
+        try:
+            self.computed += 1
+            value = await fn()
+            if cacheable(value):
+                await self.set(key, value)
+            return value, False
+        finally:
+            if token is not None:
+                try:
+                    await self.backend.release(lock, token)
+                except Exception as e:
+                    self._error("release", e)
+
+    async def _wait_for(self, key: str, lock: str) -> Any:
+        """Polls for the lock holder's result. Returns None if the holder
+        finished without a cacheable result, died, or took too long."""
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            value = await self.get(key)
+            if value is not None:
+                return value
+            if not await self.backend.locked(lock):
+                return await self.get(key)
+        return None
+
+    def _error(self, operation: str, error: Exception):
+        self.errors += 1
+        print(f"Shared cache {self.namespace} {operation} failed: {error}")
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "waited": self.waited,
+            "computed": self.computed,
+            "errors": self.errors,
+        }
@@ -0,0 +1,29 @@
+"""
+Single-flight call deduplication.
+
+Concurrent callers asking for the same key share one execution of the
+underlying coroutine instead of each issuing their own upstream call.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Runs `fn` once per key at a time. Returns (result, shared) where
+        `shared` is True if this caller joined a call already in flight."""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            # Run as an independent task so one caller timing out or being
+            # cancelled does not cancel the call for everyone else.
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def __len__(self):
+        return len(self._inflight)
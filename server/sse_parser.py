@@ -0,0 +1,80 @@
+"""
+Incremental parser for OpenRouter's server-sent event stream.
+
+Works on raw bytes as they arrive from the socket: events are split on
+blank lines without decoding the whole chunk to text, `data:` payloads are
+parsed with orjson when it is installed (falling back to the standard json
+module), and only the fields the service uses are pulled out.
+"""
+import json
+from typing import List, NamedTuple, Optional
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _decoder = json.JSONDecoder()
+
+    def _loads(data: bytes):
+        # Skips json.loads' encoding detection; the stream is always UTF-8
+        return _decoder.decode(data.decode("utf-8"))
+
+DONE = b"[DONE]"
+
+
+class StreamDelta(NamedTuple):
+    content: str
+    finish_reason: Optional[str]
+    usage: Optional[dict]
+
+
+class SSEParser:
+    """Feed raw byte chunks in, get complete `data:` payloads out.
+
+    Comment lines (OpenRouter sends ": OPENROUTER PROCESSING" keep-alives)
+    and other fields are skipped. Multi-line data is joined with newlines,
+    as the SSE spec requires.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        if self._buffer:
+            chunk = self._buffer + chunk
+        lines = chunk.split(b"\n")
+        self._buffer = lines.pop()
+        events = []
+        for line in lines:
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if not line:
+                if self._data:
+                    events.append(self._data[0] if len(self._data) == 1 else b"\n".join(self._data))
+                    self._data = []
+            elif line.startswith(b"data:"):
+                value = line[5:]
+                self._data.append(value[1:] if value.startswith(b" ") else value)
+        return events
+
+
+def parse_delta(data: bytes) -> Optional[StreamDelta]:
+    """Extracts content, finish_reason and usage from one chunk payload.
+    Returns None for payloads that are not valid JSON objects."""
+    try:
+        chunk = _loads(data)
+    except ValueError:  # json and orjson decode errors both subclass it
+        return None
+    if not isinstance(chunk, dict):
+        return None
+    choices = chunk.get("choices")
+    content, finish_reason = "", None
+    if choices:
+        choice = choices[0]
+        delta = choice.get("delta")
+        if delta:
+            content = delta.get("content") or ""
+        finish_reason = choice.get("finish_reason")
+    return StreamDelta(content, finish_reason, chunk.get("usage"))
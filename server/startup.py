@@ -0,0 +1,82 @@
+"""
+Startup phase tracking.
+
+The lifespan runs each startup step inside `phase()`, either inline or as a
+background task, so the server can accept connections before slow steps
+(loading the embedding model) finish. `ready` is True once every required
+phase has succeeded; `report()` backs /ready and /stats/startup.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, List, Optional
+
+
+class Startup:
+    def __init__(self, started: Optional[float] = None):
+        # Pass the time module imports began to include them in the timeline
+        self.started = time.perf_counter() if started is None else started
+        self.phases: Dict[str, Dict] = {}
+        self.required: List[str] = []
+        self.tasks: List[asyncio.Task] = []
+
+    def _elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    @contextmanager
+    def phase(self, name: str, required: bool = True):
+        """Times the enclosed block. Errors are recorded and re-raised."""
+        if required and name not in self.required:
+            self.required.append(name)
+        entry = self.phases[name] = {"status": "running", "start_ms": self._elapsed_ms()}
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            entry["status"] = "cancelled" if isinstance(e, asyncio.CancelledError) else "failed"
+            entry["error"] = str(e) or type(e).__name__
+            raise
+        else:
+            entry["status"] = "ok"
+        finally:
+            entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    def record(self, name: str, seconds: float):
+        """Records a phase that was timed elsewhere (e.g. module imports)."""
+        self.phases[name] = {"status": "ok", "start_ms": 0.0, "duration_ms": round(seconds * 1000, 1)}
+
+    def expect(self, name: str):
+        """Marks a phase as required before it starts, so /ready waits for it."""
+        if name not in self.required:
+            self.required.append(name)
+        self.phases.setdefault(name, {"status": "pending"})
+
+    def background(self, coro: Awaitable) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self.tasks.append(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Startup task failed: {task.exception()}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    @property
+    def ready(self) -> bool:
+        return all(self.phases.get(name, {}).get("status") == "ok" for name in self.required)
+
+    def report(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "uptime_ms": self._elapsed_ms(),
+            "phases": self.phases,
+        }
+
+    def summary(self) -> str:
+        parts = [f"{name}={p['duration_ms']:.0f}ms" for name, p in self.phases.items() if "duration_ms" in p]
+        return ", ".join(parts)
@@ -0,0 +1,129 @@
+"""
+Wire formats for /chat responses.
+
+The chat pipeline yields typed events. Token events are coalesced over a short
+time/byte window so a response is written in a few dozen chunks instead of one
+write (and one client re-render) per upstream token, then encoded as:
+
+    text    legacy plain-text stream: answer text, errors inline
+    sse     Server-Sent Events, one `event:` per type
+    ndjson  one JSON object per line with a "type" field
+
+Every structured stream starts with a "meta" event carrying the
+conversation_id and ends with a "done" event.
+"""
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from config import STREAM_COALESCE_MS, STREAM_COALESCE_BYTES
+
+MEDIA_TYPES = {
+    "text": "text/plain",
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def negotiate_format(requested: Optional[str], accept: str) -> str:
+    """Picks the stream format from the request body or the Accept header."""
+    if requested in MEDIA_TYPES:
+        return requested
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    return "text"
+
+
+async def coalesce_tokens(events: AsyncIterator[Dict], window_ms: float = STREAM_COALESCE_MS,
+                          max_bytes: int = STREAM_COALESCE_BYTES) -> AsyncIterator[Dict]:
+    """Merges consecutive token events. A batch is flushed when it is
+    `window_ms` old, reaches `max_bytes`, or another event type arrives."""
+    iterator = events.__aiter__()
+    buffer = []
+    size = 0
+    batch_started = 0.0
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None
+            if buffer:
+                timeout = max(0.0, batch_started + window_ms / 1000 - time.perf_counter())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield {"type": "token", "text": "".join(buffer)}
+                buffer, size = [], 0
+                continue
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+            if event["type"] == "token":
+                if not buffer:
+                    batch_started = time.perf_counter()
+                buffer.append(event["text"])
+                size += len(event["text"].encode("utf-8"))
+                if size >= max_bytes:
+                    yield {"type": "token", "text": "".join(buffer)}
+                    buffer, size = [], 0
+                continue
+            if buffer:
+                yield {"type": "token", "text": "".join(buffer)}
+                buffer, size = [], 0
+            yield event
+        if buffer:
+            yield {"type": "token", "text": "".join(buffer)}
+    finally:
+        if pending is not None:
+            # Let the source observe the cancellation before closing it
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def encode_event(event: Dict, stream_format: str) -> str:
+    if stream_format == "text":
+        if event["type"] == "token":
+            return event["text"]
+        if event["type"] == "error":
+            return event["message"]
+        return ""
+    if stream_format == "sse":
+        data = {k: v for k, v in event.items() if k != "type"}
+        return f"event: {event['type']}\ndata: {json.dumps(data, default=str)}\n\n"
+    return json.dumps(event, default=str) + "\n"
+
+
+async def encode_stream(events: AsyncIterator[Dict], stream_format: str, conversation_id: str,
+                        is_disconnected=None) -> AsyncIterator[str]:
+    """Encodes pipeline events for the wire.
+
+    `is_disconnected` is an optional coroutine function; when it reports the
+    client has gone away the pipeline is closed, which aborts the upstream
+    OpenRouter stream and stops paying for tokens nobody will read.
+    """
+    coalesced = coalesce_tokens(events)
+    try:
+        if stream_format != "text":
+            yield encode_event({"type": "meta", "conversation_id": conversation_id}, stream_format)
+        async for event in coalesced:
+            if is_disconnected is not None and await is_disconnected():
+                print(f"Client disconnected, cancelling stream for {conversation_id}")
+                return
+            chunk = encode_event(event, stream_format)
+            if chunk:
+                yield chunk
+        if stream_format != "text":
+            yield encode_event({"type": "done"}, stream_format)
+    finally:
+        await coalesced.aclose()
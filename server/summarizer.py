@@ -1,49 +1,154 @@
 import asyncio
-from llm_client import stream_chat_response
-from database import conversations_collection
+from typing import Dict, Optional
 
-async def summarize_conversation(conversation_id: str, messages: list):
+from llm_client import generate_chat_response
+from database import conversations_collection, conversations_meta_collection
+from prompts import get_summarization_prompt
+from context_builder import count_tokens
+from config import SUMMARIZATION_THRESHOLD, SUMMARIZATION_MAX_INPUT_TOKENS, SUMMARIZATION_KEEP_RECENT, SUMMARY_LOCK_TTL
+
+
+async def get_conversation_summary(conversation_id: str) -> Optional[Dict]:
+    """Returns the latest rolling summary and how much of the conversation is
+    not yet folded into it:
+
+        {"content": str or None, "covers_until": float, "pending_messages": int}
+    """
+    meta = await conversations_meta_collection.find_one(
+        {"_id": conversation_id},
+        {"summary_id": 1, "message_count": 1, "summary_message_count": 1},
+    )
+    if meta is None:
+        return None
+    summary = {"content": None, "covers_until": 0.0}
+    if meta.get("summary_id") is not None:
+        doc = await conversations_collection.find_one({"_id": meta["summary_id"]}, {"content": 1, "covers_until": 1, "timestamp": 1})
+        if doc is not None:
+            # Summaries written before rolling summarization have no covers_until
+            summary = {"content": doc["content"], "covers_until": doc.get("covers_until", doc["timestamp"] - 0.1)}
+    summary["pending_messages"] = meta.get("message_count", 0) - meta.get("summary_message_count", 0)
+    return summary
+
+
+async def summarize_conversation(conversation_id: str):
     """
-    Summarizes the provided messages and stores the summary in the database.
-    This is intended to be run as a background task.
+    Folds the messages added since the last summary into it and stores the
+    result in the database. Only new messages are sent to the LLM, so the cost
+    of each run is bounded no matter how long the conversation gets.
     """
     print(f"Starting background summarization for {conversation_id}...")
-    
-    # Construct the prompt
+
+    previous = await get_conversation_summary(conversation_id) or {"content": None, "covers_until": 0.0}
+
+    # The newest messages stay verbatim in the prompt, so never fold them
+    message_filter = {"conversation_id": conversation_id, "role": {"$in": ["user", "assistant"]}}
+    newest = await conversations_collection.find(message_filter, {"timestamp": 1}).sort(
+        "timestamp", -1).skip(SUMMARIZATION_KEEP_RECENT - 1).limit(1).to_list(length=1)
+    if not newest:
+        return
+    window = {"$gt": previous["covers_until"], "$lt": newest[0]["timestamp"]}
+
+    # Oldest unsummarized messages first, up to the input token budget
+    cursor = conversations_collection.find(
+        dict(message_filter, timestamp=window),
+        {"role": 1, "content": 1, "timestamp": 1},
+    ).sort("timestamp", 1)
+    messages, tokens = [], 0
+    async for msg in cursor:
+        cost = count_tokens(msg["content"])
+        if messages and tokens + cost > SUMMARIZATION_MAX_INPUT_TOKENS:
+            break
+        messages.append(msg)
+        tokens += cost
+    if not messages:
+        return
+
     conversation_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
-    prompt = f"""Summarize the following conversation concisely, capturing key facts, user preferences, and the current topic. 
-    Do not lose important technical details.
-    
-    Conversation:
-    {conversation_text}
-    
-    Summary:"""
-    
-    messages_payload = [{"role": "user", "content": prompt}]
-    
-    summary = ""
-    try:
-        async for chunk in stream_chat_response(messages_payload):
-            if not chunk.startswith("Error:"):
-                summary += chunk
-        
-        if summary:
-            print(f"Generated summary for {conversation_id}: {summary[:50]}...")
-            
-            # Store summary (for now, we'll just append it to a 'summaries' collection or update a metadata field)
-            # Let's create a new collection for summaries in database.py if we want, 
-            # or just insert a special 'system' message with the summary.
-            # For simplicity in this MVP, we'll insert a 'summary' type message.
-            
-            await conversations_collection.insert_one({
-                "conversation_id": conversation_id,
-                "role": "system",
-                "type": "summary",
-                "content": summary,
-                "timestamp": messages[-1]["timestamp"] + 0.1 # Slightly after the last message
-            })
-            
-            print(f"Summary stored for {conversation_id}")
-            
-    except Exception as e:
-        print(f"Error during summarization: {e}")
+    messages_payload = [{"role": "user", "content": get_summarization_prompt(previous["content"], conversation_text)}]
+
+    # Long inputs: never hedged, and kept out of the short calls' latency stats
+    summary = (await generate_chat_response(messages_payload, operation="summarize", hedge=False)).strip()
+    if not summary or summary.startswith("Error:"):
+        print(f"Summarization for {conversation_id} returned no summary: {summary}")
+        return
+
+    print(f"Generated summary for {conversation_id}: {summary[:50]}...")
+    covers_until = messages[-1]["timestamp"]
+    result = await conversations_collection.insert_one({
+        "conversation_id": conversation_id,
+        "role": "system",
+        "type": "summary",
+        "content": summary,
+        "covers_until": covers_until,
+        "timestamp": covers_until + 0.1 # Slightly after the last message
+    })
+    await conversations_meta_collection.update_one(
+        {"_id": conversation_id},
+        {
+            "$set": {"summary_id": result.inserted_id, "summary_covers_until": covers_until},
+            "$inc": {"summary_message_count": len(messages)},
+        }
+    )
+    # Superseded summaries are no longer referenced
+    await conversations_collection.delete_many({
+        "conversation_id": conversation_id,
+        "type": "summary",
+        "_id": {"$ne": result.inserted_id},
+    })
+    print(f"Summary stored for {conversation_id} ({len(messages)} messages folded)")
+
+
+class SummaryScheduler:
+    """Runs background summarization with at most one job per conversation.
+    With a `lock_backend`, that holds across workers as well."""
+
+    def __init__(self, threshold: int = SUMMARIZATION_THRESHOLD, lock_backend=None):
+        self.threshold = threshold
+        self.lock_backend = lock_backend
+        self.jobs: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def maybe_schedule(self, conversation_id: str, pending_messages: int) -> bool:
+        """Starts a summarization job if enough messages are unsummarized and
+        none is already running for the conversation."""
+        if pending_messages < self.threshold or conversation_id in self.jobs:
+            return False
+        task = asyncio.create_task(self._run(conversation_id))
+        self.jobs[conversation_id] = task
+        return True
+
+    async def _run(self, conversation_id: str):
+        lock, token = f"summary:{conversation_id}", None
+        try:
+            if self.lock_backend is not None:
+                try:
+                    token = await self.lock_backend.acquire(lock, SUMMARY_LOCK_TTL)
+                except Exception as e:
+                    print(f"Summary lock failed, summarizing anyway: {e}")
+                else:
+                    if token is None:
+                        self.skipped += 1  # Another worker is on it
+                        return
+            await summarize_conversation(conversation_id)
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Error during summarization: {e}")
+        finally:
+            self.jobs.pop(conversation_id, None)
+            if token is not None:
+                try:
+                    await self.lock_backend.release(lock, token)
+                except Exception as e:
+                    print(f"Summary lock release failed: {e}")
+
+    async def stop(self):
+        for task in list(self.jobs.values()):
+            task.cancel()
+        await asyncio.gather(*self.jobs.values(), return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {"in_flight": len(self.jobs), "completed": self.completed, "failed": self.failed,
+                "skipped": self.skipped}
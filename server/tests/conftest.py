@@ -0,0 +1,13 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests that touch MongoDB run against mongomock-motor when it is installed
+# (pip install mongomock-motor) and are skipped otherwise.
+try:
+    import mongomock_motor
+    import motor.motor_asyncio
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+except ImportError:
+    mongomock_motor = None
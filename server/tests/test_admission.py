@@ -0,0 +1,173 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+from shared_cache import MemoryBackend
+
+
+class SharedMemoryBackend(MemoryBackend):
+    """Stands in for Redis: one instance seen by several controllers."""
+    shared = True
+
+
+def test_conversation_serialized_across_workers():
+    backend = SharedMemoryBackend()
+    events = []
+
+    async def settle(conversation_id):
+        await asyncio.sleep(0.05)  # The turn's write
+        events.append("written")
+
+    def handoff(worker):
+        return lambda conversation_id: events.append(f"handoff {worker}")
+
+    async def scenario():
+        worker_a = AdmissionController(lock_backend=backend, settle=settle, on_handoff=handoff("a"))
+        worker_b = AdmissionController(lock_backend=backend, settle=settle, on_handoff=handoff("b"))
+
+        ticket = await worker_a.acquire("client", "conversation")
+        waiting = asyncio.ensure_future(worker_b.acquire("client", "conversation"))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()  # Worker A still holds the conversation
+
+        ticket.release()
+        events.append("released a")
+        second = await waiting
+        events.append("admitted b")
+        second.release()
+        await asyncio.sleep(0.1)
+
+        # Back on A after B ran a turn: A's local state is stale again
+        third = await worker_a.acquire("client", "conversation")
+        third.release()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert events == [
+        "handoff a", "released a", "written", "handoff b", "admitted b", "written", "handoff a", "written",
+    ]
+
+
+def test_same_worker_keeps_local_state():
+    backend = SharedMemoryBackend()
+    handoffs = []
+
+    async def scenario():
+        worker = AdmissionController(lock_backend=backend, on_handoff=handoffs.append)
+        for _ in range(3):
+            ticket = await worker.acquire("client", "conversation")
+            ticket.release()
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert handoffs == ["conversation"]  # Only the first turn
+
+
+def test_busy_conversation_on_other_worker_is_rejected():
+    backend = SharedMemoryBackend()
+
+    async def scenario():
+        worker_a = AdmissionController(lock_backend=backend)
+        worker_b = AdmissionController(lock_backend=backend, max_queue_wait=0.1)
+        ticket = await worker_a.acquire("client", "conversation")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await worker_b.acquire("client", "conversation")
+        assert rejected.value.reason == "conversation_busy"
+        assert worker_b.active == 0 and not worker_b.conversations
+        ticket.release()
+
+    asyncio.run(scenario())
+
+
+def test_slots_are_limited_and_queue_is_bounded():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queued=1, max_queue_wait=0.1, max_active_per_client=1)
+        ticket = await controller.acquire("a", "c1")
+        queued = asyncio.ensure_future(controller.acquire("b", "c2"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as full:
+            await controller.acquire("c", "c3")
+        assert full.value.reason == "queue_full"
+        with pytest.raises(AdmissionRejected) as timeout:
+            await queued
+        assert timeout.value.reason == "queue_timeout"
+        ticket.release()
+        ticket.release()  # Idempotent
+        assert controller.stats()["active"] == 0 and controller.queued == 0 and not controller.conversations
+
+    asyncio.run(scenario())
+
+
+def test_waiting_clients_are_served_round_robin():
+    order = []
+
+    async def turn(controller, client_id, conversation_id):
+        ticket = await controller.acquire(client_id, conversation_id)
+        order.append(client_id)
+        await asyncio.sleep(0.01)
+        ticket.release()
+
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queued=10, max_queue_wait=5, max_active_per_client=1)
+        blocker = await controller.acquire("blocker", "b")
+        # A busy client queues three turns before another client's one
+        turns = [asyncio.ensure_future(turn(controller, "busy", f"busy-{i}")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        turns.append(asyncio.ensure_future(turn(controller, "quiet", "quiet-0")))
+        await asyncio.sleep(0.01)
+        blocker.release()
+        await asyncio.gather(*turns)
+
+    asyncio.run(scenario())
+    assert order == ["busy", "quiet", "busy", "busy"]
+
+
+def test_per_client_limit_leaves_slots_for_others():
+    async def scenario():
+        controller = AdmissionController(max_active=3, max_queued=10, max_queue_wait=0.1, max_active_per_client=1)
+        first = await controller.acquire("greedy", "g1")
+        second = asyncio.ensure_future(controller.acquire("greedy", "g2"))
+        other = await controller.acquire("other", "o1")  # Not stuck behind greedy's queued turn
+        assert controller.active == 2
+        with pytest.raises(AdmissionRejected):
+            await second
+        first.release()
+        other.release()
+
+    asyncio.run(scenario())
+
+
+def test_same_conversation_runs_one_turn_at_a_time_in_order():
+    events = []
+
+    async def turn(controller, name):
+        ticket = await controller.acquire(name, "shared-conversation")
+        events.append(f"start {name}")
+        await asyncio.sleep(0.02)
+        events.append(f"end {name}")
+        ticket.release()
+
+    async def scenario():
+        controller = AdmissionController(max_active=10, max_queued=10, max_queue_wait=5, max_active_per_client=10)
+        await asyncio.gather(*(turn(controller, name) for name in ("first", "second", "third")))
+        assert not controller.conversations
+
+    asyncio.run(scenario())
+    assert events == ["start first", "end first", "start second", "end second", "start third", "end third"]
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queued=10, max_queue_wait=5, max_active_per_client=1)
+        ticket = await controller.acquire("a", "c1")
+        waiter = asyncio.ensure_future(controller.acquire("b", "c2"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.queued == 0 and not controller.waiting
+        ticket.release()
+        assert controller.active == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,16 @@
+import context_builder
+from context_builder import count_tokens
+
+
+def test_token_count_cache_is_bounded_and_keyed_by_digest(monkeypatch):
+    monkeypatch.setattr(context_builder, "TOKEN_COUNT_CACHE_SIZE", 3)
+    monkeypatch.setattr(context_builder, "_token_counts", context_builder.OrderedDict())
+    long_text = "word " * 10000
+    first = count_tokens(long_text)
+    assert count_tokens(long_text) == first
+    for i in range(5):
+        count_tokens(f"message {i}")
+    cache = context_builder._token_counts
+    assert len(cache) == 3
+    # Keys are fixed-size digests, never the message text
+    assert all(isinstance(key, bytes) and len(key) == 16 for key in cache)
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def test_disk_tier_round_trip(tmp_path):
+    cache = EmbeddingCache("test-model", max_entries=10, disk_dir=str(tmp_path))
+    cache.put("alpha", [1.0, 0.0])
+    cache.put("beta", [0.0, 1.0])
+
+    cache.close()  # Flushes queued writes
+    cache.disk._lock_file.close()  # Release the writer lock, as on shutdown
+    reopened = EmbeddingCache("test-model", max_entries=10, disk_dir=str(tmp_path))
+    assert np.allclose(asyncio.run(reopened.get("beta")), [0.0, 1.0])
+    assert np.allclose(asyncio.run(reopened.get("alpha")), [1.0, 0.0])
+    assert reopened.disk_hits == 2
+
+
+def test_disk_io_stays_off_the_event_loop(tmp_path):
+    cache = EmbeddingCache("test-model", max_entries=1, disk_dir=str(tmp_path))
+    threads = []
+    for name in ("get", "put_many"):
+        original = getattr(cache.disk, name)
+
+        def record(*args, original=original):
+            threads.append(threading.current_thread().name)
+            return original(*args)
+
+        setattr(cache.disk, name, record)
+
+    async def scenario():
+        cache.put("alpha", [1.0, 0.0])
+        cache.put("beta", [0.0, 1.0])  # Evicts alpha from memory
+        await asyncio.sleep(0.05)
+        assert np.allclose(await cache.get("alpha"), [1.0, 0.0])
+
+    asyncio.run(scenario())
+    cache.close()
+    assert threads and all(name.startswith("embedding-disk") for name in threads)
+    assert len(cache.disk) == 2
+
+
+def test_second_writer_runs_without_disk_tier(tmp_path):
+    first = EmbeddingCache("test-model", max_entries=10, disk_dir=str(tmp_path))
+    second = EmbeddingCache("test-model", max_entries=10, disk_dir=str(tmp_path))
+    assert first.disk is not None
+    assert second.disk is None
+
+    first.put("alpha", [1.0, 0.0])
+    second.put("beta", [0.0, 1.0])  # Memory only; must not append to first's files
+    assert asyncio.run(first.get("beta")) is None
+    first.close()
+    assert len(first.disk) == 1
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+from embedding_service import EmbeddingService
+
+
+class FakeModel:
+    """Stands in for fastembed's TextEmbedding: one vector per text."""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.batches = []
+        self.threads = []
+        self.delay = delay
+        self.fail = fail
+
+    def embed(self, texts, batch_size):
+        self.batches.append(list(texts))
+        self.threads.append(threading.current_thread())
+        if self.fail:
+            raise RuntimeError("inference failed")
+        threading.Event().wait(self.delay)
+        return [np.array([float(len(text)), 1.0]) for text in texts]
+
+
+def test_concurrent_embeds_share_a_batch_off_the_event_loop():
+    model = FakeModel()
+    service = EmbeddingService(lambda: model, batch_window=0.05, max_batch_size=16, workers=1)
+
+    async def scenario():
+        await service.load()
+        vectors = await service.embed_many(["a", "bb", "ccc"])
+        await service.stop()
+        return vectors
+
+    vectors = asyncio.run(scenario())
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+    assert model.batches == [["a", "bb", "ccc"]]
+    assert model.threads[0] is not threading.main_thread()
+    assert service.total_batches == 1 and service.total_embeddings == 3
+
+
+def test_batches_are_capped_and_loop_stays_responsive():
+    model = FakeModel(delay=0.05)
+    service = EmbeddingService(lambda: model, batch_window=0.01, max_batch_size=2, workers=1)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.005)
+
+    async def scenario():
+        await service.load()
+        tick = asyncio.ensure_future(ticker())
+        await service.embed_many([str(i) for i in range(5)])
+        tick.cancel()
+        await service.stop()
+
+    asyncio.run(scenario())
+    assert [len(batch) for batch in model.batches] == [2, 2, 1]
+    # Inference took ~0.15s; the loop kept running meanwhile
+    assert len(ticks) > 10
+
+
+def test_cache_hits_skip_inference():
+    model = FakeModel()
+    cache = EmbeddingCache("fake", max_entries=10)
+    service = EmbeddingService(lambda: model, cache=cache, batch_window=0.01, workers=1)
+
+    async def scenario():
+        await service.embed("hello")
+        await service.embed("hello")
+        await service.stop()
+
+    asyncio.run(scenario())
+    assert model.batches == [["hello"]]  # Loaded lazily on first use
+    assert cache.memory_hits == 1
+
+
+def test_failed_batch_fails_every_caller():
+    service = EmbeddingService(lambda: FakeModel(fail=True), batch_window=0.02, workers=1)
+
+    async def scenario():
+        results = await asyncio.gather(service.embed("a"), service.embed("b"), return_exceptions=True)
+        await service.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_concurrent_loads_share_one_model():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        threading.Event().wait(0.05)
+        return FakeModel()
+
+    service = EmbeddingService(loader, workers=1)
+
+    async def scenario():
+        await asyncio.gather(service.load(), service.load(), service.load())
+        await service.stop()
+
+    asyncio.run(scenario())
+    assert loads == [1] and service.ready
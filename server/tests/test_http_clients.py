@@ -0,0 +1,59 @@
+import asyncio
+
+import http_clients
+from http_clients import close_http_clients, get_http_client, get_pool_stats, init_http_clients
+
+
+async def keepalive_server(connections):
+    """Minimal HTTP/1.1 server answering every request on a kept-alive connection."""
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nContent-Type: text/plain\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # Client closed the connection
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_requests_reuse_pooled_connections(monkeypatch):
+    monkeypatch.setattr(http_clients, "_clients", {})
+    connections = []
+
+    async def scenario():
+        server = await keepalive_server(connections)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+        init_http_clients()
+        client = get_http_client("openrouter")
+        assert get_http_client("openrouter") is client
+        for _ in range(5):
+            response = await client.get(url)
+            assert response.text == "ok"
+        stats = get_pool_stats()["openrouter"]
+        await close_http_clients()
+        server.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert len(connections) == 1  # One TCP connection for all five requests
+    assert stats["connections"] == 1 and stats["idle"] == 1
+    assert stats["max_connections"] == http_clients.HTTP_POOL_LIMITS["openrouter"]["max_connections"]
+
+
+def test_clients_are_recreated_after_close(monkeypatch):
+    monkeypatch.setattr(http_clients, "_clients", {})
+
+    async def scenario():
+        first = get_http_client("parallel")
+        await close_http_clients()
+        assert first.is_closed
+        second = get_http_client("parallel")
+        assert second is not first and not second.is_closed
+        await close_http_clients()
+
+    asyncio.run(scenario())
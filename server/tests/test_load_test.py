@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SERVER_DIR, "benchmarks"))
+
+import load_test  # noqa: E402
+
+
+def test_check_regressions_flags_only_regressions_past_the_threshold():
+    baseline = {"ttft_ms": {"p95": 100.0}, "latency_ms": {"p95": 1000.0},
+                "event_loop_lag_ms": {"p99": 5.0}, "aggregate_tokens_per_sec": 500.0}
+    current = {"ttft_ms": {"p95": 130.0}, "latency_ms": {"p95": 1100.0},
+               "event_loop_lag_ms": {"p99": 1.0}, "aggregate_tokens_per_sec": 350.0}
+
+    regressions = load_test.check_regressions(current, baseline, 0.2)
+
+    assert [r.split(":")[0] for r in regressions] == ["ttft_ms.p95", "aggregate_tokens_per_sec"]
+    assert load_test.check_regressions(baseline, baseline, 0.2) == []
+    # Missing or zero baseline figures are not compared
+    assert load_test.check_regressions(current, {"ttft_ms": {"count": 0}}, 0.2) == []
+
+
+def test_load_test_runs_end_to_end_against_fake_upstreams(tmp_path):
+    pytest.importorskip("mongomock_motor")
+    output = tmp_path / "results.json"
+    command = [sys.executable, os.path.join("benchmarks", "load_test.py"),
+               "--concurrency", "2", "--requests", "4", "--warmup", "0", "--turns", "2",
+               "--fake-embeddings", "--tokens", "10", "--token-rate", "1000",
+               "--llm-latency", "0.01", "--search-latency", "0.01", "--output", str(output)]
+    completed = subprocess.run(command, cwd=SERVER_DIR, capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stdout + completed.stderr
+
+    report = json.loads(output.read_text())
+    assert report["requests"] == {"measured": 4, "ok": 4, "errors": 0}
+    assert report["ttft_ms"]["count"] == 4
+    assert report["latency_ms"]["p50"] >= report["ttft_ms"]["p50"]
+    assert report["aggregate_tokens_per_sec"] > 0
+    assert report["event_loop_lag_ms"]["count"] > 0
+
+    # A baseline that is far better than this run makes the gate fail
+    baseline = dict(report, ttft_ms=dict(report["ttft_ms"], p95=report["ttft_ms"]["p95"] / 100))
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps(baseline))
+    gated = subprocess.run(command + ["--baseline", str(baseline_path)], cwd=SERVER_DIR,
+                           capture_output=True, text=True, timeout=120)
+    assert gated.returncode == 1, gated.stdout + gated.stderr
+    assert "REGRESSION ttft_ms.p95" in gated.stdout
@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import metrics
+from metrics import SPAN_SECONDS, STAGE_SECONDS, trace
+from streaming import coalesce_tokens
+
+
+def span_count(component, operation):
+    series = SPAN_SECONDS.values.get((component, operation))
+    return series[2] if series else 0
+
+
+def test_trace_respects_explicit_decision():
+    before = span_count("test", "explicit")
+    with trace("test", "explicit", sampled=False):
+        pass
+    assert span_count("test", "explicit") == before
+    with trace("test", "explicit", sampled=True):
+        pass
+    assert span_count("test", "explicit") == before + 1
+
+
+def openrouter_handler(request: httpx.Request) -> httpx.Response:
+    payload = json.loads(request.content)
+    if not payload.get("stream"):
+        return httpx.Response(200, json={"choices": [{"message": {"content": "hello"}}]})
+    chunks = [{"choices": [{"delta": {"content": f"t{i} "}, "finish_reason": None}]} for i in range(20)]
+    body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+    return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+
+
+def run_chat(monkeypatch, sample_rate, conversation_id):
+    """Runs one turn through coalesce_tokens against a mocked OpenRouter."""
+    pytest.importorskip("mongomock_motor")
+    import chat_service
+    import llm_client
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(openrouter_handler))
+    monkeypatch.setattr(llm_client, "get_http_client", lambda name: client)
+    monkeypatch.setattr(llm_client, "OPENROUTER_API_KEY", "test")
+    monkeypatch.setattr(metrics, "METRICS_SAMPLE_RATE", sample_rate)
+
+    async def embed(text):
+        return [0.1] * 8
+
+    async def search(query):
+        return [{"title": "T", "url": "https://example.com", "body": "b"}]
+
+    monkeypatch.setattr(chat_service.embedding_service, "embed", embed)
+    monkeypatch.setattr(chat_service.search_cache, "search_fn", search)
+
+    async def scenario():
+        # coalesce_tokens resumes the pipeline in a new task on every step
+        events = [e async for e in coalesce_tokens(chat_service.chat_pipeline("hello", conversation_id))]
+        await chat_service.persistence_queue.stop()
+        return events
+
+    return asyncio.run(scenario())
+
+
+def test_unsampled_request_records_no_spans_through_coalescing(monkeypatch):
+    stream_spans = span_count("llm", "stream")
+    stages = sum(series[2] for series in STAGE_SECONDS.values.values())
+
+    events = run_chat(monkeypatch, 0.0, "metrics-sampling")
+    assert "".join(e["text"] for e in events if e["type"] == "token") == "".join(f"t{i} " for i in range(20))
+    assert span_count("llm", "stream") == stream_spans
+    assert sum(series[2] for series in STAGE_SECONDS.values.values()) == stages
+
+
+def test_sampled_turn_does_not_print_timings(monkeypatch, capsys):
+    events = run_chat(monkeypatch, 1.0, "metrics-quiet")
+    assert any(e["type"] == "timings" for e in events)
+    assert "Trace metrics-quiet" not in capsys.readouterr().out
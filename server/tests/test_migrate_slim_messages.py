@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from context_builder import format_search_results
+from migrate_slim_messages import parse_legacy_content, render_migrated
+
+
+def legacy_content(search_query, results, query):
+    block = "\n".join(format_search_results(results))
+    return f"Search Results (for query: '{search_query}'):\n{block}\n\nUser Query: {query}"
+
+
+def test_parenthesised_urls_round_trip():
+    results = [
+        {"title": "Python (programming language) - Wikipedia",
+         "url": "https://en.wikipedia.org/wiki/Python_(programming_language)",
+         "body": "Python is a high-level language (see also: CPython)."},
+        {"title": "Monty Python", "url": "https://en.wikipedia.org/wiki/Monty_Python",
+         "body": "British comedy troupe.\nFormed in 1969 (London): six members."},
+        {"title": "No link", "url": "#", "body": ""},
+    ]
+    content = legacy_content("python language", results, "what is python")
+
+    search_query, parsed, query = parse_legacy_content(content)
+    assert search_query == "python language"
+    assert query == "what is python"
+    assert [(r["title"], r["url"], r["body"]) for r in parsed] == [
+        (r["title"], r["url"], r["body"]) for r in results
+    ]
+    assert render_migrated(search_query, parsed, query) == content
+
+
+def test_content_that_does_not_round_trip_is_detected():
+    # The same URL twice is stored once, so the migrated message would render
+    # differently and must be skipped
+    results = [
+        {"title": "A", "url": "https://example.com/a", "body": "first"},
+        {"title": "A again", "url": "https://example.com/a", "body": "second"},
+    ]
+    content = legacy_content("q", results, "q")
+    parsed = parse_legacy_content(content)
+    assert parsed is not None
+    assert render_migrated(*parsed) != content
+
+
+def test_not_legacy_content():
+    assert parse_legacy_content("just a question") is None
+
+
+def test_shared_url_keeps_each_messages_excerpt():
+    pytest.importorskip("mongomock_motor")
+    import migrate_slim_messages
+    from database import conversations_collection
+    from message_store import load_sources, render_user_content, save_search_results
+
+    url = "https://example.com/shared-excerpt"
+    first = legacy_content("q1", [{"title": "Shared", "url": url, "body": "excerpt for q1"}], "q1")
+    second = legacy_content("q2", [{"title": "Shared", "url": url, "body": "excerpt for q2"}], "q2")
+
+    async def scenario():
+        await conversations_collection.insert_many([
+            {"_id": "shared-excerpt-1", "conversation_id": "shared-excerpt", "role": "user", "content": first, "timestamp": 1.0},
+            {"_id": "shared-excerpt-2", "conversation_id": "shared-excerpt", "role": "user", "content": second, "timestamp": 2.0},
+        ])
+        await migrate_slim_messages.migrate(dry_run=False, batch_size=10)
+        # A later live turn hitting the same URL must not rewrite history either
+        await save_search_results([{"title": "Changed", "url": url, "body": "excerpt for q3"}], 3.0)
+
+        messages = await conversations_collection.find({"conversation_id": "shared-excerpt"}).sort("timestamp", 1).to_list(None)
+        sources = await load_sources(messages)
+        return [render_user_content(msg, sources) for msg in messages]
+
+    assert asyncio.run(scenario()) == [first, second]
+
+
+def test_migration_skips_message_that_differs_from_stored_source():
+    from message_store import source_documents
+
+    results = [{"title": "A", "url": "https://example.com/a", "body": "original"}]
+    content = legacy_content("q", results, "q")
+    parsed = parse_legacy_content(content)
+    (source_id, document), = source_documents(parsed[1])
+    stored = {source_id: dict(document, body="something else")}
+    assert render_migrated(*parsed, stored=stored) != content
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import chat_service  # noqa: E402
+from persistence import PersistenceQueue  # noqa: E402
+
+
+def make_turn(conversation_id, timestamp):
+    return {
+        "timestamp": timestamp,
+        "search_results": [],
+        "messages": [
+            {"conversation_id": conversation_id, "role": "user", "content": "question", "timestamp": timestamp},
+            {"conversation_id": conversation_id, "role": "assistant", "content": "answer", "timestamp": timestamp + 1},
+        ],
+    }
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    # A long batch window makes the write land well after enqueue returns
+    queue = PersistenceQueue(batch_window=0.3)
+    monkeypatch.setattr(chat_service, "persistence_queue", queue)
+    return queue
+
+
+def test_read_after_write(queue):
+    async def scenario():
+        await queue.enqueue(make_turn("read-after-write", 1000.0))
+        messages = await chat_service.get_conversation_messages("read-after-write")
+        streamed = [m async for m in chat_service.iter_conversation_messages("read-after-write")]
+        await queue.stop()
+        return messages, streamed
+
+    messages, streamed = asyncio.run(scenario())
+    assert [m["role"] for m in messages] == ["user", "assistant"]
+    assert messages[0]["content"].endswith("User Query: question")
+    assert messages[1]["content"] == "answer"
+    assert streamed == messages
+
+
+def test_delete_waits_for_queued_turn(queue):
+    async def scenario():
+        await queue.enqueue(make_turn("delete-race", 2000.0))
+        deleted = await chat_service.delete_conversation("delete-race")
+        await queue.stop()
+        return deleted, await chat_service.get_conversation_messages("delete-race")
+
+    deleted, remaining = asyncio.run(scenario())
+    assert deleted
+    assert remaining == []
+
+
+def test_meta_update_is_retried_without_double_counting(queue, monkeypatch):
+    import persistence
+    from pymongo.errors import AutoReconnect
+    from database import conversations_meta_collection
+
+    update = persistence.update_conversations_meta
+    failures = []
+
+    async def flaky_update(messages):
+        if not failures:
+            failures.append(1)
+            raise AutoReconnect("primary stepped down")
+        await update(messages)
+
+    monkeypatch.setattr(persistence, "update_conversations_meta", flaky_update)
+
+    async def scenario():
+        await queue.enqueue(make_turn("meta-retry", 3000.0))
+        await queue.wait_written("meta-retry", timeout=5)
+        await queue.enqueue(make_turn("meta-retry", 3010.0))
+        await queue.stop()
+        return await conversations_meta_collection.find_one({"_id": "meta-retry"})
+
+    meta = asyncio.run(scenario())
+    assert failures and queue.retries == 1
+    assert meta["message_count"] == 4
+    assert meta["last_updated"] == 3011.0
+
+
+def test_paged_stream_waits_once(queue, monkeypatch):
+    waits = []
+    wait_written = queue.wait_written
+
+    async def counting_wait(conversation_id, timeout):
+        waits.append(conversation_id)
+        await wait_written(conversation_id, timeout)
+
+    monkeypatch.setattr(queue, "wait_written", counting_wait)
+
+    async def scenario():
+        await queue.enqueue(make_turn("paged-stream", 4000.0))
+        await queue.enqueue(make_turn("paged-stream", 4010.0))
+        page = [m async for m in chat_service.iter_conversation_messages("paged-stream", limit=3)]
+        await queue.stop()
+        return page
+
+    page = asyncio.run(scenario())
+    assert [m["timestamp"] for m in page] == [4001.0, 4010.0, 4011.0]
+    assert waits == ["paged-stream"]
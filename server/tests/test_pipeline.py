@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import pytest
+
+from pipeline import PipelineRun
+
+
+async def value_after(delay, value):
+    await asyncio.sleep(delay)
+    return value
+
+
+async def failing():
+    raise RuntimeError("boom")
+
+
+def test_stages_run_concurrently_and_report_timings():
+    async def scenario():
+        run = PipelineRun(budget=5)
+        started = time.perf_counter()
+        run.start("a", value_after(0.05, "a"))
+        run.start("b", value_after(0.05, "b"))
+        results = [await run.result("a"), await run.result("b")]
+        return results, time.perf_counter() - started, run.report()
+
+    results, elapsed, report = asyncio.run(scenario())
+    assert results == ["a", "b"]
+    assert elapsed < 0.09  # Not 0.1: the stages overlapped
+    assert {name: stage["status"] for name, stage in report["stages"].items()} == {"a": "ok", "b": "ok"}
+
+
+def test_failures_timeouts_and_budget_fall_back_to_defaults():
+    async def scenario():
+        run = PipelineRun(budget=0.1)
+        run.start("slow", value_after(1, "late"), timeout=0.02)
+        run.start("broken", failing())
+        run.start("over_budget", value_after(1, "late"))
+        return (await run.result("slow", default="d1"), await run.result("broken", default="d2"),
+                await run.result("over_budget", default="d3"), await run.result("missing", default="d4"),
+                run.report())
+
+    *defaults, report = asyncio.run(scenario())
+    assert defaults == ["d1", "d2", "d3", "d4"]
+    statuses = {name: stage["status"] for name, stage in report["stages"].items()}
+    assert statuses == {"slow": "timeout", "broken": "error", "over_budget": "timeout"}
+
+
+def test_cancel_pending_records_cancelled_stages():
+    async def scenario():
+        run = PipelineRun(budget=5)
+        run.start("done", value_after(0, "x"))
+        run.start("pending", value_after(1, "y"))
+        await run.result("done")
+        run.cancel_pending()
+        assert await run.result("pending", default=None) is None
+        return run.report()
+
+    report = asyncio.run(scenario())
+    assert report["stages"]["pending"]["status"] == "cancelled"
+
+
+def test_search_starts_before_history_is_loaded(monkeypatch):
+    pytest.importorskip("mongomock_motor")
+    import chat_service
+
+    events = []
+
+    async def embed(text):
+        return [0.1] * 8
+
+    async def recent_messages(conversation_id):
+        events.append("history requested")
+        await asyncio.sleep(0.05)
+        events.append("history loaded")
+        return []
+
+    async def search(query):
+        events.append(f"search {query}")
+        return [{"title": "T", "url": "https://example.com", "body": "b"}]
+
+    async def generate(messages):
+        return "unused"
+
+    async def stream(messages, stream_info=None, sampled=True):
+        events.append("answer")
+        yield "answer"
+
+    monkeypatch.setattr(chat_service.embedding_service, "embed", embed)
+    monkeypatch.setattr(chat_service, "get_recent_messages", recent_messages)
+    monkeypatch.setattr(chat_service.search_cache, "search", search)
+    monkeypatch.setattr(chat_service.llm_cache, "generate", generate)
+    monkeypatch.setattr(chat_service, "stream_chat_response", stream)
+
+    async def scenario():
+        result = [e async for e in chat_service.chat_pipeline("rust", "pipeline-dag")]
+        await chat_service.persistence_queue.stop()
+        return result
+
+    result = asyncio.run(scenario())
+    assert events.index("search rust") < events.index("history loaded")
+    assert events[-1] == "answer"
+    timings = next(e for e in result if e["type"] == "timings")
+    assert timings["stages"]["search_raw"]["status"] == "ok"
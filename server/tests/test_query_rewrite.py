@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+import chat_service
+
+HISTORY = [
+    {"role": "user", "content": "Who is CEO of Google?"},
+    {"role": "assistant", "content": "Sundar Pichai."},
+]
+
+
+def fake_llm(monkeypatch, response):
+    calls = []
+
+    async def generate(messages):
+        calls.append(messages)
+        return response
+
+    monkeypatch.setattr(chat_service.llm_cache, "generate", generate)
+    return calls
+
+
+def test_standalone_query_still_fans_out(monkeypatch):
+    monkeypatch.setattr(chat_service, "SEARCH_FANOUT_QUERIES", 3)
+    calls = fake_llm(monkeypatch, "Rust memory safety model\nRust borrow checker\nRust ownership rules")
+    query = "How does Rust guarantee memory safety without garbage collection"
+    assert not chat_service.needs_rewrite(query, HISTORY)
+
+    queries = asyncio.run(chat_service.generate_search_queries(query, HISTORY, rewrite=False))
+    assert queries == [query, "Rust borrow checker", "Rust ownership rules"]
+    # No history in the prompt for a standalone query
+    assert [m["role"] for m in calls[0]] == ["system", "user"]
+
+
+def test_standalone_query_without_fanout_makes_no_call(monkeypatch):
+    monkeypatch.setattr(chat_service, "SEARCH_FANOUT_QUERIES", 1)
+    calls = fake_llm(monkeypatch, "unused")
+    query = "How does Rust guarantee memory safety"
+    assert asyncio.run(chat_service.generate_search_queries(query, HISTORY, rewrite=False)) == [query]
+    assert not calls
+
+
+def test_follow_up_is_rewritten_with_history(monkeypatch):
+    monkeypatch.setattr(chat_service, "SEARCH_FANOUT_QUERIES", 3)
+    calls = fake_llm(monkeypatch, "How did Sundar Pichai become CEO\nSundar Pichai career")
+    queries = asyncio.run(chat_service.generate_search_queries("How did he get the job?", HISTORY))
+    assert queries == ["How did Sundar Pichai become CEO", "Sundar Pichai career"]
+    assert [m["role"] for m in calls[0]] == ["system", "user", "assistant", "user"]
+
+
+def run_pipeline(monkeypatch, llm_delay, query, conversation_id, history=HISTORY,
+                 response="ignored\nRust borrow checker"):
+    """Runs one turn with `history` as the recent messages; returns the
+    searched queries and the sources event."""
+    monkeypatch.setattr(chat_service, "SEARCH_FANOUT_QUERIES", 3)
+    searched = []
+
+    async def generate(messages):
+        await asyncio.sleep(llm_delay)
+        return response
+
+    async def embed(text):
+        return [0.1] * 8
+
+    async def recent_messages(conversation_id):
+        return [dict(m, _id=f"{conversation_id}-{i}", timestamp=float(i)) for i, m in enumerate(history)]
+
+    async def search(queries):
+        searched.append(queries)
+        return [{"title": str(queries), "url": f"https://example.com/{len(searched)}", "body": ""}]
+
+    async def stream(messages, stream_info=None, sampled=True):
+        yield "answer"
+
+    monkeypatch.setattr(chat_service.llm_cache, "generate", generate)
+    monkeypatch.setattr(chat_service.embedding_service, "embed", embed)
+    monkeypatch.setattr(chat_service, "get_recent_messages", recent_messages)
+    monkeypatch.setattr(chat_service.search_cache, "search", search)
+    monkeypatch.setattr(chat_service, "stream_chat_response", stream)
+
+    async def scenario():
+        events = [e async for e in chat_service.chat_pipeline(query, conversation_id)]
+        await chat_service.persistence_queue.stop()
+        return events
+
+    events = asyncio.run(scenario())
+    return searched, next(e for e in events if e["type"] == "sources")
+
+
+def test_pipeline_fans_out_standalone_query_alongside_search(monkeypatch):
+    query = "How does Rust guarantee memory safety without garbage collection"
+    searched, sources = run_pipeline(monkeypatch, 0.0, query, "parallel-fanout")
+    # The query as typed is searched once, the sub-query separately
+    assert searched.count(query) == 1
+    assert ["Rust borrow checker"] in searched
+    assert len(sources["sources"]) == 2
+    assert sources["search_query"] == query
+
+
+def test_slow_fanout_never_blocks_standalone_search(monkeypatch):
+    monkeypatch.setitem(chat_service.STAGE_TIMEOUTS, "contextualize", 0.1)
+    query = "How does Rust guarantee memory safety without garbage collection"
+    started = time.perf_counter()
+    searched, sources = run_pipeline(monkeypatch, 2.0, query, "slow-fanout")
+    assert time.perf_counter() - started < 1.0
+    assert searched == [query]
+    assert [s["title"] for s in sources["sources"]] == [query]
+
+
+def test_unchanged_rewrite_is_not_searched_twice(monkeypatch):
+    query = "what about it"
+    searched, _ = run_pipeline(monkeypatch, 0.0, query, "unchanged-rewrite",
+                               response=f"{query}\nRust borrow checker")
+    assert sorted(map(str, searched)) == sorted([query, str(["Rust borrow checker"])])
+
+
+def test_first_turn_does_not_wait_for_fanout(monkeypatch):
+    monkeypatch.setitem(chat_service.STAGE_TIMEOUTS, "contextualize", 0.1)
+    monkeypatch.setattr(chat_service, "REWRITE_PRECHECK", False)
+    decisions = chat_service.metrics.QUERY_REWRITES.values
+    before = decisions.get(("skipped_parallel_fanout",), 0)
+    query = "what about it"
+    searched, _ = run_pipeline(monkeypatch, 2.0, query, "first-turn", history=[])
+    assert searched == [query]
+    # Nothing to rewrite against: fan-out ran alongside search, not before it
+    assert decisions.get(("skipped_parallel_fanout",), 0) == before + 1
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, Upstream, UpstreamError
+
+POLICY = {
+    "timeout": 1.0,
+    "retries": 0,
+    "backoff_base": 0.0,
+    "backoff_max": 0.0,
+    "hedge": False,
+    "hedge_min_delay": 0.0,
+    "hedge_default_delay": 1.0,
+    "breaker_failures": 2,
+    "breaker_reset": 0.05,
+}
+
+
+def test_breaker_state_machine():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.state == "closed" and breaker.allow()
+
+    assert not breaker.record_failure()
+    assert breaker.record_failure()  # Threshold reached
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow()  # The single trial call
+    assert not breaker.allow()
+
+    assert breaker.record_failure()  # Failed trial reopens
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()
+
+
+def test_cancelled_trial_frees_half_open_slot():
+    upstream = Upstream("test", POLICY)
+
+    async def fail():
+        raise UpstreamError("unavailable", 503)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await upstream.call(fail)
+        with pytest.raises(CircuitOpenError):
+            await upstream.call(ok)
+
+        await asyncio.sleep(0.06)
+        trial = asyncio.ensure_future(upstream.call(hang))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        # Neither success nor failure: still half open, next call is the trial
+        assert upstream.breaker.state == "half_open"
+        assert upstream.breaker.failures == 2
+        assert await upstream.call(ok) == "ok"
+        assert upstream.breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_stream_trial_frees_half_open_slot(monkeypatch):
+    import llm_client
+    import resilience
+
+    monkeypatch.setattr(llm_client, "OPENROUTER_API_KEY", "test")
+    monkeypatch.setattr(llm_client, "LLM_FALLBACK_MODEL", None)
+    upstream = Upstream("openrouter:test", POLICY)
+    monkeypatch.setitem(resilience._upstreams, f"openrouter:{llm_client.LLM_MODEL}:stream", upstream)
+
+    async def hanging_stream(model, messages, stream_info, timeout, sampled=True):
+        await asyncio.sleep(10)
+        yield "never"
+
+    monkeypatch.setattr(llm_client, "_stream_once", hanging_stream)
+
+    async def consume():
+        async for _ in llm_client.stream_chat_response([{"role": "user", "content": "hi"}]):
+            pass
+
+    async def scenario():
+        upstream.breaker.record_failure()
+        upstream.breaker.record_failure()
+        await asyncio.sleep(0.06)
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.01)
+        assert upstream.breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not upstream.breaker.trial_in_flight
+        assert upstream.breaker.allow()
+
+    asyncio.run(scenario())
+
+
+def test_summaries_are_not_hedged_and_keep_their_own_latency(monkeypatch):
+    import llm_client
+    import resilience
+
+    monkeypatch.setattr(llm_client, "OPENROUTER_API_KEY", "test")
+    monkeypatch.setattr(llm_client, "LLM_FALLBACK_MODEL", None)
+    monkeypatch.setattr(resilience, "_upstreams", {})
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setitem(resilience.UPSTREAM_POLICIES, "openrouter",
+                        dict(POLICY, hedge=True, hedge_default_delay=0.01))
+    calls = []
+
+    async def slow_generate(model, messages, timeout, operation="generate"):
+        calls.append(operation)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    monkeypatch.setattr(llm_client, "_generate_once", slow_generate)
+
+    async def scenario():
+        messages = [{"role": "user", "content": "hi"}]
+        assert await llm_client.generate_chat_response(messages, operation="summarize", hedge=False) == "ok"
+        assert calls == ["summarize"]
+        assert await llm_client.generate_chat_response(messages) == "ok"
+        assert calls == ["summarize", "generate", "generate"]  # Short calls still hedge
+
+    asyncio.run(scenario())
+    summarize = resilience._upstreams[f"openrouter:{llm_client.LLM_MODEL}:summarize"]
+    generate = resilience._upstreams[f"openrouter:{llm_client.LLM_MODEL}:generate"]
+    assert summarize.hedged == 0 and generate.hedged == 1
+    assert summarize.breaker is generate.breaker
@@ -0,0 +1,108 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip("mongomock_motor")
+import retriever  # noqa: E402
+from database import conversations_collection  # noqa: E402
+from retriever import AtlasRetriever, FallbackRetriever, LocalRetriever  # noqa: E402
+
+DIM = 16
+
+
+def make_messages(conversation_id, count, seed):
+    rng = np.random.default_rng(seed)
+    return [{
+        "_id": f"{conversation_id}-{i}",
+        "conversation_id": conversation_id,
+        "role": "user" if i % 2 == 0 else "assistant",
+        "content": f"message {i}",
+        "timestamp": float(i),
+        "embedding": rng.standard_normal(DIM).tolist(),
+    } for i in range(count)]
+
+
+def exact_top_k(messages, query, k):
+    """What Atlas' exact cosine search returns: (id, (1 + cos) / 2), best first."""
+    query = np.asarray(query) / np.linalg.norm(query)
+    scored = []
+    for message in messages:
+        vector = np.asarray(message["embedding"])
+        scored.append((message["_id"], (1.0 + float(vector @ query / np.linalg.norm(vector))) / 2.0))
+    return sorted(scored, key=lambda item: -item[1])[:k]
+
+
+def assert_same_ranking(found, expected):
+    assert [m["_id"] for m in found] == [item[0] for item in expected]
+    assert np.allclose([m["score"] for m in found], [item[1] for item in expected], atol=1e-5)
+
+
+def test_local_top_k_matches_exact_search_over_mongo():
+    messages = make_messages("retriever-parity", 200, seed=1)
+    other = make_messages("retriever-other", 50, seed=2)
+    local = LocalRetriever()
+
+    async def scenario():
+        await conversations_collection.insert_many(messages + other)
+        queries = np.random.default_rng(3).standard_normal((5, DIM))
+        return [(q, await local.search("retriever-parity", q.tolist(), 5)) for q in queries]
+
+    for query, found in asyncio.run(scenario()):
+        assert_same_ranking(found, exact_top_k(messages, query, 5))
+        assert set(found[0]) == {"_id", "role", "content", "timestamp", "score"}
+    assert local.loads == 1  # Loaded once, then served from memory
+
+
+def test_hnsw_index_matches_exact_search(monkeypatch):
+    pytest.importorskip("hnswlib")
+    monkeypatch.setattr(retriever, "LOCAL_INDEX_HNSW_THRESHOLD", 100)
+    messages = make_messages("retriever-hnsw", 300, seed=4)
+    local = LocalRetriever()
+
+    async def scenario():
+        await conversations_collection.insert_many(messages)
+        query = np.random.default_rng(5).standard_normal(DIM)
+        return query, await local.search("retriever-hnsw", query.tolist(), 10)
+
+    query, found = asyncio.run(scenario())
+    assert local.stats()["hnsw_indexes"] == 1
+    assert_same_ranking(found, exact_top_k(messages, query, 10))
+
+
+def test_new_messages_are_indexed_and_evict_reloads():
+    messages = make_messages("retriever-updates", 10, seed=6)
+    local = LocalRetriever()
+    extra = make_messages("retriever-updates-new", 11, seed=7)[10]
+    extra["conversation_id"] = "retriever-updates"
+
+    async def scenario():
+        await conversations_collection.insert_many(messages)
+        await local.search("retriever-updates", extra["embedding"], 3)
+        local.add_messages([extra])  # As persistence does after a write
+        found = await local.search("retriever-updates", extra["embedding"], 3)
+        local.evict("retriever-updates")
+        after_evict = await local.search("retriever-updates", extra["embedding"], 3)
+        return found, after_evict
+
+    found, after_evict = asyncio.run(scenario())
+    assert found[0]["_id"] == extra["_id"]
+    assert local.loads == 2
+    # Not in Mongo, so gone after the reload
+    assert extra["_id"] not in [m["_id"] for m in after_evict]
+
+
+def test_fallback_uses_local_index_while_atlas_is_unavailable():
+    messages = make_messages("retriever-fallback", 20, seed=8)
+    fallback = FallbackRetriever(AtlasRetriever(), LocalRetriever(), retry_seconds=60)
+
+    async def scenario():
+        await conversations_collection.insert_many(messages)
+        # mongomock has no $vectorSearch, like a local MongoDB
+        query = messages[0]["embedding"]
+        return await fallback.search("retriever-fallback", query, 3), await fallback.search("retriever-fallback", query, 3)
+
+    first, second = asyncio.run(scenario())
+    assert first[0]["_id"] == messages[0]["_id"] and first == second
+    assert fallback.fallback_searches == 2
+    assert not fallback.stats()["primary_available"]
@@ -0,0 +1,116 @@
+import asyncio
+
+import search_cache
+from search_cache import SearchCache
+
+
+class FakeSearch:
+    def __init__(self, delay=0.0, results=True):
+        self.calls = []
+        self.delay = delay
+        self.results = results
+
+    async def __call__(self, query):
+        self.calls.append(query)
+        await asyncio.sleep(self.delay)
+        return [{"title": str(query), "url": "https://example.com", "body": ""}] if self.results else []
+
+
+def test_ttl_and_normalized_keys(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(search_cache.time, "time", lambda: now[0])
+    search = FakeSearch()
+    cache = SearchCache(search, ttl=60, max_entries=10)
+
+    async def scenario():
+        await cache.search("What is Rust?")
+        await cache.search("  what is   rust ")  # Same normalized key
+        now[0] += 61
+        await cache.search("what is rust")
+
+    asyncio.run(scenario())
+    assert search.calls == ["What is Rust?", "what is rust"]
+    assert cache.hits == 1 and cache.misses == 2
+
+
+def test_concurrent_identical_queries_share_one_call():
+    search = FakeSearch(delay=0.05)
+    cache = SearchCache(search, ttl=60, max_entries=10)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.search("rust") for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(search.calls) == 1
+    assert all(r == results[0] for r in results)
+    assert cache.misses == 1 and cache.coalesced == 4
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    search = FakeSearch(delay=0.05)
+    cache = SearchCache(search, ttl=60, max_entries=10)
+
+    async def scenario():
+        first = asyncio.ensure_future(cache.search("rust"))
+        second = asyncio.ensure_future(cache.search("rust"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario())[0]["title"] == "rust"
+    assert len(search.calls) == 1
+
+
+def test_empty_results_are_not_cached_and_lru_evicts():
+    failing = FakeSearch(results=False)
+    cache = SearchCache(failing, ttl=60, max_entries=10)
+
+    async def failures():
+        await cache.search("rust")
+        await cache.search("rust")
+
+    asyncio.run(failures())
+    assert len(failing.calls) == 2
+
+    search = FakeSearch()
+    cache = SearchCache(search, ttl=60, max_entries=2)
+
+    async def evictions():
+        for query in ("a", "b", "a", "c", "a", "b"):
+            await cache.search(query)
+
+    asyncio.run(evictions())
+    # "b" was least recently used when "c" arrived
+    assert search.calls == ["a", "b", "c", "b"]
+
+
+def test_batches_are_cached_as_one_entry():
+    search = FakeSearch()
+    cache = SearchCache(search, ttl=60, max_entries=10)
+
+    async def scenario():
+        await cache.search(["Rust", "borrow checker"])
+        await cache.search(["rust", "Borrow checker?"])
+        await cache.search(["borrow checker", "rust"])  # Order matters
+
+    asyncio.run(scenario())
+    assert len(search.calls) == 2
+
+
+def test_semantic_hits():
+    vectors = {"rust memory safety": [1.0, 0.0], "memory safety in rust": [0.99, 0.1], "python": [0.0, 1.0]}
+
+    async def embed(text):
+        return vectors[text]
+
+    search = FakeSearch()
+    cache = SearchCache(search, ttl=60, max_entries=10, embed_fn=embed, semantic_threshold=0.95)
+
+    async def scenario():
+        await cache.search("rust memory safety")
+        await cache.search("memory safety in rust")
+        await cache.search("python")
+
+    asyncio.run(scenario())
+    assert search.calls == ["rust memory safety", "python"]
+    assert cache.semantic_hits == 1
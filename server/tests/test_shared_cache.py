@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+import shared_cache
+from shared_cache import MemoryBackend, SharedCache
+
+
+def test_memory_backend_ttl_lru_and_locks(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(shared_cache.time, "monotonic", lambda: now[0])
+    backend = MemoryBackend(max_entries=2)
+
+    async def scenario():
+        await backend.set("a", b"1", ttl=10)
+        await backend.set("b", b"2", ttl=10)
+        assert await backend.get("a") == b"1"  # a is now most recent
+        await backend.set("c", b"3", ttl=10)
+        assert await backend.get("b") is None
+        now[0] += 11
+        assert await backend.get("a") is None
+
+        token = await backend.acquire("lock", ttl=5)
+        assert token and await backend.acquire("lock", ttl=5) is None
+        await backend.release("lock", "not-the-owner")
+        assert await backend.locked("lock")
+        now[0] += 6  # Expired locks can be taken over
+        second = await backend.acquire("lock", ttl=5)
+        assert second and second != token
+        await backend.release("lock", token)  # Stale owner cannot release it
+        assert await backend.locked("lock")
+        await backend.release("lock", second)
+        assert not await backend.locked("lock")
+
+    asyncio.run(scenario())
+
+
+def test_only_one_worker_computes_a_key():
+    # Two caches on one backend stand in for two workers
+    backend = MemoryBackend()
+    workers = [SharedCache(backend, "search", ttl=60, poll_interval=0.01) for _ in range(2)]
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["result"]
+
+    async def scenario():
+        return await asyncio.gather(*(w.get_or_compute("q", compute, bool) for w in workers))
+
+    (first, first_shared), (second, second_shared) = asyncio.run(scenario())
+    assert calls == [1]
+    assert first == second == ["result"]
+    assert (first_shared, second_shared) == (False, True)
+    assert workers[1].waited == 1
+
+
+def test_uncacheable_result_lets_the_waiter_compute():
+    backend = MemoryBackend()
+    workers = [SharedCache(backend, "llm", ttl=60, poll_interval=0.01) for _ in range(2)]
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "" if len(calls) == 1 else "answer"
+
+    async def scenario():
+        return await asyncio.gather(*(w.get_or_compute("k", compute, bool) for w in workers))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert sorted(value for value, _ in results) == ["", "answer"]
+
+
+def test_backend_errors_fail_open():
+    class BrokenBackend(MemoryBackend):
+        async def get(self, key):
+            raise ConnectionError("backend down")
+
+        async def acquire(self, key, ttl):
+            raise ConnectionError("backend down")
+
+    cache = SharedCache(BrokenBackend(), "search", ttl=60)
+
+    async def compute():
+        return ["result"]
+
+    assert asyncio.run(cache.get_or_compute("q", compute, bool)) == (["result"], False)
+    assert cache.errors >= 2
+
+
+def test_redis_backend_locks_and_values():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis needs it for the release script
+    pytest.importorskip("redis")
+    backend = shared_cache.RedisBackend(prefix="test:")
+    backend.client = fakeredis.FakeAsyncRedis()
+
+    async def scenario():
+        await backend.set("k", b"v", ttl=10)
+        assert await backend.get("k") == b"v"
+        assert await backend.client.get("test:k") == b"v"
+        token = await backend.acquire("lock", ttl=10)
+        assert token and await backend.acquire("lock", ttl=10) is None
+        await backend.release("lock", "other")
+        assert await backend.locked("lock")
+        await backend.release("lock", token)
+        assert not await backend.locked("lock")
+        await backend.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,40 @@
+import json
+
+from sse_parser import DONE, SSEParser, parse_delta
+
+
+def chunk(content, finish_reason=None, usage=None):
+    payload = {"choices": [{"delta": {"content": content}, "finish_reason": finish_reason}]}
+    if usage is not None:
+        payload["usage"] = usage
+    return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+
+def test_events_split_across_chunks_and_multibyte_characters():
+    stream = chunk("héllo ") + b": OPENROUTER PROCESSING\n\n" + chunk("wörld", "stop") + b"data: [DONE]\n\n"
+    parser = SSEParser()
+    events = []
+    # One byte at a time splits lines, CR/LF pairs and UTF-8 sequences
+    for i in range(len(stream)):
+        events.extend(parser.feed(stream[i:i + 1]))
+    assert events[-1] == DONE
+    deltas = [parse_delta(e) for e in events[:-1]]
+    assert "".join(d.content for d in deltas) == "héllo wörld"
+    assert deltas[-1].finish_reason == "stop"
+
+
+def test_crlf_multiline_data_and_other_fields():
+    parser = SSEParser()
+    events = parser.feed(b"event: message\r\nid: 7\r\ndata: first\r\ndata:second\r\n\r\ndata: tail")
+    assert events == [b"first\nsecond"]
+    assert parser.feed(b"\n\n") == [b"tail"]
+
+
+def test_parse_delta_fields():
+    usage = {"prompt_tokens": 3, "completion_tokens": 2}
+    delta = parse_delta(chunk("", "length", usage)[len(b"data: "):-2])
+    assert delta.content == "" and delta.finish_reason == "length" and delta.usage == usage
+    # Usage-only chunk without choices
+    assert parse_delta(b'{"choices": [], "usage": {"prompt_tokens": 1}}').usage == {"prompt_tokens": 1}
+    assert parse_delta(b"not json") is None
+    assert parse_delta(b"[1, 2]") is None
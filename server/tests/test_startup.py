@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+import main
+from startup import Startup
+
+
+def test_ready_waits_for_warmup(monkeypatch):
+    startup = Startup()
+    monkeypatch.setattr(main, "startup", startup)
+    monkeypatch.setattr(main, "EMBEDDING_WARMUP", True)
+    monkeypatch.setattr(main, "STARTUP_BACKGROUND_LOADING", True)
+
+    async def scenario():
+        warmed = asyncio.Event()
+
+        async def load():
+            pass
+
+        async def warmup():
+            await warmed.wait()
+
+        monkeypatch.setattr(main.embedding_service, "load", load)
+        monkeypatch.setattr(main.embedding_service, "warmup", warmup)
+        async with main.lifespan(main.app):
+            await asyncio.sleep(0.05)
+            assert startup.phases["embedding_model"]["status"] == "ok"
+            assert not startup.ready
+            warmed.set()
+            await asyncio.sleep(0.01)
+            assert startup.ready
+
+    asyncio.run(scenario())
+
+
+def test_tokenizer_loads_off_the_event_loop(monkeypatch):
+    startup = Startup()
+    monkeypatch.setattr(main, "startup", startup)
+    monkeypatch.setattr(main, "EMBEDDING_WARMUP", False)
+    monkeypatch.setattr(main, "STARTUP_BACKGROUND_LOADING", True)
+    loaded = threading.Event()
+    threads = []
+
+    def load_tokenizer():
+        threads.append(threading.current_thread())
+        loaded.wait(1)
+        return True
+
+    async def load():
+        pass
+
+    monkeypatch.setattr(main, "load_tokenizer", load_tokenizer)
+    monkeypatch.setattr(main.embedding_service, "load", load)
+
+    async def scenario():
+        async with main.lifespan(main.app):
+            await asyncio.sleep(0.05)
+            assert startup.phases["embedding_model"]["status"] == "ok"
+            assert not startup.ready  # Still loading the tokenizer
+            loaded.set()
+            await asyncio.sleep(0.05)
+            assert startup.ready
+
+    asyncio.run(scenario())
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_failed_model_load_is_retried_until_ready(monkeypatch):
+    startup = Startup()
+    monkeypatch.setattr(main, "startup", startup)
+    monkeypatch.setattr(main, "EMBEDDING_WARMUP", True)
+    monkeypatch.setattr(main, "STARTUP_BACKGROUND_LOADING", True)
+    monkeypatch.setattr(main, "STARTUP_RETRY_DELAY", 0.01)
+    attempts = []
+
+    async def load():
+        pass
+
+    async def warmup():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("session init failed")
+
+    monkeypatch.setattr(main.embedding_service, "load", load)
+    monkeypatch.setattr(main.embedding_service, "warmup", warmup)
+
+    async def scenario():
+        async with main.lifespan(main.app):
+            for _ in range(100):
+                if startup.ready:
+                    break
+                await asyncio.sleep(0.01)
+            assert startup.ready
+            assert startup.phases["embedding_warmup"]["status"] == "ok"
+
+    asyncio.run(scenario())
+    assert len(attempts) == 2
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from streaming import coalesce_tokens, encode_stream, negotiate_format
+
+
+async def token_source(tokens, delay=0.0, tail=()):
+    for token in tokens:
+        if delay:
+            await asyncio.sleep(delay)
+        yield {"type": "token", "text": token}
+    for event in tail:
+        yield event
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_tokens_coalesce_by_bytes_and_flush_before_other_events():
+    sources = {"type": "sources", "search_query": "q", "sources": []}
+    events = asyncio.run(collect(coalesce_tokens(
+        token_source(["ab", "cd", "ef", "gh"], tail=[sources]), window_ms=1000, max_bytes=4)))
+    assert events == [
+        {"type": "token", "text": "abcd"},
+        {"type": "token", "text": "efgh"},
+        sources,
+    ]
+
+
+def test_tokens_flush_when_the_window_expires():
+    events = asyncio.run(collect(coalesce_tokens(token_source(["a", "b", "c"], delay=0.05),
+                                                 window_ms=10, max_bytes=1000)))
+    # Tokens arrive slower than the window, so none are held back
+    assert [e["text"] for e in events] == ["a", "b", "c"]
+
+
+def test_sse_framing():
+    tail = [{"type": "usage", "usage": {"completion_tokens": 2}, "finish_reason": "stop"}]
+    chunks = asyncio.run(collect(encode_stream(token_source(["hi", " there"], tail=tail), "sse", "c1")))
+    body = "".join(chunks)
+    frames = body.split("\n\n")
+    assert frames[-1] == ""  # Every frame ends with a blank line
+    parsed = []
+    for frame in frames[:-1]:
+        event_line, data_line = frame.split("\n")
+        assert event_line.startswith("event: ") and data_line.startswith("data: ")
+        parsed.append((event_line[7:], json.loads(data_line[6:])))
+    assert parsed[0] == ("meta", {"conversation_id": "c1"})
+    assert parsed[-1] == ("done", {})
+    assert "".join(data["text"] for name, data in parsed if name == "token") == "hi there"
+    assert ("usage", {"usage": {"completion_tokens": 2}, "finish_reason": "stop"}) in parsed
+
+
+def test_ndjson_and_text_framing():
+    tail = [{"type": "error", "message": "Upstream failed"}]
+    ndjson = asyncio.run(collect(encode_stream(token_source(["a", "b"], tail=tail), "ndjson", "c2")))
+    lines = [json.loads(line) for line in "".join(ndjson).splitlines()]
+    assert [line["type"] for line in lines] == ["meta", "token", "error", "done"]
+    text = asyncio.run(collect(encode_stream(token_source(["a", "b"], tail=tail), "text", "c2")))
+    assert "".join(text) == "abUpstream failed"
+
+
+def test_disconnect_closes_the_pipeline():
+    closed = []
+
+    async def pipeline():
+        try:
+            for i in range(100):
+                await asyncio.sleep(0.01)
+                yield {"type": "token", "text": str(i)}
+        finally:
+            closed.append(True)
+
+    async def disconnected():
+        return True
+
+    chunks = asyncio.run(collect(encode_stream(pipeline(), "sse", "c3", is_disconnected=disconnected)))
+    assert len(chunks) == 1  # Only the meta event went out
+    assert closed == [True]
+
+
+def test_negotiate_format():
+    assert negotiate_format("ndjson", "text/event-stream") == "ndjson"
+    assert negotiate_format(None, "text/event-stream") == "sse"
+    assert negotiate_format(None, "application/x-ndjson") == "ndjson"
+    assert negotiate_format("bogus", "*/*") == "text"